@@ -18,6 +18,7 @@ from ._internal.client import mark_recv as mark_recv
 from ._internal.config import jconfig as jconfig
 
 # context
+from ._internal.context import MsgKind as MsgKind
 from ._internal.context import ctx as ctx
 
 # contrib
@@ -35,7 +36,11 @@ from ._internal.log import logger as logger
 # mahiro
 from ._internal.mahiro import Mahiro as Mahiro
 
+# metrics
+from ._internal.metrics import metrics as metrics
+
 # receiver
+from ._internal.receiver import no_session as no_session
 from ._internal.receiver import start_session as start_session
 
 # schedule
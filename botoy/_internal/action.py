@@ -1,19 +1,31 @@
 import asyncio
 import base64 as _base64
 import re
-from typing import Any, List, Optional, Tuple, TypeVar, Union
+import time
+import weakref
+from typing import Any, Dict, List, Optional, Tuple, TypeVar, Union
 from urllib.parse import urlparse
 
 import httpx
 from pydantic import BaseModel
 
-from .utils import get_image_size
+from .utils import (
+    IMAGE_HEADER_SIZE,
+    get_image_size,
+    image_format,
+    probe_image_size,
+)
 
 T = TypeVar("T")
 
+from . import jsonlib
+from .cache import SingleFlight, get_upload_cache
 from .config import jconfig
 from .context import GroupMsg
 from .log import logger
+from .members import GroupMembers, get_member_directory
+from .metrics import ACTION_ERRORS, ACTION_REQUESTS, ACTION_SECONDS, metrics
+from .throttle import SendScheduler, get_scheduler
 
 
 class BaseResponse(BaseModel):
@@ -26,9 +38,6 @@ class Response(BaseModel):
     ResponseData: Any
 
 
-lock = asyncio.Lock()
-
-
 def get_base_url(url):
     if not re.match(r"^(http|https|ws|wss)://", url):
         url = "http://" + url
@@ -58,29 +67,193 @@ def add_image(
     images.append(item)
 
 
+def _image_size(data: Union[bytes, str]) -> Optional[Tuple[int, int]]:
+    try:
+        return get_image_size(data)
+    except Exception:
+        return None
+
+
+def _image_size_from_base64(b64: str) -> Optional[Tuple[int, int]]:
+    try:
+        # 先只解码开头部分解析文件头
+        head = _base64.b64decode(b64[: IMAGE_HEADER_SIZE // 3 * 4])
+        if size := probe_image_size(head):
+            return size
+        return _image_size(_base64.b64decode(b64))
+    except ValueError:
+        return None
+
+
+def _observe_request(
+    funcname: str, payload: Optional[dict], code: Optional[int], elapsed: float
+):
+    """记录接口请求指标
+    :param code: ``CgiBaseResponse.Ret``, 请求失败时为None
+    """
+    cmd = (payload or {}).get("CgiCmd") or funcname
+    ACTION_SECONDS.labels(cmd).observe(elapsed)
+    if code is None:
+        ACTION_ERRORS.labels(cmd).inc()
+    else:
+        ACTION_REQUESTS.labels(cmd, code).inc()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # type: ignore # pylint: disable=W0611
+    except ImportError:
+        return False
+    return True
+
+
+# 只读查询的并发合并, 所有实例共用, 见``Action._query``
+_queries = SingleFlight()
+
+# 共享实例 {事件循环: {(base_url, qq): Action}}
+# httpx 的连接池绑定事件循环，所以按事件循环分开存储
+_shared_actions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+# 机器人QQ => 所在服务端地址，由``Botoy``的各个连接登记
+# 连接了多个服务端时，未指定地址的``Action``根据机器人QQ选择服务端
+_bot_urls: Dict[int, str] = {}
+
+
+def set_bot_url(qq: int, url: str):
+    """登记机器人所在的服务端地址"""
+    _bot_urls[int(qq)] = get_base_url(url)
+
+
+def get_bot_url(qq: Optional[int]) -> str:
+    """机器人所在的服务端地址，未登记时为配置中的``url``"""
+    return _bot_urls.get(int(qq or 0)) or get_base_url(jconfig.url)
+
+
+async def _close_actions(actions: dict):
+    for action in actions.values():
+        await action.c.aclose()
+
+
+async def close_shared_actions(current_only: bool = False):
+    """关闭共享实例
+
+    当前事件循环中的实例直接关闭；其他线程中正在运行的事件循环中的实例提交到对应的事件循环关闭；
+    其他事件循环中的实例无法关闭，只移除引用
+    :param current_only: 只关闭当前事件循环中的实例
+    """
+    current = asyncio.get_running_loop()
+    if current_only:
+        await _close_actions(_shared_actions.pop(current, {}))
+        return
+    for loop, actions in list(_shared_actions.items()):
+        _shared_actions.pop(loop, None)
+        if loop is current:
+            await _close_actions(actions)
+        elif loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(_close_actions(actions), loop)
+
+
 class Action:
     def __init__(
         self,
         qq: Optional[int] = None,
         url: Optional[str] = None,
         timeout: int = 20,
+        http2: Optional[bool] = None,
     ):
-        self.base_url = get_base_url(url or jconfig.url)
+        """
+        :param qq: 机器人QQ
+        :param url: 机器人服务端地址
+        :param timeout: 等待接口响应的超时时间
+        :param http2: 是否启用HTTP/2, 需要安装 h2, 默认读取配置 action.http2
+        """
+        self.base_url = get_base_url(url) if url else get_bot_url(qq or jconfig.qq)
         self._qq = int(qq or jconfig.qq or 0)
+        self._scheduler: Optional[SendScheduler] = None
+        self._shared = False
+
+        config = jconfig.get_configuration("action")
+        # 发送多张图片时同时上传的数量
+        self.upload_concurrency = max(1, config.get("upload_concurrency", 4))
+        # 与服务端共享文件系统，发送本地文件时直接上传路径
+        self.shared_fs = bool(config.get("shared_fs", False))
+        # 只读查询结果的缓存时间 {方法名: 秒}, 默认只合并并发请求不缓存
+        self.query_ttl = jconfig.get_configuration("action.query_ttl")
+        # 同时进行的请求数上限，默认与保持的连接数一致
+        # 大量请求在 httpx 连接池中排队时，连接池的调度开销随排队数成倍增加
+        max_keepalive = config.get("max_keepalive_connections", 20)
+        self.max_inflight = config.get("max_inflight", max_keepalive)
+        # (事件循环, 信号量)
+        self._slots: Optional[Tuple[Any, asyncio.Semaphore]] = None
+        if http2 is None:
+            http2 = bool(config.get("http2", False))
+        if http2 and not _http2_available():
+            logger.warning("未安装 h2, 无法启用HTTP/2: pip install httpx[http2]")
+            http2 = False
 
         self.c = httpx.AsyncClient(
             headers={"Content-Type": "application/json"},
             timeout=timeout + 5,
             base_url=self.base_url,
             params={"timeout": timeout},
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=config.get("max_connections", 100),
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=config.get("keepalive_expiry", 60),
+            ),
         )
 
+    @classmethod
+    def shared(cls, qq: Optional[int] = None, url: Optional[str] = None) -> "Action":
+        """获取共享实例，相同(url, qq)在同一事件循环中复用同一个实例和连接池
+        共享实例无需也不会被``close``或``async with``关闭，由``Botoy.disconnect``统一关闭,
+        ``sync_run``新建的事件循环中的共享实例在事件循环结束前关闭
+        只能在异步环境中调用
+        :param qq: 机器人QQ
+        :param url: 机器人服务端地址
+        """
+        qq = int(qq or jconfig.qq or 0)
+        key = (get_base_url(url) if url else get_bot_url(qq), qq)
+        actions = _shared_actions.setdefault(asyncio.get_running_loop(), {})
+        action = actions.get(key)
+        if action is None or action.c.is_closed:
+            action = actions[key] = cls(qq=key[1], url=key[0])
+            action._shared = True
+        return action
+
     @property
     async def qq(self) -> int:
         if self._qq == 0:
             self._qq = (await self.getAllBots())[0]
         return int(self._qq)
 
+    async def _query(self, name: str, factory, *args, per_bot: bool = True):
+        """只读查询，相同的并发请求只发送一次，可按方法名配置结果缓存时间
+        :param name: 方法名
+        :param factory: 实际发送请求的协程函数, 参数为发送请求使用的实例
+        :param args: 请求参数，作为区分请求的键
+        :param per_bot: 结果是否与机器人相关
+        """
+        qq = await self.qq if per_bot else 0
+        key = (self.base_url, qq, name, args)
+        # 合并的请求由共享实例发送，发起请求的实例被关闭时不影响其他等待结果的调用者
+        action = self if self._shared else Action.shared(self._qq, self.base_url)
+        return await _queries.do(
+            key, lambda: factory(action), self.query_ttl.get(name, 0)
+        )
+
+    @staticmethod
+    def query_stats() -> dict:
+        """只读查询的合并统计"""
+        return _queries.stats()
+
+    @staticmethod
+    def clear_query_cache():
+        """清除只读查询的缓存结果"""
+        _queries.clear()
+
     def set_url(self, url):
         self.base_url = get_base_url(url)
         self.c.base_url = self.base_url
@@ -88,7 +261,17 @@ class Action:
     def set_qq(self, qq: int):
         self._qq = qq
 
+    def set_scheduler(self, scheduler: SendScheduler):
+        """设置该实例使用的出站调度器，默认使用全局调度器(见``throttle``模块)"""
+        self._scheduler = scheduler
+
+    @property
+    def scheduler(self) -> SendScheduler:
+        return self._scheduler or get_scheduler()
+
     async def close(self):
+        if self._shared:
+            return
         return await self.c.aclose()
 
     #
@@ -97,8 +280,19 @@ class Action:
 
     #
     async def __aexit__(self, *args):
+        if self._shared:
+            return
         return await self.c.__aexit__(*args)
 
+    def _request_slots(self) -> Optional[asyncio.Semaphore]:
+        if not self.max_inflight:
+            return None
+        # Semaphore 绑定事件循环
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots[0] is not loop:
+            self._slots = (loop, asyncio.Semaphore(self.max_inflight))
+        return self._slots[1]
+
     def build_request(self, request, cmd="MessageSvc.PbSendMsg") -> dict:
         return {"CgiCmd": cmd, "CgiRequest": request}
 
@@ -131,6 +325,7 @@ class Action:
         text: str = "",
         url: Union[str, List[str]] = "",
         base64: Union[str, List[str]] = "",
+        path: Union[str, List[str]] = "",
         # md5: Union[str, List[str]] = '',
     ):
         """发送好友图片消息
@@ -138,6 +333,7 @@ class Action:
         :param text: 发送文字内容
         :param url: 发送图片链接, 可以使用列表发送多张图片
         :param base64: 发送图片base64, 可以使用列表发送多张图片
+        :param path: 发送图片文件路径，需要和服务端在同一个文件系统中, 可以使用列表发送多张图片
         """
         # :param md5: 发送图片md5或md5列表, 可以为列表
         req = {
@@ -148,27 +344,10 @@ class Action:
         # images
         url_list = [url for url in to_list(url) if url]
         base64_list = [b64 for b64 in to_list(base64) if b64]
+        path_list = [path for path in to_list(path) if path]
         # md5_list = [md5 for md5 in to_list(md5) if md5]
 
-        images = []
-
-        for url in url_list:
-            size = None
-            try:
-                res = await self.c.get(
-                    url, headers={"User-Agent": "Mozilla/5.0"}, timeout=10
-                )
-                res.raise_for_status()
-            except Exception:
-                pass
-            else:
-                size = get_image_size(res.content)
-            add_image(images, await self.upload(1, url=url), size)
-            await asyncio.sleep(0.5)
-        for b64 in base64_list:
-            size = get_image_size(_base64.b64decode(b64))
-            add_image(images, await self.upload(1, base64=b64), size)
-            await asyncio.sleep(0.5)
+        images = await self._upload_images(1, url_list, base64_list, path_list)
         # for md5 in md5_list:
         #     images.append({'FileMd5': md5})
         req["Images"] = images
@@ -304,6 +483,8 @@ class Action:
 
         url、base64和path三项不能同时存在
 
+        相同内容的上传结果会被缓存，详见配置项``action.upload_cache``
+
         {
             "CgiBaseResponse": {
                 "Ret": 0,
@@ -326,13 +507,93 @@ class Action:
             req["FilePath"] = path  # type: ignore
         else:
             raise ValueError("缺少参数")
+
+        cache = get_upload_cache()
+        key = None
+        if cache is not None:
+            key = cache.key(await self.qq, cmd, url=url, base64=base64, path=path)
+            if entry := cache.get(key):
+                return self.UploadResponse.parse_obj(entry["resp"])
+
         data = await self.post(
             self.build_request(req, "PicUp.DataUp"),
             path="/v1/upload",
             funcname="",
             timeout=60,  # 这个timeout可能不能写死
         )
-        return self.UploadResponse.parse_obj(data)
+        resp = self.UploadResponse.parse_obj(data)
+        if cache is not None:
+            cache.set(key, data)
+        return resp
+
+    async def _fetch_image_size(self, url: str) -> Optional[Tuple[int, int]]:
+        """下载图片获取尺寸, 失败返回None
+
+        常见格式解析到文件头中的尺寸后立即停止下载，其他格式才下载完整图片解码
+        """
+        try:
+            async with self.c.stream(
+                "GET", url, headers={"User-Agent": "Mozilla/5.0"}, timeout=10
+            ) as res:
+                res.raise_for_status()
+                data = bytearray()
+                async for chunk in res.aiter_bytes():
+                    data.extend(chunk)
+                    if len(data) < 32 or image_format(data[:16]) is None:
+                        continue
+                    if size := probe_image_size(data):
+                        return size
+        except Exception:
+            return None
+        # 解码图片比较耗时，不阻塞事件循环
+        return await asyncio.get_running_loop().run_in_executor(
+            None, _image_size, bytes(data)
+        )
+
+    async def _upload_images(
+        self,
+        cmd: int,
+        url_list: List[str],
+        base64_list: List[str],
+        path_list: Optional[List[str]] = None,
+    ) -> List[dict]:
+        """并发上传多张图片，同时获取图片尺寸，返回顺序与传入顺序一致
+        :param cmd: 1好友图片 2群组图片
+        """
+        semaphore = asyncio.Semaphore(self.upload_concurrency)
+        loop = asyncio.get_running_loop()
+        cache = get_upload_cache()
+        qq = await self.qq
+
+        async def upload_one(url: str = "", b64: str = "", path: str = ""):
+            async with semaphore:
+                key = cache.key(qq, cmd, url, b64, path) if cache else None
+                # 已经上传过并且知道尺寸，无需再获取尺寸
+                if cache is not None and (entry := cache.get(key)) and entry["size"]:
+                    resp = await self.upload(cmd, url, b64, path)
+                    return resp, tuple(entry["size"])
+                if url:
+                    size_task = self._fetch_image_size(url)
+                elif b64:
+                    size_task = loop.run_in_executor(None, _image_size_from_base64, b64)
+                else:
+                    size_task = loop.run_in_executor(None, _image_size, path)
+                resp, size = await asyncio.gather(
+                    self.upload(cmd, url, b64, path), size_task
+                )
+                if cache is not None:
+                    cache.update_size(key, size)
+                return resp, size
+
+        results = await asyncio.gather(
+            *(upload_one(url=url) for url in url_list),
+            *(upload_one(b64=b64) for b64 in base64_list),
+            *(upload_one(path=path) for path in path_list or ()),
+        )
+        images = []
+        for resp, size in results:
+            add_image(images, resp, size)
+        return images
 
     class SendGroupPicResponse(BaseModel):
         MsgTime: int
@@ -346,6 +607,7 @@ class Action:
         text: str = "",
         url: Union[str, List[str]] = "",
         base64: Union[str, List[str]] = "",
+        path: Union[str, List[str]] = "",
         # md5: Union[str, List[str]] = '',
     ):
         """发送私聊图片消息
@@ -354,6 +616,7 @@ class Action:
         :param text: 发送文字内容
         :param url: 发送图片链接, 可以使用列表发送多张图片
         :param base64: 发送图片base64, 可以使用列表发送多张图片
+        :param path: 发送图片文件路径，需要和服务端在同一个文件系统中, 可以使用列表发送多张图片
         """
         # :param md5: 发送图片md5或md5列表
         req = {
@@ -365,27 +628,10 @@ class Action:
         # images
         url_list = [url for url in to_list(url) if url]
         base64_list = [b64 for b64 in to_list(base64) if b64]
+        path_list = [path for path in to_list(path) if path]
         # md5_list = [md5 for md5 in to_list(md5) if md5]
 
-        images = []
-
-        for url in url_list:
-            size = None
-            try:
-                res = await self.c.get(
-                    url, headers={"User-Agent": "Mozilla/5.0"}, timeout=10
-                )
-                res.raise_for_status()
-            except Exception:
-                pass
-            else:
-                size = get_image_size(res.content)
-            add_image(images, await self.upload(1, url=url), size)
-            await asyncio.sleep(0.5)
-        for b64 in base64_list:
-            size = get_image_size(_base64.b64decode(b64))
-            add_image(images, await self.upload(1, base64=b64), size)
-            await asyncio.sleep(0.5)
+        images = await self._upload_images(1, url_list, base64_list, path_list)
         # for md5 in md5_list:
         #     images.append({'FileMd5': md5})
         req["Images"] = images
@@ -401,6 +647,7 @@ class Action:
         text: str = "",
         url: Union[str, List[str]] = "",
         base64: Union[str, List[str]] = "",
+        path: Union[str, List[str]] = "",
         # md5: Union[str, List[str]] = '',
         atUser: Union[int, List[int]] = 0,
         atUserNick: Union[str, List[str]] = "",
@@ -410,6 +657,7 @@ class Action:
         :param text: 发送文字内容
         :param url: 发送图片链接, 可以为列表
         :param base64: 发送图片base64, 可以为列表
+        :param path: 发送图片文件路径，需要和服务端在同一个文件系统中, 可以为列表
         :param atUser: 需要艾特的用户QQ号, 可以为列表
         :param atUserNick: 需要艾特的用户昵称, 需与atUser对应，如果缺失会将被艾特用户QQ号作为昵称
         """
@@ -422,29 +670,11 @@ class Action:
         # images
         url_list = [url for url in to_list(url) if url]
         base64_list = [b64 for b64 in to_list(base64) if b64]
+        path_list = [path for path in to_list(path) if path]
         # FIXME: 支持用户直接传递md5，size，id
         # md5_list = [md5 for md5 in to_list(md5) if md5]
 
-        images = []
-
-        for url in url_list:
-            size = None
-            try:
-                res = await self.c.get(
-                    url, headers={"User-Agent": "Mozilla/5.0"}, timeout=10
-                )
-                res.raise_for_status()
-            except Exception:
-                pass
-            else:
-                size = get_image_size(res.content)
-            imageUrl = await self.upload(2, url=url)
-            add_image(images, imageUrl, size)
-            await asyncio.sleep(0.5)
-        for b64 in base64_list:
-            size = get_image_size(_base64.b64decode(b64))
-            add_image(images, await self.upload(2, base64=b64), size)
-            await asyncio.sleep(0.5)
+        images = await self._upload_images(2, url_list, base64_list, path_list)
         # for md5 in md5_list:
         #     images.append({'FileMd5': md5})
         req["Images"] = images  # type: ignore
@@ -917,7 +1147,13 @@ class Action:
     #
     async def getClusterInfo(self) -> dict:
         """获取当前集群信息"""
-        return await self.get("", path="v1/clusterinfo", params={"isShow": 1, "qq": 1})  # type: ignore
+
+        async def query(action: "Action"):
+            return await action.get(
+                "", path="v1/clusterinfo", params={"isShow": 1, "qq": 1}
+            )  # type: ignore
+
+        return await self._query("getClusterInfo", query, per_bot=False)
 
     async def getQrCode(self, qq="", devicename="") -> str:
         """获取登录二维码base64
@@ -933,11 +1169,16 @@ class Action:
 
     async def getGroupList(self) -> List[dict]:
         """获取群列表"""
-        data = await self.post(self.build_request(request={}, cmd="GetGroupLists"))
-        return data["GroupLists"]  # type: ignore
 
-    async def getGroupMembers(self, group: int) -> List[dict]:
-        """获取群成员列表"""
+        async def query(action: "Action"):
+            data = await action.post(
+                action.build_request(request={}, cmd="GetGroupLists")
+            )
+            return data["GroupLists"]  # type: ignore
+
+        return list(await self._query("getGroupList", query))
+
+    async def _fetchGroupMembers(self, group: int) -> List[dict]:
         members = []
         LastBuffer = ""
         while True:
@@ -954,17 +1195,48 @@ class Action:
             LastBuffer = data["LastBuffer"]  # type: ignore
         return members
 
+    async def getGroupMemberDirectory(
+        self, group: int, refresh: bool = False
+    ) -> GroupMembers:
+        """获取群成员目录，可按QQ号或uid快速查找成员
+        :param group: 群号
+        :param refresh: 忽略缓存重新获取
+        """
+        directory = get_member_directory()
+        if directory is None:
+            return GroupMembers(group, await self._fetchGroupMembers(group))
+        return await directory.get(self, group, refresh)
+
+    async def getGroupMembers(self, group: int, refresh: bool = False) -> List[dict]:
+        """获取群成员列表
+        :param group: 群号
+        :param refresh: 忽略缓存重新获取
+        """
+        return list((await self.getGroupMemberDirectory(group, refresh)).members)
+
+    async def getGroupMember(self, group: int, user: Union[int, str]) -> Optional[dict]:
+        """获取群成员信息，不存在时返回None
+        :param group: 群号
+        :param user: QQ号(int)或uid(str)
+        """
+        return (await self.getGroupMemberDirectory(group)).get(user)
+
     async def getGroupAdminList(self, group: int, include_owner=True) -> List[dict]:
         """获取群管理员列表
         :param group: 群号
         :param include_owner: 是否包括群主
         """
-        members = await self.getGroupMembers(group)
-        if include_owner:
-            admins = [member for member in members if member["MemberFlag"] in [1, 2]]
-        else:
-            admins = [member for member in members if member["MemberFlag"] == 2]
-        return admins
+        return (await self.getGroupMemberDirectory(group)).admins(include_owner)
+
+    async def isGroupAdmin(
+        self, group: int, user: Union[int, str], include_owner=True
+    ) -> bool:
+        """判断群成员是否为管理员
+        :param group: 群号
+        :param user: QQ号(int)或uid(str)
+        :param include_owner: 群主是否算作管理员
+        """
+        return (await self.getGroupMemberDirectory(group)).is_admin(user, include_owner)
 
     async def revokeGroupMsg(self, group: int, msgSeq: int, msgRandom: int):
         """撤回群消息
@@ -1198,7 +1470,11 @@ class Action:
 
     async def getAllBots(self) -> List[int]:
         """获取OPQ登陆的所有机器人QQ号"""
-        return [i["QQ"] for i in (await self.getClusterInfo())["QQUsers"]]
+
+        async def query(action: "Action"):
+            return [i["QQ"] for i in (await action.getClusterInfo())["QQUsers"]]
+
+        return list(await self._query("getAllBots", query, per_bot=False))
 
     class QueryUinByUidResponse(BaseModel):
         Uin: int
@@ -1213,6 +1489,12 @@ class Action:
         """用户Uid转Uin，返回值中不仅仅包含uin, 还包括用户信息
         :param uid: 用户uid
         """
+        directory = get_member_directory()
+        if directory is None:
+            return await self._queryUinByUid(uid)
+        return await directory.query_uid(self, uid)
+
+    async def _queryUinByUid(self, uid: str):
         req = self.build_request({"Uid": uid}, "QueryUinByUid")
         data = await self.post(req)
         return self.QueryUinByUidResponse.parse_obj(
@@ -1221,7 +1503,11 @@ class Action:
 
     async def getClientKey(self) -> int:
         """自己看OPQ文档"""
-        return await self.post(self.build_request({}, "GetClientKey"))
+
+        async def query(action: "Action"):
+            return await action.post(action.build_request({}, "GetClientKey"))
+
+        return await self._query("getClientKey", query)
 
     class GetPSKeyResponse(BaseModel):
         Domain: str
@@ -1229,8 +1515,14 @@ class Action:
 
     async def getPSKey(self, domain: str = "qzone.qq.com"):
         """自己看OPQ文档"""
-        data = await self.post(self.build_request({"Domain": domain}, "GetPSKey"))
-        return self.GetPSKeyResponse.parse_obj(data)
+
+        async def query(action: "Action"):
+            data = await action.post(
+                action.build_request({"Domain": domain}, "GetPSKey")
+            )
+            return action.GetPSKeyResponse.parse_obj(data)
+
+        return await self._query("getPSKey", query, domain)
 
         ############################################################################
 
@@ -1244,24 +1536,33 @@ class Action:
         timeout: Optional[int] = None,
     ):
         """基础请求方法, 提供部分提示信息，出错返回空字典，其他返回服务端响应结果"""
-        async with lock:
-            await asyncio.sleep(0.5)
-
         params = params or {}
         params["funcname"] = funcname
         if "qq" not in params:
             params["qq"] = await self.qq
 
+        await self.scheduler.acquire(params["qq"], payload)
+
         ret = None
+        code = None
+        started = time.perf_counter()
+        slots = self._request_slots()
         try:
-            resp = await self.c.request(
-                method,
-                httpx.URL(url=path, params=params),
-                json=payload,
-                timeout=timeout,
-            )
-            ret = resp.json()
+            if slots is not None:
+                await slots.acquire()
+            try:
+                resp = await self.c.request(
+                    method,
+                    httpx.URL(url=path, params=params),
+                    content=None if payload is None else jsonlib.dumpb(payload),
+                    timeout=timeout,
+                )
+            finally:
+                if slots is not None:
+                    slots.release()
+            ret = jsonlib.loads(resp.content)
             resp_model = Response.parse_obj(ret)
+            code = resp_model.CgiBaseResponse.Ret
             if resp_model.CgiBaseResponse.ErrMsg:
                 if resp_model.CgiBaseResponse.Ret == 0:
                     logger.success(resp_model.CgiBaseResponse.ErrMsg)
@@ -1272,6 +1573,9 @@ class Action:
             logger.error(e)
             logger.debug(f"接口返回数据：{ret}")
             return None
+        finally:
+            if metrics.enabled:
+                _observe_request(funcname, payload, code, time.perf_counter() - started)
 
     #
     async def post(
@@ -0,0 +1,328 @@
+"""性能测试
+
+向``Botoy._packet_handler``回放合成或录制的消息数据包，由若干个空接收函数处理，
+发送消息的请求发往本地的模拟 OPQ HTTP 服务，统计吞吐量、分发延迟、发送延迟和内存占用
+
+命令行: ``botoy bench --help``
+"""
+
+import asyncio
+import gc
+import random
+import sys
+import time
+from typing import Dict, List, Optional
+
+from . import jsonlib
+from .action import Action, close_shared_actions
+from .client import Botoy
+from .context import current_ctx
+from .log import logger
+from .sugar import S
+from .throttle import SendScheduler, get_scheduler, set_scheduler
+
+# 数据包中记录放入队列时间的字段
+_TS_KEY = "_bench_ts"
+
+
+def group_packet(group: int, user: int, bot: int, text: str) -> dict:
+    """合成群消息数据包"""
+    return {
+        "CurrentPacket": {
+            "EventName": "ON_EVENT_GROUP_NEW_MSG",
+            "EventData": {
+                "MsgHead": {
+                    "FromUin": group,
+                    "ToUin": bot,
+                    "FromType": 2,
+                    "SenderUin": user,
+                    "SenderNick": f"user{user}",
+                    "MsgType": 82,
+                    "C2cCmd": 0,
+                    "MsgSeq": 1,
+                    "MsgTime": int(time.time()),
+                    "MsgRandom": random.randint(1, 2**31),
+                    "MsgUid": random.randint(1, 2**62),
+                    "GroupInfo": {
+                        "GroupCard": "",
+                        "GroupCode": group,
+                        "GroupInfoSeq": 1,
+                        "GroupLevel": 1,
+                        "GroupRank": 1,
+                        "GroupType": 1,
+                        "GroupName": f"group{group}",
+                    },
+                },
+                "MsgBody": {"SubMsgType": 0, "Content": text, "AtUinLists": None},
+            },
+        },
+        "CurrentQQ": bot,
+    }
+
+
+def friend_packet(user: int, bot: int, text: str) -> dict:
+    """合成好友消息数据包"""
+    return {
+        "CurrentPacket": {
+            "EventName": "ON_EVENT_FRIEND_NEW_MSG",
+            "EventData": {
+                "MsgHead": {
+                    "FromUin": user,
+                    "ToUin": bot,
+                    "FromType": 1,
+                    "SenderUin": user,
+                    "SenderNick": f"user{user}",
+                    "MsgType": 166,
+                    "C2cCmd": 11,
+                    "MsgSeq": 1,
+                    "MsgTime": int(time.time()),
+                    "MsgRandom": random.randint(1, 2**31),
+                    "MsgUid": random.randint(1, 2**62),
+                },
+                "MsgBody": {"SubMsgType": 0, "Content": text},
+            },
+        },
+        "CurrentQQ": bot,
+    }
+
+
+def synthetic_packets(
+    count: int,
+    bot: int = 10000,
+    groups: int = 20,
+    users: int = 200,
+    friend_ratio: float = 0.1,
+    seed: int = 0,
+) -> List[dict]:
+    """生成数据包
+    :param count: 数量
+    :param bot: 机器人QQ
+    :param groups: 群数量
+    :param users: 用户数量
+    :param friend_ratio: 好友消息比例
+    :param seed: 随机种子，相同参数生成相同的消息
+    """
+    rnd = random.Random(seed)
+    packets = []
+    for i in range(count):
+        user = 20000 + rnd.randrange(users)
+        text = f"bench message {i}"
+        if rnd.random() < friend_ratio:
+            packets.append(friend_packet(user, bot, text))
+        else:
+            packets.append(group_packet(30000 + rnd.randrange(groups), user, bot, text))
+    return packets
+
+
+def load_packets(path: str) -> List[dict]:
+    """读取录制的数据包，每行一个JSON"""
+    packets = []
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                packets.append(jsonlib.loads(line))
+    return packets
+
+
+class StubServer:
+    """模拟 OPQ HTTP 服务，所有请求都返回成功"""
+
+    def __init__(self, bot: int, delay: float = 0):
+        """
+        :param bot: 集群信息中返回的机器人QQ
+        :param delay: 每个请求的处理耗时(秒)
+        """
+        self.bot = bot
+        self.delay = delay
+        self.requests = 0
+        self.port = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line[:15].lower() == b"content-length:":
+                        length = int(line[15:])
+                if length:
+                    await reader.readexactly(length)
+                self.requests += 1
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                body = jsonlib.dumpb(
+                    {
+                        "CgiBaseResponse": {"Ret": 0, "ErrMsg": ""},
+                        "ResponseData": {
+                            "MsgTime": int(time.time()),
+                            "MsgSeq": self.requests,
+                            "QQUsers": [{"QQ": self.bot}],
+                        },
+                    }
+                )
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def _max_rss() -> Optional[int]:
+    """进程最大常驻内存(KB), 不支持的平台返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 单位为字节
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+async def run_bench(
+    messages: int = 5000,
+    receivers: int = 10,
+    senders: int = 1,
+    friend_ratio: float = 0.1,
+    packets: Optional[List[dict]] = None,
+    sync: bool = False,
+    throttle: bool = False,
+    server_delay: float = 0,
+) -> Dict[str, float]:
+    """执行测试，返回统计结果
+    :param messages: 消息数量, 使用录制的数据包时循环回放
+    :param receivers: 接收函数数量
+    :param senders: 其中每条消息都发送一条文字的接收函数数量
+    :param friend_ratio: 合成数据包中好友消息的比例
+    :param packets: 录制的数据包，为None时使用合成的数据包
+    :param sync: 使用同步接收函数，同步接收函数不发送消息
+    :param throttle: 是否启用出站限流，默认关闭以测试框架本身
+    :param server_delay: 模拟服务端每个请求的处理耗时(秒)
+    """
+    bot_qq = 10000
+    if packets is None:
+        packets = synthetic_packets(messages, bot=bot_qq, friend_ratio=friend_ratio)
+    elif packets:
+        bot_qq = packets[0].get("CurrentQQ", bot_qq)
+    if not packets:
+        raise ValueError("没有可回放的数据包")
+
+    server = StubServer(bot_qq, server_delay)
+    await server.start()
+    scheduler = get_scheduler()
+    if not throttle:
+        set_scheduler(SendScheduler())
+    for qq in {p.get("CurrentQQ", bot_qq) for p in packets}:
+        Action.shared(qq).set_url(server.url)
+
+    dispatch: List[float] = []
+    send: List[float] = []
+    calls = 0
+
+    def make_receiver(idx: int):
+        sender = not sync and idx < senders
+
+        async def receiver():
+            nonlocal calls
+            calls += 1
+            dispatch.append(time.perf_counter() - current_ctx.get().data[_TS_KEY])
+            if sender:
+                start = time.perf_counter()
+                await S.text("pong")
+                send.append(time.perf_counter() - start)
+
+        def sync_receiver():
+            nonlocal calls
+            calls += 1
+            dispatch.append(time.perf_counter() - current_ctx.get().data[_TS_KEY])
+
+        func = sync_receiver if sync else receiver
+        func.__name__ = f"bench_{idx}"
+        return func
+
+    bot = Botoy()
+    for idx in range(receivers):
+        bot.attach(make_receiver(idx), name=f"bench_{idx}")
+
+    gc.collect()
+    rss_before = _max_rss()
+    bot.dispatcher.start()
+    start = time.perf_counter()
+    try:
+        high_water = max(1, bot.ingest.maxsize // 2)
+        for i in range(messages):
+            pkt = dict(packets[i % len(packets)])
+            pkt[_TS_KEY] = time.perf_counter()
+            bot.ingest.put(pkt)
+            # 避免超出队列长度被丢弃
+            while bot.ingest.queued >= high_water:
+                await asyncio.sleep(0)
+        while bot.ingest.queued or bot.dispatcher.pending:
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - start
+    finally:
+        bot.dispatcher.stop()
+        set_scheduler(scheduler)
+        await close_shared_actions()
+        await server.close()
+    rss_after = _max_rss()
+
+    stats = bot.stats()
+    return {
+        "messages": messages,
+        "receivers": receivers,
+        "elapsed": elapsed,
+        "msgs_per_sec": stats["processed"] / elapsed if elapsed else 0,
+        "receiver_calls": calls,
+        "dropped": stats["dropped"],
+        "dispatch_p50_ms": percentile(dispatch, 50) * 1000,
+        "dispatch_p99_ms": percentile(dispatch, 99) * 1000,
+        "sends": len(send),
+        "send_p50_ms": percentile(send, 50) * 1000,
+        "send_p99_ms": percentile(send, 99) * 1000,
+        "server_requests": server.requests,
+        "max_rss_kb": rss_after or 0,
+        "rss_growth_kb": (rss_after - rss_before) if rss_after and rss_before else 0,
+    }
+
+
+def format_report(result: Dict[str, float]) -> str:
+    lines = [
+        f"消息数: {result['messages']}  接收函数: {result['receivers']}  耗时: {result['elapsed']:.2f}s",
+        f"吞吐量: {result['msgs_per_sec']:.0f} msgs/s  接收函数调用: {result['receiver_calls']}  丢弃: {result['dropped']}",
+        f"分发延迟: p50 {result['dispatch_p50_ms']:.2f}ms  p99 {result['dispatch_p99_ms']:.2f}ms",
+        f"发送延迟: p50 {result['send_p50_ms']:.2f}ms  p99 {result['send_p99_ms']:.2f}ms  发送数: {result['sends']}",
+        f"内存: 最大常驻 {result['max_rss_kb'] / 1024:.1f}MB  测试期间增长 {result['rss_growth_kb'] / 1024:.1f}MB",
+    ]
+    return "\n".join(lines)
+
+
+def bench(**kwargs):
+    """命令行入口, 测试期间关闭框架日志"""
+    logger.disable("botoy")
+    return asyncio.run(run_bench(**kwargs))
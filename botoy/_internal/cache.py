@@ -0,0 +1,302 @@
+"""缓存
+
+- ``TTLCache``: 带过期时间和容量上限(LRU)的内存缓存, 线程安全
+- ``SingleFlight``: 合并相同的并发请求，只执行一次并共享结果
+- ``UploadCache``: 资源上传结果缓存，相同内容不再重复上传
+
+上传缓存配置项(botoy.json)::
+
+    {
+      "action.upload_cache.enabled": true,   // 是否启用
+      "action.upload_cache.maxsize": 1024,   // 内存中最多缓存的数量
+      "action.upload_cache.ttl": 86400,      // 过期时间(秒)
+      "action.upload_cache.url": false,      // 是否按链接缓存，链接内容可能变化(如随机图片接口)，默认关闭
+      "action.upload_cache.disk": false      // 是否同时缓存到磁盘(botoy-cache/upload)，重启后仍然有效
+    }
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from time import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from . import jsonlib
+from .config import jconfig
+from .log import logger
+
+_MISSING = object()
+
+
+class TTLCache:
+    """带过期时间和容量上限的缓存，超出容量时淘汰最久未使用的项"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        """
+        :param maxsize: 最多缓存的数量
+        :param ttl: 过期时间(秒), <=0 表示不过期
+        """
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires = item
+            if expires and expires < time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        :param ttl: 该项的过期时间，默认使用缓存的过期时间
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (value, time() + ttl if ttl > 0 else 0)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class SingleFlight:
+    """合并相同键的并发调用: 同一时间只执行一次，所有调用者共享结果或异常
+
+    可按调用指定ttl缓存结果，出错和结果为None(请求失败)时不会被缓存
+    """
+
+    def __init__(self, maxsize: int = 256):
+        """
+        :param maxsize: 最多缓存的结果数量
+        """
+        self.cache = TTLCache(maxsize, 0)
+        self.calls = 0  # 实际执行的次数
+        self.shared = 0  # 共享了其他调用结果的次数
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    async def do(
+        self,
+        key: Hashable,
+        factory: Callable[[], Awaitable[Any]],
+        ttl: float = 0,
+    ) -> Any:
+        """
+        :param key: 调用的键
+        :param factory: 无参数的协程函数
+        :param ttl: 结果缓存时间(秒), <=0 表示不缓存
+        """
+        if ttl > 0:
+            value = self.cache.get(key, _MISSING)
+            if value is not _MISSING:
+                self.shared += 1
+                return value
+
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(key)
+        # Task 绑定事件循环，其他事件循环中的调用不能共享
+        if task is None or task.done() or task.get_loop() is not loop:
+            self.calls += 1
+            task = self._inflight[key] = loop.create_task(factory())
+
+            def done(t: asyncio.Task):
+                if self._inflight.get(key) is t:
+                    del self._inflight[key]
+                if (
+                    ttl > 0
+                    and not t.cancelled()
+                    and t.exception() is None
+                    and t.result() is not None
+                ):
+                    self.cache.set(key, t.result(), ttl)
+
+            task.add_done_callback(done)
+        else:
+            self.shared += 1
+        # 某个调用者被取消时不影响其他调用者
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable):
+        """移除缓存的结果"""
+        self.cache.pop(key)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "inflight": self.inflight,
+            "cached": len(self.cache),
+        }
+
+
+class UploadCache:
+    """资源上传结果缓存
+
+    键为机器人QQ、上传类型和内容(base64的哈希、文件路径和修改时间或链接)，
+    值为上传接口的返回结果和图片尺寸
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 86400,
+        cache_url: bool = False,
+        directory: Optional[Path] = None,
+    ):
+        """
+        :param maxsize: 内存中最多缓存的数量
+        :param ttl: 过期时间(秒)
+        :param cache_url: 是否按链接缓存
+        :param directory: 磁盘缓存目录，为None时只缓存在内存中
+        """
+        self.memory = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.cache_url = cache_url
+        self.directory = directory
+
+    @classmethod
+    def from_config(cls) -> Optional["UploadCache"]:
+        config = jconfig.get_configuration("action.upload_cache")
+        if not config.get("enabled", True):
+            return None
+        directory = None
+        if config.get("disk", False):
+            # contrib 为独立模块，只在需要时导入
+            from .contrib import get_cache_dir
+
+            directory = get_cache_dir("upload")
+        return cls(
+            maxsize=config.get("maxsize", 1024),
+            ttl=config.get("ttl", 86400),
+            cache_url=config.get("url", False),
+            directory=directory,
+        )
+
+    def key(
+        self, qq: int, cmd: int, url: str = "", base64: str = "", path: str = ""
+    ) -> Optional[str]:
+        """生成缓存键，不能缓存时返回None"""
+        if base64:
+            digest = hashlib.sha256(base64.strip().encode()).hexdigest()
+            return f"{qq}:{cmd}:b64:{digest}"
+        if path:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            return f"{qq}:{cmd}:path:{path}:{stat.st_mtime_ns}:{stat.st_size}"
+        if url and self.cache_url:
+            return f"{qq}:{cmd}:url:{url}"
+        return None
+
+    def _file(self, key: str) -> Path:
+        return self.directory / (hashlib.sha1(key.encode()).hexdigest() + ".json")  # type: ignore
+
+    def get(self, key: Optional[str]) -> Optional[dict]:
+        """获取缓存, {"resp": 上传接口返回结果, "size": 图片尺寸或None}"""
+        if key is None:
+            return None
+        entry = self.memory.get(key)
+        if entry is None and self.directory is not None:
+            entry = self._load(key)
+            if entry is not None:
+                self.memory.set(key, entry)
+        return entry
+
+    def set(self, key: Optional[str], resp: dict, size=None):
+        if key is None:
+            return
+        entry = {"resp": resp, "size": list(size) if size else None}
+        self.memory.set(key, entry)
+        if self.directory is not None:
+            self._dump(key, entry)
+
+    def update_size(self, key: Optional[str], size):
+        """补充图片尺寸"""
+        if key is None or not size:
+            return
+        entry = self.get(key)
+        if entry is not None and not entry.get("size"):
+            self.set(key, entry["resp"], size)
+
+    def _load(self, key: str) -> Optional[dict]:
+        file = self._file(key)
+        try:
+            data = jsonlib.loads(file.read_bytes())
+        except (OSError, ValueError):
+            return None
+        if data.get("key") != key:
+            return None
+        if self.ttl > 0 and data.get("expires", 0) < time():
+            try:
+                file.unlink()
+            except OSError:
+                pass
+            return None
+        return data.get("entry")
+
+    def _dump(self, key: str, entry: dict):
+        data = {
+            "key": key,
+            "expires": time() + self.ttl if self.ttl > 0 else 0,
+            "entry": entry,
+        }
+        try:
+            self._file(key).write_bytes(jsonlib.dumpb(data))
+        except OSError as e:
+            logger.warning(f"上传缓存写入失败: {e}")
+
+    def stats(self) -> dict:
+        return self.memory.stats()
+
+
+_upload_cache: Any = _MISSING
+
+
+def get_upload_cache() -> Optional[UploadCache]:
+    """全局上传缓存，未启用时返回None"""
+    global _upload_cache
+    if _upload_cache is _MISSING:
+        _upload_cache = UploadCache.from_config()
+    return _upload_cache
+
+
+def set_upload_cache(cache: Optional[UploadCache]):
+    """替换全局上传缓存, 传入None则关闭缓存"""
+    global _upload_cache
+    _upload_cache = cache
@@ -21,6 +21,8 @@ def cli():
 
     botoy --help
     botoy go --help
+    botoy bench --help
+    botoy profile --help
     """
 
 
@@ -40,3 +42,100 @@ def go(plugin, url, reload):
     if url:
         bot.set_url(url)
     bot.run(reload)
+
+
+@cli.command()
+@click.option("-n", "--messages", default=5000, show_default=True, help="消息数量")
+@click.option("-r", "--receivers", default=10, show_default=True, help="接收函数数量")
+@click.option(
+    "-s", "--senders", default=1, show_default=True, help="其中发送消息的接收函数数量"
+)
+@click.option(
+    "--friend-ratio", default=0.1, show_default=True, help="合成消息中好友消息的比例"
+)
+@click.option(
+    "-f",
+    "--file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="录制的数据包文件，每行一个JSON, 不指定则使用合成的消息",
+)
+@click.option("--sync", is_flag=True, help="使用同步接收函数(不发送消息)")
+@click.option("--throttle", is_flag=True, help="启用出站限流")
+@click.option(
+    "--server-delay", default=0.0, show_default=True, help="模拟服务端请求耗时(秒)"
+)
+@click.option("--json", "as_json", is_flag=True, help="以JSON格式输出结果")
+def bench(
+    messages,
+    receivers,
+    senders,
+    friend_ratio,
+    file,
+    sync,
+    throttle,
+    server_delay,
+    as_json,
+):
+    """性能测试: 消息分发、接收函数执行和消息发送"""
+    from . import jsonlib
+    from .bench import bench as run_bench
+    from .bench import format_report, load_packets
+
+    result = run_bench(
+        messages=messages,
+        receivers=receivers,
+        senders=senders,
+        friend_ratio=friend_ratio,
+        packets=load_packets(file) if file else None,
+        sync=sync,
+        throttle=throttle,
+        server_delay=server_delay,
+    )
+    echo(jsonlib.dumps(result, indent=2) if as_json else format_report(result))
+
+
+@cli.command()
+@click.argument("pid", type=int)
+@click.option("-d", "--duration", default=30.0, show_default=True, help="采样时长(秒)")
+@click.option("--hz", default=100.0, show_default=True, help="采样频率")
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="输出文件，默认为当前目录下的 profile-进程号.txt",
+)
+def profile(pid, duration, hz, output):
+    """对运行中的botoy进程采样分析，输出折叠栈格式的结果(可用于生成火焰图)"""
+    import os
+    import signal
+    import time
+    from pathlib import Path
+
+    from . import jsonlib
+    from .profiler import request_path
+
+    if not hasattr(signal, "SIGUSR2"):
+        raise click.ClickException("当前平台不支持")
+    output = Path(output or f"profile-{pid}.txt").absolute()
+    if output.exists():
+        output.unlink()
+    request = request_path(pid)
+    request.write_bytes(
+        jsonlib.dumpb({"hz": hz, "duration": duration, "output": str(output)})
+    )
+    try:
+        os.kill(pid, signal.SIGUSR2)
+    except OSError as e:
+        request.unlink()
+        raise click.ClickException(f"无法发送信号: {e}")
+
+    echo(f"采样中: {duration}秒, {hz}Hz")
+    deadline = time.time() + duration + 10
+    while not output.exists():
+        if time.time() > deadline:
+            raise click.ClickException(
+                "等待超时，请确认该进程为botoy并且在主线程中运行"
+            )
+        time.sleep(0.5)
+    echo(f"结果已写入 {output}")
+    echo(f"生成火焰图: flamegraph.pl {output.name} > profile.svg")
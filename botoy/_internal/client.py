@@ -4,8 +4,9 @@ import inspect
 import re
 import signal
 import threading
+import weakref
 from pathlib import Path
-from typing import Callable, List, Optional
+from typing import Callable, List, Optional, Union
 from urllib.parse import urlparse
 
 import prettytable
@@ -15,21 +16,61 @@ from websockets.legacy.server import WebSocketServerProtocol
 from websockets.server import serve as ws_serve
 
 from . import runner
+from .action import Action, close_shared_actions, get_base_url, set_bot_url
 from .config import jconfig
-from .context import Context, current_ctx
+from .context import Context, MsgKind, current_ctx
+from .dispatch import DispatchIndex
+from .ingest import Dispatcher, IngestQueue
 from .keys import *
 from .log import logger
+from .members import get_member_directory
+from .metrics import CONNECTED, CONNECTS, INGEST, PACKETS, RECONNECTS, metrics
+from .monitor import loop_monitor
 from .pool import WorkerPool
-from .receiver import Receiver, ReceiverInfo, is_recv, mark_recv
+from .profiler import install_signal_handler
+from .receiver import Receiver, ReceiverInfo, configure_recv, is_recv, mark_recv
+from .throttle import TokenBucketScheduler, get_scheduler
+from .watchdog import watchdog
 
 connected_clients = []
+CONNECTED.set_function(lambda: len(connected_clients))
+
+# 用于汇总接收队列指标
+_clients: "weakref.WeakSet[Botoy]" = weakref.WeakSet()
+
+
+def _collect_ingest():
+    totals = {}
+    for client in list(_clients):
+        for key, value in client.dispatcher.stats().items():
+            totals[key] = totals.get(key, 0) + value
+    for key, value in totals.items():
+        INGEST.labels(key).set(value)
+
+
+metrics.add_collector(_collect_ingest)
 is_signal_hander_set = False
 
 
+def _get_ws_urls(url: str) -> List[str]:
+    if not re.match(r"^(http|https|ws|wss)://", url):
+        url = "ws://" + url
+
+    parsed_url = urlparse(url)
+    scheme = parsed_url.scheme
+    netloc = parsed_url.netloc
+
+    schemes = ["ws", "wss"] if scheme in ["http", "ws"] else ["wss", "ws"]
+
+    return [f"{s}://{netloc}/ws" for s in schemes]
+
+
 def async_signal_handler():
     async def _handler():
         for c in connected_clients[:]:
             await c.disconnect()
+        for client in list(_clients):
+            client.dispatcher.stop()
 
         tasks = [
             task for task in asyncio.all_tasks() if task is not asyncio.current_task()
@@ -42,18 +83,246 @@ def async_signal_handler():
     asyncio.ensure_future(_handler())
 
 
+class Connection:
+    """与一个服务端的websocket连接，由``Botoy``管理
+
+    每个连接有独立的读取循环和重连，收到的数据包放入``Botoy``共用的接收队列，
+    所有连接共用接收函数、线程池和各类缓存
+    """
+
+    def __init__(
+        self,
+        bot: "Botoy",
+        url: str,
+        qq: Optional[List[int]] = None,
+        bot_rate: Optional[float] = None,
+        bot_burst: Optional[float] = None,
+    ):
+        """
+        :param bot: 所属的``Botoy``
+        :param url: 服务端地址
+        :param qq: 该服务端登录的机器人QQ, 不指定则连接后自动获取
+        :param bot_rate: 该服务端机器人的发送速率, 默认读取配置 action.throttle
+        :param bot_burst: 该服务端机器人的发送桶容量
+        """
+        self.bot = bot
+        self.urls = _get_ws_urls(url)
+        self.qq: List[int] = [int(i) for i in qq or []]
+        self.bot_rate = bot_rate
+        self.bot_burst = bot_burst
+        # 已登记的机器人
+        self.bots: List[int] = []
+        self.ws = None
+        self.state = "disconnected"
+        self.connect_task: Optional[asyncio.Task] = None
+        self.reconnect_task: Optional[asyncio.Task] = None
+        self.received = 0
+
+    @property
+    def http_url(self) -> str:
+        """服务端接口地址"""
+        return get_base_url(self.urls[0])
+
+    def set_url(self, url: str):
+        self.urls = _get_ws_urls(url)
+
+    def start(self) -> asyncio.Task:
+        """在后台开始连接，不等待连接成功"""
+        self.connect_task = self.bot._start_task(self.connect)
+        return self.connect_task
+
+    async def connect(self):
+        ws = None
+        while True:
+            for idx, connection_url in enumerate(self.urls):
+                try:
+                    if idx == 0:
+                        logger.info(f"正在连接[{connection_url}]...")
+                    else:
+                        logger.info(f"尝试连接[{connection_url}]...")
+                    self.state = "connecting"
+                    ws = await ws_connect(connection_url, open_timeout=10)
+                except InvalidURI as e:
+                    CONNECTS.labels("failure").inc()
+                    logger.error(f"连接地址有误[{connection_url}]: {e}")
+                except asyncio.TimeoutError as e:
+                    CONNECTS.labels("failure").inc()
+                    logger.error(f"连接超时[{connection_url}]: {e}")
+                except Exception as e:
+                    CONNECTS.labels("failure").inc()
+                    logger.error(f"连接失败[{connection_url}]: {e}")
+                else:
+                    CONNECTS.labels("success").inc()
+                    self.urls.remove(connection_url)
+                    self.urls.insert(0, connection_url)
+                    logger.success(f"连接成功[{connection_url}]!")
+                    break
+                await asyncio.sleep(1)
+            if ws:
+                break
+            await asyncio.sleep(1)
+
+        if ws:
+            self.state = "connected"
+            connected_clients.append(self)
+            self.ws = ws
+            # 指定的机器人在开始接收消息前登记，未指定时在后台获取
+            if self.qq:
+                self._register_bots(self.qq)
+            else:
+                self.bot._start_task(self._fetch_bots)
+            self.bot._start_task(self._read_loop)
+
+    async def _fetch_bots(self):
+        try:
+            async with Action(url=self.http_url) as action:
+                qq_list = await action.getAllBots()
+        except Exception as e:
+            logger.warning(f"获取服务端[{self.http_url}]的机器人失败: {e}")
+            return
+        self._register_bots(qq_list)
+
+    def _register_bots(self, qq_list: List[int]):
+        """登记该服务端的机器人，发送消息时据此选择服务端"""
+        scheduler = get_scheduler()
+        for qq in qq_list:
+            set_bot_url(qq, self.http_url)
+            if self.bot_rate is not None and isinstance(
+                scheduler, TokenBucketScheduler
+            ):
+                scheduler.set_bot_budget(
+                    qq, self.bot_rate, self.bot_burst or self.bot_rate
+                )
+        self.bots = list(qq_list)
+
+    async def _read_loop(self):
+        while self.state == "connected":
+            try:
+                if self.ws is not None:
+                    async for pkt in self.ws:
+                        self.received += 1
+                        if self.bot.receivers:
+                            self.bot.ingest.put(pkt)
+            except ConnectionClosed:
+                connected_clients.remove(self)
+                if self.state == "connected":
+                    self.reconnect_task = self.bot._start_task(self._handle_reconnect)
+                break
+
+    async def disconnect(self):
+        if self.connect_task is not None and not self.connect_task.done():
+            self.connect_task.cancel()
+        if self.ws and not self.ws.closed:
+            self.state = "disconnecting"
+            await self.ws.close()
+            self.state = "disconnected"
+            connected_clients.remove(self)
+
+    async def _handle_reconnect(self):
+        logger.info("准备重连中...")
+        RECONNECTS.inc()
+        try:
+            await self.connect()
+        except:
+            pass
+        else:
+            self.reconnect_task = None
+
+    async def wait(self):
+        if self.connect_task is not None:
+            await asyncio.wait((self.connect_task,))
+        while True:
+            if not self.ws:
+                break
+            await self.ws.wait_closed()
+            await asyncio.sleep(1)
+            if not self.reconnect_task:
+                break
+            await self.reconnect_task
+            if self.state != "connected":
+                break
+
+    def stats(self) -> dict:
+        return {
+            "url": self.urls[0],
+            "state": self.state,
+            "bots": self.bots,
+            "received": self.received,
+        }
+
+    def __repr__(self) -> str:
+        return f"<Connection[{self.urls[0]}]>"
+
+
 class Botoy:
     def __init__(self):
-        self.ws = None
         self.receivers: List[Receiver] = []
-        self.state = "disconnected"
+        self._dispatch_index: Optional[DispatchIndex] = None
         self.loaded_plugins = False
-        self.pool = WorkerPool()
-        self.connection_urls = self._get_ws_urls(jconfig.url)
+        self.pool = WorkerPool.from_config()
+        # 第一个连接为配置中的url, 其他连接读取配置项 connections
+        self.connections: List[Connection] = [Connection(self, jconfig.url)]
+        for item in jconfig.get("connections") or []:
+            if isinstance(item, str):
+                self.add_connection(item)
+            else:
+                self.add_connection(
+                    item["url"],
+                    item.get("qq"),
+                    bot_rate=item.get("bot_rate"),
+                    bot_burst=item.get("bot_burst"),
+                )
         self._log_messages = False
 
+        ingest_config = jconfig.get_configuration("ingest")
+        self.ingest = IngestQueue.from_config()
+        self.dispatcher = Dispatcher(
+            self.ingest,
+            self._packet_handler,
+            workers=ingest_config.get("workers", 4),
+            max_pending=ingest_config.get("max_pending", 1000),
+        )
+        _clients.add(self)
+
+    @property
+    def ws(self):
+        """第一个连接的websocket"""
+        return self.connections[0].ws
+
+    @property
+    def state(self) -> str:
+        """第一个连接的状态"""
+        return self.connections[0].state
+
+    @property
+    def connection_urls(self) -> List[str]:
+        return self.connections[0].urls
+
     def set_url(self, url: str):
-        self.connection_urls = self._get_ws_urls(url)
+        """设置第一个连接的服务端地址"""
+        self.connections[0].set_url(url)
+
+    def add_connection(
+        self,
+        url: str,
+        qq: Optional[Union[int, List[int]]] = None,
+        bot_rate: Optional[float] = None,
+        bot_burst: Optional[float] = None,
+    ) -> Connection:
+        """添加一个服务端连接，需要在``connect``之前调用
+
+        所有连接共用接收函数，各连接收到的消息中``ctx.bot_qq``为对应的机器人，
+        ``S``和未指定地址的``Action``会自动向该机器人所在的服务端发送请求
+        :param url: 服务端地址
+        :param qq: 该服务端登录的机器人QQ, 可以为列表, 不指定则连接后自动获取
+        :param bot_rate: 该服务端机器人的发送速率(条/秒), 默认读取配置 action.throttle
+        :param bot_burst: 该服务端机器人的发送桶容量, 默认与``bot_rate``相同
+        """
+        if isinstance(qq, int):
+            qq = [qq]
+        connection = Connection(self, url, qq, bot_rate, bot_burst)
+        self.connections.append(connection)
+        return connection
 
     def log_messages(self):
         self._log_messages = True
@@ -99,19 +368,34 @@ class Botoy:
             table.add_row([info.name, info.author, info.usage, info.meta])
         print(table)
 
-    def attach(self, callback):
+    def attach(self, callback=None, **kwargs):
         """绑定接收函数
         :param callback: 消息接收函数
+        :param kwargs: 过滤条件和执行选项, 参数同``mark_recv``, 如 ``prefix``, ``groups``, ``lane``
+
+        设置过滤条件时可作为装饰器工厂使用 ``@bot.attach(prefix="#")``
         """
+        if callback is None:
+            return lambda callback: self.attach(callback, **kwargs)
         if callback in (i.callback for i in self.receivers):
-            return
+            return callback
         #  不使用插件，基本不会调用mark_recv，这里自动调用补充默认信息
         if not hasattr(callback, RECEIVER_INFO):
-            mark_recv(callback, _directly_attached=True)
+            mark_recv(callback, _directly_attached=True, **kwargs)
+        elif kwargs:
+            configure_recv(callback, **kwargs)
         info = getattr(callback, RECEIVER_INFO, ReceiverInfo())
 
-        receiver = Receiver(callback, info, pool=self.pool)
+        receiver = Receiver(
+            callback,
+            info,
+            pool=self.pool,
+            filter=getattr(callback, RECEIVER_FILTER, None),
+            options=getattr(callback, RECEIVER_OPTIONS, None),
+        )
         self.receivers.append(receiver)
+        self._dispatch_index = None
+        return callback
 
     __call__ = attach
 
@@ -121,22 +405,24 @@ class Botoy:
         # TODO: 在mark_recv中处理好name
         # 由botoy注册的框架名自动添加 BOTOY前缀如："name" => "BOTOY name"
         _ctx = Context(pkt)
+        if metrics.enabled:
+            PACKETS.labels(_ctx.kind.value).inc()
         if self._log_messages:
             logger.info(_ctx)
+        if _ctx.kind is MsgKind.EVENT:
+            directory = get_member_directory()
+            if directory is not None:
+                directory.on_event(_ctx.data)
         token = current_ctx.set(_ctx)
+        if self._dispatch_index is None:
+            self._dispatch_index = DispatchIndex(self.receivers)
+        receivers = self._dispatch_index.match(_ctx)
         if _available_names is not None:
             _available_names = [i[6:] for i in _available_names]
+            receivers = [r for r in receivers if r.info.name in _available_names]
+        if receivers:
             await asyncio.gather(
-                *(
-                    self._start_task(receiver)
-                    for receiver in self.receivers
-                    if receiver.info.name in _available_names
-                ),
-                return_exceptions=True,
-            )
-        else:
-            await asyncio.gather(
-                *(self._start_task(receiver) for receiver in self.receivers),
+                *(self._start_task(receiver) for receiver in receivers),
                 return_exceptions=True,
             )
         current_ctx.reset(token)
@@ -144,20 +430,18 @@ class Botoy:
     def _start_task(self, target, *args, **kwargs):
         return asyncio.ensure_future(target(*args, **kwargs))
 
-    async def _read_loop(self):
-        while self.state == "connected":
-            try:
-                if self.ws is not None:
-                    async for pkt in self.ws:
-                        if self.receivers:
-                            self._start_task(self._packet_handler, pkt)
-            except ConnectionClosed:
-                connected_clients.remove(self)
-                if self.state == "connected":
-                    self.reconnect_task = self._start_task(self._handle_reconnect)
-                break
+    def stats(self) -> dict:
+        """数据包接收和处理的统计信息"""
+        return {
+            **self.dispatcher.stats(),
+            "pool": self.pool.stats(),
+            "receivers": watchdog.stats(),
+            "loop": loop_monitor.stats(),
+            "connections": [c.stats() for c in self.connections],
+        }
 
     async def connect(self):
+        """连接所有服务端，任意一个连接成功后返回，其他连接在后台继续尝试"""
         global is_signal_hander_set
         if (
             not is_signal_hander_set
@@ -169,67 +453,26 @@ class Botoy:
                 )
             except NotImplementedError:
                 pass
+            install_signal_handler(asyncio.get_event_loop())
             is_signal_hander_set = True
 
-        ws = None
-        while True:
-            for idx, connection_url in enumerate(self.connection_urls):
-                try:
-                    if idx == 0:
-                        logger.info(f"正在连接[{connection_url}]...")
-                    else:
-                        logger.info(f"尝试连接[{connection_url}]...")
-                    self.state = "connecting"
-                    ws = await ws_connect(connection_url, open_timeout=10)
-                except InvalidURI as e:
-                    logger.error(f"连接地址有误[{connection_url}]: {e}")
-                except asyncio.TimeoutError as e:
-                    logger.error(f"连接超时[{connection_url}]: {e}")
-                except Exception as e:
-                    logger.error(f"连接失败[{connection_url}]: {e}")
-                else:
-                    self.connection_urls.remove(connection_url)
-                    self.connection_urls.insert(0, connection_url)
-                    logger.success(f"连接成功[{connection_url}]!")
-                    break
-                await asyncio.sleep(1)
-            if ws:
-                break
-            await asyncio.sleep(1)
-
-        if ws:
-            self.state = "connected"
-            connected_clients.append(self)
-            self.ws = ws
-            self._start_task(self._read_loop)
+        # 各连接互不等待，某个服务端无法连接时不影响其他服务端的消息处理
+        self.dispatcher.start()
+        tasks = [c.start() for c in self.connections]
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        await metrics.start()
+        loop_monitor.start()
 
     async def disconnect(self):
-        if self.ws and not self.ws.closed:
-            self.state = "disconnecting"
-            await self.ws.close()
-            self.state = "disconnected"
-            connected_clients.remove(self)
-
-    async def _handle_reconnect(self):
-        logger.info("准备重连中...")
-        try:
-            await self.connect()
-        except:
-            pass
-        else:
-            self.reconnect_task = None
+        for connection in self.connections:
+            await connection.disconnect()
+        self.dispatcher.stop()
+        # 共享的Action连接池随连接一起释放
+        await close_shared_actions()
 
     async def wait(self):
-        while True:
-            if not self.ws:
-                break
-            await self.ws.wait_closed()
-            await asyncio.sleep(1)
-            if not self.reconnect_task:
-                break
-            await self.reconnect_task
-            if self.state != "connected":
-                break
+        """等待所有连接断开"""
+        await asyncio.gather(*(c.wait() for c in self.connections))
 
     def run(self, reload=False):
         """一键启动
@@ -244,15 +487,20 @@ class Botoy:
 
         async def handler(websocket: WebSocketServerProtocol):
             logger.info(f"建立连接 {websocket.id}")
+            self.dispatcher.start()
             try:
                 async for pkt in websocket:
                     if self.receivers:
-                        self._start_task(self._packet_handler, pkt)
+                        self.ingest.put(pkt)
             except ConnectionClosed:
                 pass
             logger.warning(f"连接断开 {websocket.id}")
 
         async def main():
+            await metrics.start()
+            loop_monitor.start()
+            if threading.current_thread() == threading.main_thread():
+                install_signal_handler(asyncio.get_running_loop())
             async with ws_serve(handler, "", port) as server:
                 logger.success(f"监听中 :{port}")
                 await server.wait_closed()
@@ -260,13 +508,4 @@ class Botoy:
         asyncio.get_event_loop().run_until_complete(main())
 
     def _get_ws_urls(self, url: str) -> List[str]:
-        if not re.match(r"^(http|https|ws|wss)://", url):
-            url = "ws://" + url
-
-        parsed_url = urlparse(url)
-        scheme = parsed_url.scheme
-        netloc = parsed_url.netloc
-
-        schemes = ["ws", "wss"] if scheme in ["http", "ws"] else ["wss", "ws"]
-
-        return [f"{s}://{netloc}/ws" for s in schemes]
+        return _get_ws_urls(url)
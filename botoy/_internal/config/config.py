@@ -1,7 +1,8 @@
-import json
 import threading
 from typing import Any, Generic, List, Optional, TypeVar, Union
 
+from .. import jsonlib
+from ..log import logger
 from .constants import CONFIG_FILE_PATH, DEFAULT_URL
 from .util import dict2tree, lookup
 
@@ -21,9 +22,15 @@ def read_botoy_config():
 
     with lock:
         try:
-            botoy_config.update(json.loads(CONFIG_FILE_PATH.read_text()))
+            botoy_config.update(jsonlib.loads(CONFIG_FILE_PATH.read_text()))
         except FileNotFoundError:
             pass
+        try:
+            jsonlib.set_backend(botoy_config.get("json.backend", jsonlib.BACKEND_AUTO))
+        except ValueError as e:
+            # 配置有误不影响启动
+            logger.warning(f"{e}, 使用默认配置 {jsonlib.BACKEND_AUTO}")
+            jsonlib.set_backend(jsonlib.BACKEND_AUTO)
 
         botoy_config_tree = dict2tree(botoy_config)
 
@@ -33,9 +40,7 @@ read_botoy_config()
 
 def write_botoy_config():
     with lock:
-        CONFIG_FILE_PATH.write_text(
-            json.dumps(botoy_config, ensure_ascii=False, indent=2), "utf8"
-        )
+        CONFIG_FILE_PATH.write_text(jsonlib.dumps(botoy_config, indent=2), "utf8")
 
 
 def update_botoy_config(key, value):
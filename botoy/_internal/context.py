@@ -1,13 +1,25 @@
-import json
 import re
 import traceback
 from abc import ABCMeta, abstractmethod
 from contextvars import ContextVar
+from enum import Enum
+from functools import cached_property, lru_cache
 from typing import Optional, Union
 
-from . import action, models
+from . import action, jsonlib, models
+from .config import jconfig
 from .log import logger
 from .utils import bind_contextvar
+from .view import DataView
+
+
+@lru_cache(maxsize=None)
+def strict_mode() -> bool:
+    """是否使用严格模式, 开启后消息数据使用pydantic模型完整校验，适合开发调试时使用
+    配置项: context.strict, 默认关闭, 此时消息数据为不做校验的惰性视图(DataView)
+    该配置仅在首次使用时读取
+    """
+    return bool(jconfig.get_configuration("context").get("strict", False))
 
 
 def c(obj, key, value):  # c => cache
@@ -18,8 +30,11 @@ def c(obj, key, value):  # c => cache
 class BaseMsg(metaclass=ABCMeta):
     @property
     @abstractmethod
-    def model(self) -> Union[models.GroupMsg, models.FriendMsg]:
-        """数据包结构"""
+    def model(self) -> Union[models.GroupMsg, models.FriendMsg, DataView]:
+        """数据包结构
+        默认为不做校验的惰性视图(DataView)，字段和枚举与模型一致；
+        开启严格模式(context.strict)后为pydantic模型
+        """
         ...
 
     @property
@@ -117,12 +132,18 @@ class BaseMsg(metaclass=ABCMeta):
 
 
 class GroupMsg(BaseMsg):
-    def __init__(self, data: Union[str, dict]):
+    def __init__(self, data: Union[str, bytes, dict]):
         super().__init__()
-        if isinstance(data, str):
-            model = models.GroupMsg.parse_raw(data)
-        else:
-            model = models.GroupMsg(**data)
+        if not strict_mode():
+            if isinstance(data, (str, bytes)):
+                data = jsonlib.loads(data)
+            assert classify_packet(data) is MsgKind.GROUP, "GroupMsg: 非群消息"
+            self.__model = DataView(data, models.GroupMsg)
+            return
+
+        if isinstance(data, (str, bytes)):
+            data = jsonlib.loads(data)
+        model = models.GroupMsg.parse_obj(data)
 
         assert (
             model.CurrentPacket.EventData.MsgHead.C2cCmd
@@ -137,7 +158,7 @@ class GroupMsg(BaseMsg):
         self.__model = model
 
     @property
-    def model(self) -> models.GroupMsg:
+    def model(self) -> Union[models.GroupMsg, DataView]:
         return self.__model
 
     @property
@@ -178,17 +199,22 @@ class GroupMsg(BaseMsg):
 
     async def revoke(self):
         """撤回该消息"""
-        async with action.Action(self.bot_qq) as a:
-            return await a.revoke(self)
+        return await action.Action.shared(self.bot_qq).revoke(self)
 
 
 class FriendMsg(BaseMsg):
-    def __init__(self, data: Union[str, dict]):
+    def __init__(self, data: Union[str, bytes, dict]):
         super().__init__()
-        if isinstance(data, str):
-            model = models.FriendMsg.parse_raw(data)
-        else:
-            model = models.FriendMsg(**data)
+        if not strict_mode():
+            if isinstance(data, (str, bytes)):
+                data = jsonlib.loads(data)
+            assert classify_packet(data) is MsgKind.FRIEND, "FriendMsg: 非好友消息"
+            self.__model = DataView(data, models.FriendMsg)
+            return
+
+        if isinstance(data, (str, bytes)):
+            data = jsonlib.loads(data)
+        model = models.FriendMsg.parse_obj(data)
 
         assert (
             model.CurrentPacket.EventData.MsgHead.C2cCmd
@@ -203,7 +229,7 @@ class FriendMsg(BaseMsg):
         self.__model = model
 
     @property
-    def model(self) -> models.FriendMsg:
+    def model(self) -> Union[models.FriendMsg, DataView]:
         return self.__model
 
     @property
@@ -245,21 +271,53 @@ class FriendMsg(BaseMsg):
         )
 
 
+class MsgKind(Enum):
+    """消息类型"""
+
+    GROUP = "group"
+    """群消息"""
+    FRIEND = "friend"
+    """好友消息(包括私聊)"""
+    EVENT = "event"
+    """事件消息"""
+    UNKNOWN = "unknown"
+    """未知消息"""
+
+
+def classify_packet(data: dict) -> MsgKind:
+    """根据原始数据中的 EventName 和 C2cCmd 判断消息类型，不做任何模型解析"""
+    packet = data.get("CurrentPacket")
+    if not isinstance(packet, dict):
+        return MsgKind.UNKNOWN
+    event_name = packet.get("EventName")
+    msg_head = (packet.get("EventData") or {}).get("MsgHead") or {}
+    c2c_cmd = msg_head.get("C2cCmd")
+    if event_name == "ON_EVENT_GROUP_NEW_MSG" and c2c_cmd == 0:
+        return MsgKind.GROUP
+    if event_name == "ON_EVENT_FRIEND_NEW_MSG" and c2c_cmd == 11:
+        return MsgKind.FRIEND
+    if isinstance(event_name, str) and event_name.startswith("ON_EVENT_"):
+        return MsgKind.EVENT
+    return MsgKind.UNKNOWN
+
+
 class EventMsg:
     def __init__(self, data):
-        model = models.EventMsg.parse_raw(data)  # type: ignore
+        if isinstance(data, (str, bytes)):
+            data = jsonlib.loads(data)
+        model = models.EventMsg.parse_obj(data)  # type: ignore
         self.model = model
 
 
 class Context:
-    def __init__(self, data: Union[str, dict]) -> None:
+    def __init__(self, data: Union[str, bytes, dict]) -> None:
         """
         :param data: websokets收到的原始包数据
         """
         if isinstance(data, dict):
             self.__data = data
         else:
-            self.__data = json.loads(data)
+            self.__data = jsonlib.loads(data)
 
     @property
     def data(self) -> dict:
@@ -271,28 +329,35 @@ class Context:
         """当前机器人QQ"""
         return self.data["CurrentQQ"]  # type: ignore
 
-    @property
+    # NOTE: 属性的结果缓存在实例上, 每个数据包只判断和解析一次
+    @cached_property
+    def kind(self) -> MsgKind:
+        """消息类型"""
+        return classify_packet(self.__data)
+
+    @cached_property
     def group_msg(self) -> Optional[GroupMsg]:
         msg = None
-        try:
-            msg = GroupMsg(self.__data)
-        except Exception:
-            logger.debug(f"filter message: {traceback.format_exc()}")
-
-        return c(self, "group_msg", msg)
+        if self.kind is MsgKind.GROUP:
+            try:
+                msg = GroupMsg(self.__data)
+            except Exception as e:
+                logger.debug(f"filter message: {e!r}")
+        return msg
 
     @property
     def g(self) -> Optional[GroupMsg]:
         return self.group_msg
 
-    @property
+    @cached_property
     def friend_msg(self) -> Optional[FriendMsg]:
         msg = None
-        try:
-            msg = FriendMsg(self.__data)
-        except Exception:
-            logger.debug(f"filter message: {traceback.format_exc()}")
-        return c(self, "friend_msg", msg)
+        if self.kind is MsgKind.FRIEND:
+            try:
+                msg = FriendMsg(self.__data)
+            except Exception as e:
+                logger.debug(f"filter message: {e!r}")
+        return msg
 
     @property
     def f(self) -> Optional[FriendMsg]:
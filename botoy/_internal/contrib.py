@@ -19,6 +19,8 @@ from typing import Any, Awaitable, Callable, Dict, Optional, Union
 
 import httpx
 
+from .action import close_shared_actions
+
 __all__ = [
     "file_to_base64",
     "get_cache_dir",
@@ -284,7 +286,11 @@ def sync_run(func):
     try:
         return loop.run_until_complete(coro)
     finally:
-        loop.close()
+        try:
+            # 该事件循环中创建的共享实例不会再被使用
+            loop.run_until_complete(close_shared_actions(current_only=True))
+        finally:
+            loop.close()
 
 
 # Zero-width character mapping
@@ -0,0 +1,180 @@
+"""接收函数分发索引
+
+根据接收函数声明的过滤条件(ReceiverFilter)预先建立索引，数据包到达时只唤醒可能匹配的接收函数
+
+- 消息类型、群号: 字典
+- 前缀: 字典树
+- 关键字和正则: 合并为一个正则快速排除，命中后再逐个判断
+"""
+
+import re
+from typing import Dict, List, Optional, Set
+
+from .context import Context, MsgKind
+from .receiver import Receiver, session_registry
+
+
+class PrefixTrie:
+    """前缀字典树, 查询文本时返回所有前缀命中的值"""
+
+    __slots__ = ("root",)
+
+    def __init__(self):
+        self.root: dict = {}
+
+    def add(self, prefix: str, value):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(value)
+
+    def search(self, text: str) -> Set:
+        found = set()
+        node = self.root
+        if None in node:
+            found.update(node[None])
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                found.update(node[None])
+        return found
+
+
+# 可以写成内联形式的正则flags
+_INLINE_FLAGS = {
+    re.IGNORECASE: "i",
+    re.MULTILINE: "m",
+    re.DOTALL: "s",
+    re.VERBOSE: "x",
+    re.ASCII: "a",
+}
+
+
+def _inline_pattern(pattern: re.Pattern) -> Optional[str]:
+    """将编译时的flags写入正则文本，用于合并多个正则，无法合并时返回None
+
+    含有分组的正则不合并，合并后分组编号改变，反向引用会指向其他正则的分组
+    """
+    if pattern.groups:
+        return None
+    flags = pattern.flags & ~re.UNICODE
+    letters = ""
+    for flag, letter in _INLINE_FLAGS.items():
+        if flags & flag:
+            letters += letter
+            flags &= ~flag
+    if flags or not isinstance(pattern.pattern, str):
+        return None
+    if letters:
+        return f"(?{letters}:{pattern.pattern})"
+    return pattern.pattern
+
+
+class DispatchIndex:
+    def __init__(self, receivers: List[Receiver]):
+        self.receivers = receivers
+        self._order = {id(r): idx for idx, r in enumerate(receivers)}
+
+        # 没有过滤条件的接收函数
+        self._always: List[Receiver] = []
+        # 有过滤条件的接收函数
+        self._filtered: Dict[int, Receiver] = {}
+        # 消息类型 => 未设置群号白名单的接收函数
+        self._by_kind: Dict[MsgKind, List[Receiver]] = {kind: [] for kind in MsgKind}
+        # 群号 => 设置了群号白名单的接收函数
+        self._by_group: Dict[int, List[Receiver]] = {}
+
+        self._prefix_trie = PrefixTrie()
+        self._text_pattern: Optional[re.Pattern] = None
+
+        patterns: Optional[List[str]] = []
+        for receiver in receivers:
+            receiver_filter = receiver.filter
+            if receiver_filter is None or receiver_filter.empty:
+                self._always.append(receiver)
+                continue
+            self._filtered[id(receiver)] = receiver
+            if receiver_filter.groups:
+                if MsgKind.GROUP in receiver_filter.effective_kinds:
+                    for group in receiver_filter.groups:
+                        self._by_group.setdefault(group, []).append(receiver)
+            else:
+                for kind in receiver_filter.effective_kinds:
+                    self._by_kind[kind].append(receiver)
+            for prefix in receiver_filter.prefixes:
+                self._prefix_trie.add(prefix, id(receiver))
+            if patterns is None:
+                continue
+            patterns.extend(re.escape(k) for k in receiver_filter.keywords)
+            for pattern in receiver_filter.patterns:
+                inline = _inline_pattern(pattern)
+                if inline is None:
+                    # 该正则无法合并，就不做预先排除
+                    patterns = None
+                    break
+                patterns.append(inline)
+
+        if patterns:
+            try:
+                self._text_pattern = re.compile("|".join(f"(?:{p})" for p in patterns))
+            except re.error:
+                # 正则中含有全局内联flags等情况无法合并，就不做预先排除
+                self._text_pattern = None
+
+    def _candidates(self, ctx: Context) -> List[Receiver]:
+        kind = ctx.kind
+        candidates = self._by_kind[kind]
+        if kind is MsgKind.GROUP and self._by_group:
+            group = ctx.g.from_group if ctx.g else None
+            if group in self._by_group:
+                candidates = candidates + self._by_group[group]
+        if not candidates:
+            return []
+
+        msg = ctx.g or ctx.f
+        text = (msg.text or "") if msg is not None else ""
+        prefix_hits = self._prefix_trie.search(text)
+        text_possible = (
+            self._text_pattern is None or self._text_pattern.search(text) is not None
+        )
+        is_at_bot: Optional[bool] = None
+
+        matched = []
+        for receiver in candidates:
+            receiver_filter = receiver.filter
+            if receiver_filter.prefixes and id(receiver) not in prefix_hits:
+                continue
+            if receiver_filter.keywords or receiver_filter.patterns:
+                if not text_possible:
+                    continue
+                if receiver_filter.keywords and not any(
+                    k in text for k in receiver_filter.keywords
+                ):
+                    continue
+                if receiver_filter.patterns and not any(
+                    p.search(text) for p in receiver_filter.patterns
+                ):
+                    continue
+            if receiver_filter.at_bot:
+                if is_at_bot is None:
+                    is_at_bot = bool(ctx.g and ctx.g.is_at_bot)
+                if not is_at_bot:
+                    continue
+            matched.append(receiver)
+        return matched
+
+    def match(self, ctx: Context) -> List[Receiver]:
+        """返回需要处理该数据包的接收函数, 顺序与注册顺序一致"""
+        matched = self._candidates(ctx)
+        # 存在对应会话的接收函数需要接收后续消息，不受过滤条件限制
+        if session_ids := session_registry.receiver_ids(ctx):
+            matched_ids = {id(r) for r in matched}
+            for rid in session_ids - matched_ids:
+                receiver = self._filtered.get(rid)
+                if receiver is not None and session_registry.lookup(receiver, ctx):
+                    matched.append(receiver)
+        if not matched:
+            return list(self._always)
+        return sorted(self._always + matched, key=lambda r: self._order[id(r)])
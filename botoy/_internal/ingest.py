@@ -0,0 +1,237 @@
+"""数据包接收队列
+
+websockets 收到的数据包先放入有界队列，再由固定数量的分发协程取出处理，
+消息洪水时按丢弃策略丢弃数据包，内存占用可控
+
+配置项(botoy.json)::
+
+    {
+      "ingest.maxsize": 1000,          // 队列最大长度
+      "ingest.workers": 4,             // 分发协程数
+      "ingest.max_pending": 1000,      // 同时处理中的数据包上限，达到后暂停分发
+      "ingest.policy": "drop_oldest",  // 队列满时的丢弃策略 drop_oldest/drop_newest/drop_by_group
+      "ingest.friend_priority": true   // 好友消息优先处理，并且尽量不被丢弃
+    }
+"""
+
+import asyncio
+import functools
+from collections import Counter, deque
+from typing import Deque, List, Optional, Tuple, Union
+
+from . import jsonlib
+from .config import jconfig
+from .context import MsgKind, classify_packet
+from .log import logger
+
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DROP_NEWEST = "drop_newest"
+POLICY_DROP_BY_GROUP = "drop_by_group"
+
+# (群号, 数据), 非群消息群号为0
+_Item = Tuple[int, dict]
+
+
+class IngestQueue:
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        policy: str = POLICY_DROP_OLDEST,
+        friend_priority: bool = True,
+    ):
+        if policy not in (
+            POLICY_DROP_OLDEST,
+            POLICY_DROP_NEWEST,
+            POLICY_DROP_BY_GROUP,
+        ):
+            raise ValueError(f"不支持的丢弃策略: {policy}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.friend_priority = friend_priority
+
+        self._priority: Deque[_Item] = deque()
+        self._normal: Deque[_Item] = deque()
+        self._group_counts: Counter = Counter()
+        self._getters: Deque[asyncio.Future] = deque()
+
+        # counters
+        self.received = 0
+        self.dropped = 0
+        self.invalid = 0
+
+    @classmethod
+    def from_config(cls) -> "IngestQueue":
+        config = jconfig.get_configuration("ingest")
+        return cls(
+            maxsize=config.get("maxsize", 1000),
+            policy=config.get("policy", POLICY_DROP_OLDEST),
+            friend_priority=config.get("friend_priority", True),
+        )
+
+    @property
+    def queued(self) -> int:
+        """当前排队的数据包数"""
+        return len(self._priority) + len(self._normal)
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "queued": self.queued,
+            "dropped": self.dropped,
+            "invalid": self.invalid,
+        }
+
+    def _drop(self, item: _Item):
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 100 == 0:
+            logger.warning(f"消息过多，已丢弃{self.dropped}个数据包 {self.stats()}")
+
+    def _pop(self, queue: Deque[_Item]) -> _Item:
+        item = queue.popleft()
+        if item[0]:
+            self._group_counts[item[0]] -= 1
+            if self._group_counts[item[0]] <= 0:
+                del self._group_counts[item[0]]
+        return item
+
+    def _make_room(self, incoming: _Item, priority: bool) -> bool:
+        """队列已满时腾出空间，返回是否接收新数据包"""
+        if self.policy == POLICY_DROP_NEWEST:
+            return False
+
+        if self.policy == POLICY_DROP_BY_GROUP and self._group_counts:
+            # 丢弃排队最多的群中最早的数据包
+            group, count = self._group_counts.most_common(1)[0]
+            if incoming[0] == group or count > 1:
+                for idx, item in enumerate(self._normal):
+                    if item[0] == group:
+                        del self._normal[idx]
+                        self._group_counts[group] -= 1
+                        if self._group_counts[group] <= 0:
+                            del self._group_counts[group]
+                        self._drop(item)
+                        return True
+
+        # drop_oldest, 优先丢弃普通队列
+        if self._normal:
+            self._drop(self._pop(self._normal))
+            return True
+        if priority and self._priority:
+            self._drop(self._pop(self._priority))
+            return True
+        return False
+
+    def put(self, pkt: Union[str, bytes, dict]) -> bool:
+        """放入数据包，返回是否成功放入"""
+        self.received += 1
+        if not isinstance(pkt, dict):
+            try:
+                pkt = jsonlib.loads(pkt)
+            except ValueError:
+                self.invalid += 1
+                return False
+        kind = classify_packet(pkt)  # type: ignore
+        group = 0
+        if kind is MsgKind.GROUP:
+            msg_head = pkt["CurrentPacket"]["EventData"]["MsgHead"]  # type: ignore
+            group = msg_head.get("FromUin") or 0
+        item: _Item = (group, pkt)  # type: ignore
+        priority = self.friend_priority and kind is MsgKind.FRIEND
+
+        if self.queued >= self.maxsize and not self._make_room(item, priority):
+            self._drop(item)
+            return False
+
+        (self._priority if priority else self._normal).append(item)
+        if group:
+            self._group_counts[group] += 1
+        self._wakeup()
+        return True
+
+    def _wakeup(self):
+        while self._getters:
+            getter = self._getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+                break
+
+    async def get(self) -> dict:
+        """取出数据包，队列为空时等待"""
+        while not self.queued:
+            getter = asyncio.get_running_loop().create_future()
+            self._getters.append(getter)
+            try:
+                await getter
+            except asyncio.CancelledError:
+                getter.cancel()
+                # 被取消时把唤醒机会让给其他等待者
+                if self.queued:
+                    self._wakeup()
+                raise
+        if self._priority:
+            return self._pop(self._priority)[1]
+        return self._pop(self._normal)[1]
+
+
+class Dispatcher:
+    """从接收队列中取出数据包并启动处理任务"""
+
+    def __init__(self, queue: IngestQueue, handler, workers: int, max_pending: int):
+        """
+        :param queue: 接收队列
+        :param handler: 数据包处理函数(协程函数)
+        :param workers: 分发协程数
+        :param max_pending: 同时处理中的数据包上限
+        """
+        self.queue = queue
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.processed = 0
+        self.pending = 0  # 处理中的数据包数
+        self._tasks: List[asyncio.Task] = []
+        # 在事件循环中创建，同一事件循环中重新启动时继续使用
+        self._pending: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def running(self) -> bool:
+        return any(not t.done() for t in self._tasks)
+
+    def stats(self) -> dict:
+        return {
+            **self.queue.stats(),
+            "pending": self.pending,
+            "processed": self.processed,
+        }
+
+    def start(self):
+        if self.running:
+            return
+        loop = asyncio.get_event_loop()
+        if self._pending is None or self._loop is not loop:
+            self._pending = asyncio.Semaphore(self.max_pending)
+            self._loop = loop
+        self._tasks = [
+            asyncio.ensure_future(self._worker()) for _ in range(self.workers)
+        ]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def _done(self, pending: asyncio.Semaphore, _):
+        self.pending -= 1
+        self.processed += 1
+        # 释放获取时的信号量，重新启动后替换的信号量不受影响
+        pending.release()
+
+    async def _worker(self):
+        pending: asyncio.Semaphore = self._pending  # type: ignore
+        while True:
+            pkt = await self.queue.get()
+            await pending.acquire()
+            self.pending += 1
+            task = asyncio.ensure_future(self.handler(pkt))
+            task.add_done_callback(functools.partial(self._done, pending))
@@ -0,0 +1,88 @@
+"""JSON 编解码
+
+自动选择已安装的最快实现: orjson > ujson > json(标准库)，安装: ``pip install orjson``
+
+可通过配置项指定(botoy.json)::
+
+    {
+      "json.backend": "auto"  // auto/orjson/ujson/json
+    }
+
+各模块统一使用``jsonlib.loads``, ``jsonlib.dumps``, ``jsonlib.dumpb``，
+切换实现后立即生效，不要直接导入这些函数
+"""
+
+import json as _json
+from typing import Any, Callable, Optional, Union
+
+BACKEND_AUTO = "auto"
+BACKEND_ORJSON = "orjson"
+BACKEND_UJSON = "ujson"
+BACKEND_JSON = "json"
+
+backend: str = BACKEND_JSON
+
+_loads: Callable[[Union[str, bytes]], Any] = _json.loads
+_dumpb: Callable[[Any], bytes] = lambda obj: _std_dumps(obj).encode()
+
+
+def _std_dumps(obj: Any, indent: Optional[int] = None) -> str:
+    return _json.dumps(obj, ensure_ascii=False, indent=indent)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """解码, 数据格式有误时抛出ValueError"""
+    return _loads(data)
+
+
+def dumpb(obj: Any) -> bytes:
+    """编码为utf8 bytes, 用于请求内容"""
+    try:
+        return _dumpb(obj)
+    except (TypeError, OverflowError):
+        # orjson 不支持超出64位的整数等情况
+        return _std_dumps(obj).encode()
+
+
+def dumps(obj: Any, indent: Optional[int] = None) -> str:
+    """编码为字符串，非ASCII字符不转义
+    :param indent: 缩进
+    """
+    if indent is None:
+        return dumpb(obj).decode()
+    return _std_dumps(obj, indent)
+
+
+def set_backend(name: str = BACKEND_AUTO) -> str:
+    """切换实现，返回实际使用的实现
+    :param name: auto/orjson/ujson/json, 指定的实现未安装时使用标准库
+    """
+    global backend, _loads, _dumpb
+    if name not in (BACKEND_AUTO, BACKEND_ORJSON, BACKEND_UJSON, BACKEND_JSON):
+        raise ValueError(f"不支持的JSON实现: {name}")
+
+    if name in (BACKEND_AUTO, BACKEND_ORJSON):
+        try:
+            import orjson  # type: ignore
+        except ImportError:
+            pass
+        else:
+            backend, _loads, _dumpb = BACKEND_ORJSON, orjson.loads, orjson.dumps
+            return backend
+
+    if name in (BACKEND_AUTO, BACKEND_UJSON):
+        try:
+            import ujson  # type: ignore
+        except ImportError:
+            pass
+        else:
+            backend, _loads = BACKEND_UJSON, ujson.loads
+            _dumpb = lambda obj: ujson.dumps(obj, ensure_ascii=False).encode()
+            return backend
+
+    backend, _loads = BACKEND_JSON, _json.loads
+    _dumpb = lambda obj: _std_dumps(obj).encode()
+    return backend
+
+
+set_backend()
@@ -1,2 +1,4 @@
 IS_RECEIVER = "is_receiver"
 RECEIVER_INFO = "_receiver_info"
+RECEIVER_FILTER = "_receiver_filter"
+RECEIVER_OPTIONS = "_receiver_options"
@@ -5,27 +5,44 @@ from urllib.parse import urlparse
 import httpx
 import uvicorn
 from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 
+from . import jsonlib
 from .client import Botoy
 from .config import jconfig
 from .log import logger
+from .metrics import metrics
+from .monitor import loop_monitor
 
 # botoy.json 新增项
 # mahiro_listen_url: botoy服务端监听地址，如 0.0.0.0:8099
 # mahiro_server_url: mahiro服务地址，如 http://0.0.0.0:8098
+# mahiro.register_concurrency: 同时注册插件的数量，默认为10
 # 以上默认值与mahiro中默认值一致
 #
 
 
 class Mahiro(Botoy):
+    # 注册插件失败时的重试次数
+    REGISTER_RETRIES = 5
+    # 等待token的最大次数，每次请求后最多等待 TOKEN_WAIT 秒
+    TOKEN_ATTEMPTS = 120  # 重试这么多次不行就打120吧
+    TOKEN_WAIT = 4
+
     def __init__(self):
         super().__init__()
         self.app = FastAPI()
         self._token = ""
+        # 以下对象绑定事件循环，在服务启动后创建
+        self._client: Optional[httpx.AsyncClient] = None
+        self._token_event: Optional[asyncio.Event] = None
+        self._token_task: Optional[asyncio.Future] = None
         mahiro = jconfig.get_configuration("mahiro")
+        self.register_concurrency = max(1, mahiro.get("register_concurrency", 10))
         address = mahiro.get("listen_url", "http://0.0.0.0:8099")
         if not address.startswith("http"):
-            self.default_address = f"http://{address}"
+            address = f"http://{address}"
+        self.default_address = address
         server = mahiro.get("server_url", "http://localhost:8098")
         if not server.startswith("http"):
             server = f"http://{server}"
@@ -35,14 +52,23 @@ class Mahiro(Botoy):
 
     def set_token(self, token: str):
         self._token = token
+        if token and self._token_event is not None:
+            self._token_event.set()
 
     @property
     def headers(self):
         return {"x-mahiro-token": self._token}
 
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """与mahiro服务端通信的共享连接池"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=20)
+        return self._client
+
     async def __message_handler(self, req: Request):
         await self.__ensure_token()
-        data = await req.json()
+        data = jsonlib.loads(await req.body())
         self._start_task(
             self._packet_handler,
             data["raw"],
@@ -51,39 +77,87 @@ class Mahiro(Botoy):
         return {"code": 200}
 
     async def __exchange_authentication(self, req: Request):
-        data = await req.json()
+        data = jsonlib.loads(await req.body())
         self.set_token(data["token"])
-        for receiver in self.receivers:
-            name = "BOTOY " + receiver.info.name
-            httpx.post(
-                self.REGISTER_PLUGIN_URL,
-                headers=self.headers,
-                json={"name": name},
-                timeout=20,
+        # 注册插件在后台进行，不阻塞请求处理
+        self._start_task(self.__register_plugins)
+
+    async def __register_plugins(self):
+        semaphore = asyncio.Semaphore(self.register_concurrency)
+        await asyncio.gather(
+            *(
+                self.__register_plugin("BOTOY " + receiver.info.name, semaphore)
+                for receiver in self.receivers
             )
-            logger.info("Registered mahiro plugin: " + name)
+        )
+
+    async def __register_plugin(self, name: str, semaphore: asyncio.Semaphore):
+        delay = 0.5
+        async with semaphore:
+            for attempt in range(1, self.REGISTER_RETRIES + 1):
+                try:
+                    resp = await self.http.post(
+                        self.REGISTER_PLUGIN_URL,
+                        headers=self.headers,
+                        json={"name": name},
+                    )
+                    resp.raise_for_status()
+                except httpx.HTTPError as e:
+                    if attempt == self.REGISTER_RETRIES:
+                        logger.error(f"Failed to register mahiro plugin: {name} {e}")
+                        return
+                    await asyncio.sleep(delay)
+                    delay *= 2
+                else:
+                    logger.info("Registered mahiro plugin: " + name)
+                    return
 
     async def __request_token(self):
-        async with httpx.AsyncClient() as client:
-            await client.post(self.GET_TOKEN_URL, timeout=20)
+        try:
+            await self.http.post(self.GET_TOKEN_URL)
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to request mahiro token: {e}")
 
     async def __ensure_token(self):
-        times = 0
-        while self._token == "" and times < 120:  # 重试这么多次不行就打120吧
-            times += 1
-            await self.__request_token()
-            # 留时间给server端把token传过来
-            await asyncio.sleep(2)  # 先留2秒应该够了
+        if self._token:
+            return
+        # 同时到达的请求共用一个等待任务
+        if self._token_task is None or self._token_task.done():
+            self._token_task = asyncio.ensure_future(self.__wait_token())
+        await asyncio.shield(self._token_task)
+
+    async def __wait_token(self):
+        if self._token_event is None:
+            self._token_event = asyncio.Event()
+        for _ in range(self.TOKEN_ATTEMPTS):
             if self._token:
-                break
-            # 不够再加
-            await asyncio.sleep(2)
+                return
+            await self.__request_token()
+            # server端通过 /recive/auth 把token传过来
+            try:
+                await asyncio.wait_for(self._token_event.wait(), self.TOKEN_WAIT)
+            except asyncio.TimeoutError:
+                pass
+
+    async def __close(self):
+        if self._client is not None:
+            await self._client.aclose()
 
     def __setup_routes(self):
         self.app.post("/recive/group")(self.__message_handler)
         self.app.post("/recive/friend")(self.__message_handler)
         self.app.get("/recive/health")(lambda: {"code": 200, "version": "1.5.0"})
         self.app.post("/recive/auth")(self.__exchange_authentication)
+        self.app.router.on_shutdown.append(self.__close)
+        if metrics.enabled:
+            self.app.get("/metrics")(
+                lambda: PlainTextResponse(
+                    metrics.render(), media_type="text/plain; version=0.0.4"
+                )
+            )
+            self.app.router.on_startup.append(metrics.start)
+        if loop_monitor.enabled:
+            self.app.router.on_startup.append(loop_monitor.start)
 
     def listen(
         self,
@@ -0,0 +1,213 @@
+"""群成员目录
+
+按群缓存成员列表，并建立 uin/uid 索引，查询成员和判断管理员为 O(1) 操作
+
+- 同一个群同时只会有一个拉取请求，并发的调用共享结果
+- 收到进群事件时使该群缓存失效，退群事件直接从缓存中移除该成员
+- ``queryUinByUid`` 的结果同样会被缓存
+
+配置项(botoy.json)::
+
+    {
+      "action.members.enabled": true,   // 是否启用
+      "action.members.ttl": 300,        // 群成员列表过期时间(秒)
+      "action.members.maxsize": 256,    // 最多缓存的群数量
+      "action.members.uid_ttl": 3600    // uid 查询结果过期时间(秒)
+    }
+"""
+
+from typing import Any, Dict, List, Optional, Union
+
+from .cache import SingleFlight, TTLCache
+from .config import jconfig
+
+_MISSING = object()
+
+# MemberFlag
+FLAG_OWNER = 1
+FLAG_ADMIN = 2
+
+EVENT_GROUP_JOIN = "ON_EVENT_GROUP_JOIN"
+EVENT_GROUP_EXIT = "ON_EVENT_GROUP_EXIT"
+
+
+class GroupMembers:
+    """一个群的成员列表及索引"""
+
+    __slots__ = ("group", "members", "by_uin", "by_uid")
+
+    def __init__(self, group: int, members: List[dict]):
+        self.group = group
+        self.members = members
+        self.by_uin: Dict[int, dict] = {}
+        self.by_uid: Dict[str, dict] = {}
+        for member in members:
+            if "Uin" in member:
+                self.by_uin[member["Uin"]] = member
+            if "Uid" in member:
+                self.by_uid[member["Uid"]] = member
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def get(self, user: Union[int, str]) -> Optional[dict]:
+        """查找成员
+        :param user: QQ号(int)或uid(str)
+        """
+        if isinstance(user, str):
+            return self.by_uid.get(user)
+        return self.by_uin.get(user)
+
+    def is_admin(self, user: Union[int, str], include_owner: bool = True) -> bool:
+        """是否为管理员
+        :param user: QQ号(int)或uid(str)
+        :param include_owner: 群主是否算作管理员
+        """
+        member = self.get(user)
+        if member is None:
+            return False
+        flag = member.get("MemberFlag")
+        return flag == FLAG_ADMIN or (include_owner and flag == FLAG_OWNER)
+
+    def admins(self, include_owner: bool = True) -> List[dict]:
+        flags = (FLAG_OWNER, FLAG_ADMIN) if include_owner else (FLAG_ADMIN,)
+        return [m for m in self.members if m.get("MemberFlag") in flags]
+
+    def remove(self, user: Union[int, str]) -> bool:
+        """移除成员，返回是否存在该成员"""
+        member = self.get(user)
+        if member is None:
+            return False
+        self.by_uin.pop(member.get("Uin"), None)  # type: ignore
+        self.by_uid.pop(member.get("Uid"), None)  # type: ignore
+        self.members = [m for m in self.members if m is not member]
+        return True
+
+
+class MemberDirectory:
+    """群成员目录，多个机器人共用，以群号区分"""
+
+    def __init__(self, ttl: float = 300, maxsize: int = 256, uid_ttl: float = 3600):
+        """
+        :param ttl: 群成员列表过期时间(秒)
+        :param maxsize: 最多缓存的群数量
+        :param uid_ttl: uid 查询结果过期时间(秒)
+        """
+        self.groups = TTLCache(maxsize, ttl)
+        self.uids = TTLCache(maxsize * 64, uid_ttl)
+        self.fetches = 0
+        # 同一个群同时只拉取一次
+        self.flight = SingleFlight()
+        # 缓存失效计数，拉取期间群发生变化时不缓存拉取结果
+        self._versions: Dict[int, int] = {}
+
+    @classmethod
+    def from_config(cls) -> Optional["MemberDirectory"]:
+        config = jconfig.get_configuration("action.members")
+        if not config.get("enabled", True):
+            return None
+        return cls(
+            ttl=config.get("ttl", 300),
+            maxsize=config.get("maxsize", 256),
+            uid_ttl=config.get("uid_ttl", 3600),
+        )
+
+    async def get(self, action, group: int, refresh: bool = False) -> GroupMembers:
+        """获取群成员
+        :param action: 用于拉取成员列表的``Action``
+        :param group: 群号
+        :param refresh: 忽略缓存重新拉取
+        """
+        if not refresh:
+            entry = self.groups.get(group)
+            if entry is not None:
+                return entry
+
+        async def fetch():
+            version = self._versions.get(group, 0)
+            self.fetches += 1
+            members = await action._fetchGroupMembers(group)
+            entry = GroupMembers(group, members)
+            if self._versions.get(group, 0) == version:
+                self.groups.set(group, entry)
+            return entry
+
+        return await self.flight.do(("group", group), fetch)
+
+    async def query_uid(self, action, uid: str):
+        """uid 转 uin, 结果为``Action.QueryUinByUidResponse``"""
+        resp = self.uids.get(uid)
+        if resp is not None:
+            return resp
+
+        async def fetch():
+            resp = await action._queryUinByUid(uid)
+            self.uids.set(uid, resp)
+            return resp
+
+        return await self.flight.do(("uid", uid), fetch)
+
+    def invalidate(self, group: Optional[int] = None):
+        """使缓存失效
+        :param group: 群号, 不传则清空所有群
+        """
+        if group is None:
+            for key in self._versions:
+                self._versions[key] += 1
+            self.groups.clear()
+        else:
+            self._versions[group] = self._versions.get(group, 0) + 1
+            self.groups.pop(group)
+
+    def on_event(self, data: dict):
+        """根据进群退群事件更新缓存
+        :param data: 事件的原始数据
+        """
+        packet = data.get("CurrentPacket") or {}
+        event_name = packet.get("EventName")
+        if event_name not in (EVENT_GROUP_JOIN, EVENT_GROUP_EXIT):
+            return
+        event_data = packet.get("EventData") or {}
+        msg_head = event_data.get("MsgHead") or {}
+        event = event_data.get("Event") or {}
+        # 不同版本群号所在字段不同
+        groups = {
+            g
+            for g in (msg_head.get("FromUin"), msg_head.get("ToUid"))
+            if isinstance(g, int) and g
+        }
+        uid = event.get("Uid")
+        for group in groups:
+            entry = self.groups.get(group)
+            if event_name == EVENT_GROUP_EXIT and entry is not None and uid:
+                # 退群直接移除，拉取中的结果可能已过时，不再缓存
+                entry.remove(uid)
+                self._versions[group] = self._versions.get(group, 0) + 1
+            else:
+                # 进群事件中没有完整的成员信息，下次使用时重新拉取
+                self.invalidate(group)
+
+    def stats(self) -> dict:
+        return {
+            "groups": self.groups.stats(),
+            "uids": self.uids.stats(),
+            "fetches": self.fetches,
+            "inflight": self.flight.inflight,
+        }
+
+
+_member_directory: Any = _MISSING
+
+
+def get_member_directory() -> Optional[MemberDirectory]:
+    """全局群成员目录，未启用时返回None"""
+    global _member_directory
+    if _member_directory is _MISSING:
+        _member_directory = MemberDirectory.from_config()
+    return _member_directory
+
+
+def set_member_directory(directory: Optional[MemberDirectory]):
+    """替换全局群成员目录, 传入None则关闭缓存"""
+    global _member_directory
+    _member_directory = directory
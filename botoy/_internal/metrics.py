@@ -0,0 +1,377 @@
+"""运行指标
+
+计数器、仪表和直方图，可导出为 Prometheus 文本格式，通过HTTP接口提供或定时推送给回调函数
+
+配置项(botoy.json)::
+
+    {
+      "metrics.enabled": false,     // 是否启用，关闭时各处埋点只有一次属性判断的开销
+      "metrics.port": 0,            // 大于0时在该端口提供 /metrics 接口
+      "metrics.host": "0.0.0.0",    // 接口监听地址
+      "metrics.push_interval": 0    // 大于0时按该间隔(秒)调用``add_push_callback``添加的回调
+    }
+
+内置指标:
+
+- ``botoy_packets_total{kind}``: 收到的数据包
+- ``botoy_ingest{stat}``: 接收队列统计, 同``Botoy.stats()``
+- ``botoy_receiver_calls_total{receiver}``: 接收函数执行次数
+- ``botoy_receiver_errors_total{receiver}``: 接收函数异常次数
+- ``botoy_receiver_seconds{receiver}``: 接收函数执行耗时
+- ``botoy_receiver_timeouts_total{receiver}``: 接收函数执行超时次数
+- ``botoy_receiver_slow_total{receiver}``: 接收函数执行时间超过``receiver.slow_threshold``的次数
+- ``botoy_sessions``: 进行中的会话数
+- ``botoy_action_requests_total{cmd, ret}``: 接口请求次数，``ret``为``CgiBaseResponse.Ret``
+- ``botoy_action_errors_total{cmd}``: 接口请求异常(超时、连接失败等)次数
+- ``botoy_action_seconds{cmd}``: 接口请求耗时
+- ``botoy_connects_total{result}``: 连接次数
+- ``botoy_reconnects_total``: 重连次数
+- ``botoy_connected``: 当前连接数
+- ``botoy_loop_lag_seconds``: 事件循环调度延迟，需要启用``loop_monitor``
+- ``botoy_loop_blocked_total{receiver}``: 事件循环阻塞次数及阻塞时正在执行的接收函数，需要启用``loop_monitor``
+"""
+
+import asyncio
+import bisect
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .config import jconfig
+from .log import logger
+
+# (名称后缀, 标签, 值)
+_Sample = Tuple[str, Dict[str, str], float]
+
+
+class LatencyHistogram:
+    """耗时直方图(秒), 线程安全"""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        idx = bisect.bisect_left(self.BUCKETS, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> dict:
+        """各区间为累计数量, 与Prometheus的histogram一致"""
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        buckets = {}
+        cumulative = 0
+        for bound, n in zip(self.BUCKETS + (float("inf"),), counts):
+            cumulative += n
+            buckets[bound] = cumulative
+        return {"buckets": buckets, "sum": total, "count": count}
+
+
+class _Value:
+    __slots__ = ("value", "function", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """导出时调用该函数获取值"""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class Metric:
+    """指标，有标签时通过``labels``获取对应的子项"""
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self) -> Any:
+        return _Value()
+
+    def labels(self, *values) -> Any:
+        """
+        :param values: 标签值，与``labelnames``一一对应
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签: {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(
+                    tuple(str(v) for v in values), self._new_child()
+                )
+                self._children[values] = child
+        return child
+
+    def _items(self) -> Iterator[Tuple[Dict[str, str], Any]]:
+        seen = set()
+        for values, child in list(self._children.items()):
+            if id(child) in seen:
+                continue
+            seen.add(id(child))
+            yield dict(zip(self.labelnames, (str(v) for v in values))), child
+
+    def samples(self) -> Iterator[_Sample]:
+        for labels, child in self._items():
+            yield "", labels, child.get()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def _new_child(self) -> LatencyHistogram:
+        return LatencyHistogram()
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> Iterator[_Sample]:
+        for labels, child in self._items():
+            snapshot = child.snapshot()
+            for bound, count in snapshot["buckets"].items():
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield "_bucket", {**labels, "le": le}, count
+            yield "_sum", labels, snapshot["sum"]
+            yield "_count", labels, snapshot["count"]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = False):
+        """
+        :param enabled: 是否启用, 埋点处先判断该属性
+        """
+        self.enabled = enabled
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._push_callbacks: List[Callable[[List[_Sample]], Any]] = []
+        self._lock = threading.Lock()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._push_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls) -> "MetricsRegistry":
+        config = jconfig.get_configuration("metrics")
+        return cls(enabled=bool(config.get("enabled", False)))
+
+    def _register(self, cls, name: str, documentation: str, labelnames) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.type}")
+        return metric
+
+    def counter(self, name: str, documentation: str = "", labelnames=()) -> Counter:
+        """获取或注册计数器"""
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str = "", labelnames=()) -> Gauge:
+        """获取或注册仪表"""
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str = "", labelnames=()) -> Histogram:
+        """获取或注册直方图(秒)"""
+        return self._register(Histogram, name, documentation, labelnames)
+
+    def add_collector(self, collector: Callable[[], None]):
+        """添加导出前调用的函数，用于更新需要即时计算的指标"""
+        self._collectors.append(collector)
+
+    def add_push_callback(self, callback: Callable[[List[_Sample]], Any]):
+        """添加推送回调，按``metrics.push_interval``定时调用, 参数为``samples()``的结果"""
+        self._push_callbacks.append(callback)
+
+    def _collect(self):
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"指标收集出错: {e!r}")
+
+    def samples(self) -> List[_Sample]:
+        """所有指标的当前值 [(完整名称, 标签, 值)]"""
+        self._collect()
+        return [
+            (metric.name + suffix, labels, value)
+            for metric in list(self._metrics.values())
+            for suffix, labels, value in metric.samples()
+        ]
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        self._collect()
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                name = metric.name + suffix
+                if labels:
+                    text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                    lines.append(f"{name}{{{text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    async def start(self):
+        """按配置启动HTTP接口和定时推送, 可重复调用"""
+        if not self.enabled:
+            return
+        config = jconfig.get_configuration("metrics")
+        port = config.get("port", 0)
+        if port and self._server is None:
+            host = config.get("host", "0.0.0.0")
+            self._server = await asyncio.start_server(self._handle, host, port)
+            logger.info(f"指标接口: http://{host}:{port}/metrics")
+        interval = config.get("push_interval", 0)
+        if interval and (self._push_task is None or self._push_task.done()):
+            self._push_task = asyncio.ensure_future(self._push_loop(interval))
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._push_task is not None:
+            self._push_task.cancel()
+            self._push_task = None
+
+    async def _push_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            if not self._push_callbacks:
+                continue
+            samples = self.samples()
+            for callback in self._push_callbacks:
+                try:
+                    ret = callback(samples)
+                    if asyncio.iscoroutine(ret):
+                        await ret
+                except Exception as e:
+                    logger.warning(f"指标推送出错: {e!r}")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+            if path.split(b"?")[0] in (b"/metrics", b"/"):
+                status = b"200 OK"
+                body = self.render().encode()
+            else:
+                status, body = b"404 Not Found", b""
+            writer.write(
+                b"HTTP/1.1 %s\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                b"Content-Length: %d\r\nConnection: close\r\n\r\n%s"
+                % (status, len(body), body)
+            )
+            await writer.drain()
+        except (
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ConnectionError,
+        ):
+            pass
+        finally:
+            writer.close()
+
+
+metrics = MetricsRegistry.from_config()
+
+PACKETS = metrics.counter("botoy_packets_total", "收到的数据包", ("kind",))
+INGEST = metrics.gauge("botoy_ingest", "接收队列统计", ("stat",))
+RECEIVER_CALLS = metrics.counter(
+    "botoy_receiver_calls_total", "接收函数执行次数", ("receiver",)
+)
+RECEIVER_ERRORS = metrics.counter(
+    "botoy_receiver_errors_total", "接收函数异常次数", ("receiver",)
+)
+RECEIVER_SECONDS = metrics.histogram(
+    "botoy_receiver_seconds", "接收函数执行耗时", ("receiver",)
+)
+RECEIVER_TIMEOUTS = metrics.counter(
+    "botoy_receiver_timeouts_total", "接收函数执行超时次数", ("receiver",)
+)
+RECEIVER_SLOW = metrics.counter(
+    "botoy_receiver_slow_total", "接收函数执行缓慢次数", ("receiver",)
+)
+SESSIONS = metrics.gauge("botoy_sessions", "进行中的会话数")
+ACTION_REQUESTS = metrics.counter(
+    "botoy_action_requests_total", "接口请求次数", ("cmd", "ret")
+)
+ACTION_ERRORS = metrics.counter(
+    "botoy_action_errors_total", "接口请求异常次数", ("cmd",)
+)
+ACTION_SECONDS = metrics.histogram("botoy_action_seconds", "接口请求耗时", ("cmd",))
+CONNECTS = metrics.counter("botoy_connects_total", "连接次数", ("result",))
+RECONNECTS = metrics.counter("botoy_reconnects_total", "重连次数")
+CONNECTED = metrics.gauge("botoy_connected", "当前连接数")
+LOOP_LAG = metrics.histogram("botoy_loop_lag_seconds", "事件循环调度延迟")
+LOOP_BLOCKED = metrics.counter(
+    "botoy_loop_blocked_total", "事件循环阻塞次数", ("receiver",)
+)
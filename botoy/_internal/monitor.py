@@ -0,0 +1,174 @@
+"""事件循环监控
+
+定时在事件循环中执行一次回调，记录实际执行时间与预期时间的差值(调度延迟)。
+同时由一个后台线程检查回调是否按时执行，事件循环被阻塞超过阈值时，
+打印事件循环线程当前的调用栈和正在执行的接收函数，用于定位在异步接收函数中调用了阻塞代码
+(如``time.sleep``, 同步的``httpx.get``)的插件
+
+配置项(botoy.json)::
+
+    {
+      "loop_monitor.enabled": false,   // 是否启用
+      "loop_monitor.threshold": 0.5,   // 事件循环阻塞超过该时间(秒)时打印调用栈
+      "loop_monitor.interval": 0.1     // 采样间隔(秒)
+    }
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from .config import jconfig
+from .log import logger
+from .metrics import LOOP_BLOCKED, LOOP_LAG, LatencyHistogram, metrics
+from .watchdog import watchdog
+
+_ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+
+def _format_loop_stack(frame) -> str:
+    """事件循环线程的调用栈，省略事件循环本身的部分"""
+    summary = traceback.extract_stack(frame)
+    for idx in range(len(summary) - 1, -1, -1):
+        if summary[idx].filename.startswith(_ASYNCIO_DIR):
+            summary = traceback.StackSummary.from_list(summary[idx + 1 :])
+            break
+    return "".join(summary.format())
+
+
+class LoopMonitor:
+    def __init__(
+        self, enabled: bool = False, threshold: float = 0.5, interval: float = 0.1
+    ):
+        """
+        :param enabled: 是否启用
+        :param threshold: 事件循环阻塞超过该时间(秒)时打印调用栈
+        :param interval: 采样间隔(秒)
+        """
+        self.enabled = enabled
+        self.threshold = threshold
+        self.interval = interval
+        self.lag = LatencyHistogram()
+        self.max_lag = 0.0
+        self.blocked = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._watcher: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        # 最近一次回调的执行时间和下一次的预期执行时间
+        self._beat = 0.0
+        self._expected = 0.0
+
+    @classmethod
+    def from_config(cls) -> "LoopMonitor":
+        config = jconfig.get_configuration("loop_monitor")
+        return cls(
+            enabled=bool(config.get("enabled", False)),
+            threshold=config.get("threshold", 0.5),
+            interval=config.get("interval", 0.1),
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._watcher is not None and self._watcher.is_alive()
+
+    def start(self):
+        """开始监控当前事件循环, 可重复调用"""
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        if loop is self._loop and self.running:
+            return
+        self.stop()
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._stopped = threading.Event()
+        self._beat = time.perf_counter()
+        self._expected = self._beat + self.interval
+        self._handle = loop.call_later(self.interval, self._tick)
+        self._watcher = threading.Thread(
+            target=self._watch,
+            args=(loop, self._stopped),
+            name="botoy-loop-monitor",
+            daemon=True,
+        )
+        self._watcher.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._watcher = None
+
+    def _tick(self):
+        now = time.perf_counter()
+        lag = max(0.0, now - self._expected)
+        self.lag.observe(lag)
+        if lag > self.max_lag:
+            self.max_lag = lag
+        if metrics.enabled:
+            LOOP_LAG.observe(lag)
+        self._beat = now
+        self._expected = now + self.interval
+        self._handle = self._loop.call_later(self.interval, self._tick)  # type: ignore
+
+    def _watch(self, loop: asyncio.AbstractEventLoop, stopped: threading.Event):
+        # 已报告的阻塞开始前最后一次回调的执行时间, 同一次阻塞只报告一次
+        reported: Optional[float] = None
+        while not stopped.wait(self.interval):
+            if loop.is_closed():
+                break
+            beat = self._beat
+            if reported is not None and beat != reported:
+                blocked = max(0.0, beat - reported - self.interval)
+                logger.warning(f"事件循环已恢复，共阻塞{blocked:.2f}秒")
+                reported = None
+            blocked = time.perf_counter() - beat
+            if reported is None and blocked >= self.threshold:
+                reported = beat
+                self._report(loop, blocked)
+
+    def _report(self, loop: asyncio.AbstractEventLoop, blocked: float):
+        self.blocked += 1
+        name = ""
+        task = asyncio.current_task(loop)
+        if task is not None:
+            try:
+                executions = watchdog.running()
+            except RuntimeError:
+                # 事件循环线程恰好恢复并修改了执行记录
+                executions = []
+            for execution in executions:
+                if execution.task is task:
+                    name = execution.name
+                    break
+        frame = sys._current_frames().get(self._loop_thread)  # type: ignore
+        stack = _format_loop_stack(frame) if frame is not None else ""
+        if metrics.enabled:
+            LOOP_BLOCKED.labels(name).inc()
+        if name:
+            source = f"接收函数[{name}]"
+        elif task is not None:
+            source = f"任务[{task.get_name()}]"
+        else:
+            source = "回调"
+        logger.warning(
+            f"事件循环已阻塞{blocked:.2f}秒，正在执行{source}，当前调用栈：\n{stack}"
+        )
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "lag": self.lag.snapshot(),
+            "max_lag": self.max_lag,
+            "blocked": self.blocked,
+        }
+
+
+loop_monitor = LoopMonitor.from_config()
@@ -4,16 +4,32 @@
 # https://github.com/python/cpython/blob/main/Lib/concurrent/futures/thread.py
 # 修改并简化了部分内容，因为不想为了框架需要再继承一遍
 # 如果使用有问题再考虑直接引用库
+"""
+配置项(botoy.json)::
+
+    {
+      "pool.max_workers": 8,      // 最大线程数，默认为 min(32, cpu数 + 4)
+      "pool.min_workers": 5,      // 保留的空闲线程数
+      "pool.keep_alive": 60,      // 空闲线程存活时间
+      "pool.max_queue": 0,        // 排队任务上限，超出后拒绝新任务，0为不限制
+      "pool.receiver_limit": 4,   // 单个接收函数最多同时占用的线程数，默认为最大线程数的一半，0为不限制
+      "pool.processes": 2         // 进程池进程数，默认为cpu数
+    }
+"""
+
 import atexit
 import os
 import queue
 import threading
+import time
 import traceback
 import weakref
 from concurrent import futures
 from typing import Optional
 
+from .config import jconfig
 from .log import logger
+from .metrics import LatencyHistogram
 
 _thread_queue = weakref.WeakKeyDictionary()
 _exit = False
@@ -35,6 +51,7 @@ class Worker:
         self.func = func
         self.args = args
         self.kwargs = kwargs
+        self.submitted = time.perf_counter()
 
     def run(self):
         if not self.future.set_running_or_notify_cancel():
@@ -53,9 +70,12 @@ class WorkerThread(threading.Thread):
     def __init__(self, executor: "WorkerExecutor"):
         super().__init__()
         self.executor: "WorkerExecutor" = executor
+        # 正在执行的任务
+        self.current: Optional[Worker] = None
+        # 被隔离的线程执行完当前任务后退出
+        self.quarantined = False
 
     def run(self):
-        self.executor._adjust_free_threads(1)
         while True:
             # break/return出死循环即关闭线程
             try:
@@ -73,8 +93,19 @@ class WorkerThread(threading.Thread):
 
             if worker is not None:
                 self.executor._adjust_free_threads(-1)
+                started = time.perf_counter()
+                self.executor.wait_latency.observe(started - worker.submitted)
+                self.current = worker
                 worker.run()
+                self.executor.run_latency.observe(time.perf_counter() - started)
+                with self.executor._quarantine_lock:
+                    self.current = None
+                    quarantined = self.quarantined
                 del worker
+                self.executor._completed += 1
+                if quarantined:
+                    self.executor._quarantined.discard(self)
+                    break
                 self.executor._adjust_free_threads(1)
                 continue
 
@@ -84,16 +115,44 @@ class WorkerThread(threading.Thread):
 
 
 class WorkerExecutor(futures.Executor):
-    def __init__(self, max_workers: Optional[int] = None):
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        min_workers: int = 5,
+        keep_alive_time: float = 60,
+        max_queue: int = 0,
+        receiver_limit: Optional[int] = None,
+    ):
+        """
+        :param max_workers: 最大线程数
+        :param min_workers: 保留的空闲线程数
+        :param keep_alive_time: 空闲线程存活时间
+        :param max_queue: 排队任务上限，超出后拒绝新任务，0为不限制
+        :param receiver_limit: 单个接收函数最多同时占用的线程数，默认为最大线程数的一半，0为不限制
+        """
         max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
         if max_workers <= 0:
             raise ValueError("max_workers must be greater than 0")
         self._max_workers = max_workers
-        self._min_workers = 5  # 允许的空闲线程数
-        self._keep_alive_time = 60  # 空闲线程存活时间
+        self._min_workers = min_workers  # 允许的空闲线程数
+        self._keep_alive_time = keep_alive_time  # 空闲线程存活时间
+        self._max_queue = max_queue
+        if receiver_limit is None:
+            receiver_limit = max(1, max_workers // 2)
+        self.receiver_limit = receiver_limit
 
         self._worker_queue = queue.Queue()
         self._worker_threads = weakref.WeakSet()
+        # 执行超时被隔离的线程，不再计入线程数
+        self._quarantined = weakref.WeakSet()
+        self._quarantine_lock = threading.Lock()
+
+        # metrics
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self.wait_latency = LatencyHistogram()  # 排队耗时
+        self.run_latency = LatencyHistogram()  # 执行耗时
 
         self._shutdown = False
         self._shutdown_lock = threading.RLock()
@@ -109,12 +168,46 @@ class WorkerExecutor(futures.Executor):
             for t in self._worker_threads:
                 t.join()
 
+    @classmethod
+    def from_config(cls) -> "WorkerExecutor":
+        config = jconfig.get_configuration("pool")
+        return cls(
+            max_workers=config.get("max_workers"),
+            min_workers=config.get("min_workers", 5),
+            keep_alive_time=config.get("keep_alive", 60),
+            max_queue=config.get("max_queue", 0),
+            receiver_limit=config.get("receiver_limit"),
+        )
+
+    def stats(self) -> dict:
+        threads = len(self._worker_threads)
+        idle = max(0, self._free_threads)
+        return {
+            "threads": threads,
+            "busy": max(0, threads - idle),
+            "idle": idle,
+            "queued": self._worker_queue.qsize(),
+            "max_workers": self._max_workers,
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "quarantined": len(self._quarantined),
+            "wait_latency": self.wait_latency.snapshot(),
+            "run_latency": self.run_latency.snapshot(),
+        }
+
     def submit(self, target, *args, **kwargs):
         with self._shutdown_lock:
             if self._shutdown:
+                self._rejected += 1
                 raise RuntimeError("工作池已关闭，无法添加新任务")
             if _exit:
+                self._rejected += 1
                 raise RuntimeError("程序已退出，无法添加新任务")
+            if self._max_queue and self._worker_queue.qsize() >= self._max_queue:
+                self._rejected += 1
+                raise RuntimeError("工作池排队任务已满，无法添加新任务")
+            self._submitted += 1
 
             future = futures.Future()
             worker = Worker(future, target, args, kwargs)
@@ -124,14 +217,39 @@ class WorkerExecutor(futures.Executor):
             self._schedule_threads()
             return future
 
+    def quarantine(self, future: futures.Future) -> bool:
+        """隔离正在执行该任务的线程，返回是否隔离成功
+
+        线程无法被强制结束，隔离后该线程不再计入线程数，线程池可以创建新的线程补充，
+        该线程执行完当前任务后直接退出
+        :param future: ``submit``返回的Future
+        """
+        with self._quarantine_lock:
+            for thread in list(self._worker_threads):
+                if thread.current is not None and thread.current.future is future:
+                    break
+            else:
+                return False
+            thread.quarantined = True
+            self._worker_threads.discard(thread)
+            self._quarantined.add(thread)
+        # 退出时不等待被隔离的线程
+        _thread_queue.pop(thread, None)
+        with self._shutdown_lock:
+            if not self._shutdown:
+                self._schedule_threads()
+        return True
+
     def _schedule_threads(self):
-        # 如果有空闲线程并且未超过限制数目，不管是否达到最大线程数都不需要创建新线程
+        # 空闲线程足够处理排队任务时不需要创建新线程
         if (
             len(self._worker_threads) < self._max_workers
-            and self._free_threads < self._min_workers
+            and self._worker_queue.qsize() > self._free_threads
         ):
             thread = WorkerThread(self)  # use executor reference??
-            thread.setDaemon(True)
+            thread.daemon = True
+            # 启动前就计入空闲线程，避免并发提交时重复创建
+            self._adjust_free_threads(1)
             thread.start()
 
             self._worker_threads.add(thread)
@@ -146,3 +264,17 @@ class WorkerExecutor(futures.Executor):
 
 
 WorkerPool = WorkerExecutor
+
+
+_process_pool: Optional[futures.ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> futures.ProcessPoolExecutor:
+    """进程池, 用于执行CPU密集的同步接收函数, 第一次使用时创建"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            processes = jconfig.get_configuration("pool").get("processes") or None
+            _process_pool = futures.ProcessPoolExecutor(processes)
+        return _process_pool
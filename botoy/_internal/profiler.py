@@ -0,0 +1,212 @@
+"""采样分析
+
+后台线程按固定频率采集所有线程的调用栈，输出 flamegraph 使用的折叠栈格式(每行为``栈 次数``)，
+可用``flamegraph.pl``或 speedscope 等工具生成火焰图。
+事件循环线程中正在执行的接收函数，以及线程池中执行的同步接收函数，以接收函数名称作为栈的根节点
+
+运行中的进程收到``SIGUSR2``信号时开始采样，命令行: ``botoy profile --help``
+
+配置项(botoy.json)::
+
+    {
+      "profiler.signal": true,    // 是否响应 SIGUSR2 信号
+      "profiler.hz": 100,         // 采样频率
+      "profiler.duration": 30     // 采样时长(秒)
+    }
+"""
+
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional
+
+from . import jsonlib
+from .config import jconfig
+from .log import logger
+from .watchdog import watchdog
+
+
+def request_path(pid: int) -> Path:
+    """命令行传递采样参数的文件"""
+    return Path(tempfile.gettempdir()) / f"botoy-profile-{pid}.json"
+
+
+def _frame_name(code) -> str:
+    filename = os.path.basename(code.co_filename)
+    name = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+    # 分号是折叠栈的分隔符
+    return name.replace(";", ":")
+
+
+class SamplingProfiler:
+    def __init__(self, hz: float = 100, duration: float = 30, output: str = ""):
+        """
+        :param hz: 采样频率
+        :param duration: 采样时长(秒)
+        :param output: 输出文件，默认为工作目录下的``botoy-profile/profile-进程号-时间.txt``
+        """
+        self.hz = hz
+        self.duration = duration
+        self.output = output or str(
+            Path("botoy-profile")
+            / f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+        )
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """开始采样, 在事件循环中调用时可以识别异步接收函数"""
+        try:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+        except RuntimeError:
+            pass
+        self._thread = threading.Thread(
+            target=self._run, name="botoy-profiler", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"开始采样: {self.hz}Hz, {self.duration}秒")
+
+    def stop(self):
+        """提前结束采样"""
+        self._stopped.set()
+
+    def join(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        interval = 1 / self.hz
+        deadline = time.perf_counter() + self.duration
+        while time.perf_counter() < deadline:
+            self._sample()
+            if self._stopped.wait(interval):
+                break
+        try:
+            self.write()
+        except OSError as e:
+            logger.error(f"采样结果写入失败: {e}")
+        else:
+            logger.info(f"采样结束，共{self.samples}次，结果已写入 {self.output}")
+
+    def _thread_roots(self) -> Dict[int, str]:
+        """线程 => 栈的根节点名称"""
+        roots = {t.ident: f"thread:{t.name}" for t in threading.enumerate()}
+        try:
+            executions = watchdog.running()
+        except RuntimeError:
+            # 事件循环线程恰好修改了执行记录，本次不区分接收函数
+            executions = []
+        task = None
+        if self._loop is not None and not self._loop.is_closed():
+            task = asyncio.current_task(self._loop)
+        for execution in executions:
+            if execution.thread is not None:
+                roots[execution.thread] = f"receiver:{execution.name}"
+            elif task is not None and execution.task is task:
+                roots[self._loop_thread] = f"receiver:{execution.name}"  # type: ignore
+        return roots
+
+    def _sample(self):
+        me = threading.get_ident()
+        roots = self._thread_roots()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            names.append(roots.get(ident, f"thread:{ident}"))
+            self.stacks[";".join(reversed(names))] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        """折叠栈格式的结果"""
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def write(self) -> str:
+        """写入结果, 返回文件路径"""
+        path = Path(self.output)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写入临时文件，避免命令行读到不完整的结果
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(self.collapsed(), encoding="utf-8")
+        os.replace(tmp, path)
+        return str(path)
+
+
+_profiler: Optional[SamplingProfiler] = None
+
+
+def start_profile(
+    hz: Optional[float] = None, duration: Optional[float] = None, output: str = ""
+) -> SamplingProfiler:
+    """开始采样，同时只能进行一次，参数默认读取配置
+    :param hz: 采样频率
+    :param duration: 采样时长(秒)
+    :param output: 输出文件
+    """
+    global _profiler
+    if _profiler is not None and _profiler.running:
+        raise RuntimeError("正在采样中")
+    config = jconfig.get_configuration("profiler")
+    _profiler = SamplingProfiler(
+        hz=hz or config.get("hz", 100),
+        duration=duration or config.get("duration", 30),
+        output=output,
+    )
+    _profiler.start()
+    return _profiler
+
+
+def _handle_signal():
+    params = {}
+    path = request_path(os.getpid())
+    try:
+        params = jsonlib.loads(path.read_bytes())
+        path.unlink()
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning(f"采样参数读取失败: {e}")
+    if not isinstance(params, dict):
+        logger.warning(f"采样参数格式有误，使用默认参数: {params!r}")
+        params = {}
+    try:
+        start_profile(
+            hz=params.get("hz"),
+            duration=params.get("duration"),
+            output=params.get("output", ""),
+        )
+    except RuntimeError as e:
+        logger.warning(e)
+
+
+def install_signal_handler(loop: asyncio.AbstractEventLoop) -> bool:
+    """收到 SIGUSR2 时开始采样，返回是否设置成功"""
+    if not hasattr(signal, "SIGUSR2"):
+        return False
+    if not jconfig.get_configuration("profiler").get("signal", True):
+        return False
+    try:
+        loop.add_signal_handler(signal.SIGUSR2, _handle_signal)
+    except (NotImplementedError, RuntimeError, ValueError):
+        return False
+    return True
@@ -1,29 +1,60 @@
 import asyncio
+import concurrent.futures
 import inspect
 import os
 import random
 import re
 import string
 import textwrap
+import threading
+import time
 import traceback
 import weakref
 from contextvars import ContextVar, copy_context
 from pathlib import Path
-from typing import Any, Callable, Dict, List, NoReturn, Optional, Tuple, TypeVar, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Hashable,
+    List,
+    NoReturn,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 from uuid import uuid4
 
 from .context import Context as T_Context
 from .context import FriendMsg as T_FriendMsg
 from .context import GroupMsg as T_GroupMsg
-from .context import current_ctx
+from .context import MsgKind, current_ctx
 from .keys import *
 from .log import logger
+from .metrics import (
+    RECEIVER_CALLS,
+    RECEIVER_ERRORS,
+    RECEIVER_SECONDS,
+    SESSIONS,
+    metrics,
+)
+from .pool import get_process_pool
 from .sugar import _S as T_S
-from .sugar import S
+from .sugar import S, current_batch
+from .watchdog import Execution, watchdog
 
 T = TypeVar("T")
 
 current_receiver: ContextVar["Receiver"] = ContextVar("current_receiver")
+current_lane: ContextVar[Optional["_LaneTicket"]] = ContextVar(
+    "current_lane", default=None
+)
+current_decision: ContextVar[Optional["_SessionDecision"]] = ContextVar(
+    "current_decision", default=None
+)
 
 
 def start_session(
@@ -168,15 +199,34 @@ def start_session(
         else:
             raise NotImplementedError("事件类型暂不支持创建对话")
     receiver = current_receiver.get()
-    if sid in receiver.state:
+    if session_registry.get(receiver, sid) is not None:
         raise RuntimeError(f"该类型对话已经创建，不能重复创建。session id = {sid}")
     session = Session(sid, receiver, group, friend, multi_user, skip_responder)
     session.set_s(s)
-    receiver.state[sid] = weakref.ref(session)
+    session_registry.add(session)
     logger.debug(f"{receiver=} start {session=}")
+    # 会话已经建立，后续消息由会话接收，无需再等待本次执行结束
+    if lane := current_lane.get():
+        lane.release_threadsafe()
+    if decision := current_decision.get():
+        decision.resolve_threadsafe()
     return SessionExport(session)
 
 
+def no_session():
+    """声明本次执行不会开启会话
+
+    使用会话的接收函数在执行期间，相关的新消息会等待本次执行确定是否开启会话，
+    确定不会开启会话后调用该函数，等待中的消息即可立即处理, 适用于耗时较长的逻辑
+
+    >>> if ctx.g.text != "开始":
+    ...     no_session()
+    ...     await generate_image()  # 耗时操作
+    """
+    if decision := current_decision.get():
+        decision.resolve_threadsafe()
+
+
 class SessionExport:  # 避免代码补全太多不需要关注的内容, 同时也用于添加额外功能
     def __init__(self, s: "Session") -> None:
         self.__s__ = s
@@ -465,6 +515,9 @@ class Session:
         """队列中获取ctx
         :param timeout: 超时时间，单位为秒。超时返回`None`。默认30s，可通过`set_default_timeout`修改。
         """
+        # 合并发送中的提示需要在等待回复前发出
+        if (batch := current_batch.get()) is not None:
+            await batch.flush()
         try:
             return await asyncio.wait_for(
                 self.queue.get(), timeout or self.default_timeout
@@ -572,6 +625,165 @@ class Session:
         return f"<Session[sid={self.sid}]>"
 
 
+_RouteKey = Tuple  # ("g", 群号) / ("gu", 群号, 用户) / ("u", 用户)
+
+
+class SessionRegistry:
+    """会话路由表, 所有接收函数共享
+
+    会话按类型建立索引，消息到达时直接定位到对应会话:
+
+    1. groupID 该群所有人, 不包括私聊 => ("g", groupID)
+    2. groupID-userID 该群对应用户, 包括私聊 => ("gu", groupID, userID), ("u", userID)
+    3. userID 仅该用户私聊 => ("u", userID)
+
+    会话对象只保存弱引用，被回收后立即移除；已结束但仍被引用的会话由定时清理移除
+    """
+
+    SWEEP_INTERVAL = 30
+
+    def __init__(self):
+        # 路由 => 接收函数id => sid => 会话
+        self._routes: Dict[_RouteKey, Dict[int, Dict[str, weakref.ref]]] = {}
+        # 接收函数id => sid => (会话, 路由)
+        self._owned: Dict[int, Dict[str, Tuple[weakref.ref, Tuple[_RouteKey, ...]]]] = (
+            {}
+        )
+        # 同步接收函数在线程中开启会话，弱引用回调也可能在任意线程触发
+        self._lock = threading.RLock()
+        self._sweeper: Optional[asyncio.TimerHandle] = None
+
+    @staticmethod
+    def _route_keys(session: "Session") -> Tuple[_RouteKey, ...]:
+        if "-" in session.sid:
+            group, user = map(int, session.sid.split("-"))
+            return (("gu", group, user), ("u", user))
+        if session.multi_user:
+            return (("g", int(session.sid)),)
+        return (("u", int(session.sid)),)
+
+    @staticmethod
+    def _lookup_keys(ctx: T_Context) -> Tuple[_RouteKey, ...]:
+        if g := ctx.g:
+            return (("gu", g.from_group, g.from_user), ("g", g.from_group))
+        if f := ctx.f:
+            return (("u", f.from_user),)
+        return ()
+
+    def __len__(self) -> int:
+        return sum(len(sessions) for sessions in self._owned.values())
+
+    def add(self, session: "Session"):
+        receiver = session.receiver
+        rid, sid = id(receiver), session.sid
+        keys = self._route_keys(session)
+        ref = weakref.ref(session, lambda ref: self._remove(rid, sid, ref))
+        with self._lock:
+            self._owned.setdefault(rid, {})[sid] = (ref, keys)
+            for key in keys:
+                self._routes.setdefault(key, {}).setdefault(rid, {})[sid] = ref
+        self._schedule_sweep(receiver.loop)
+
+    def _remove(self, rid: int, sid: str, ref: Optional[weakref.ref] = None):
+        with self._lock:
+            owned = self._owned.get(rid)
+            if not owned or sid not in owned:
+                return
+            entry_ref, keys = owned[sid]
+            # 同一sid可能已经开启了新的会话
+            if ref is not None and entry_ref is not ref:
+                return
+            del owned[sid]
+            if not owned:
+                del self._owned[rid]
+            for key in keys:
+                receivers = self._routes.get(key)
+                if receivers is None:
+                    continue
+                sessions = receivers.get(rid)
+                if sessions is not None:
+                    sessions.pop(sid, None)
+                    if not sessions:
+                        del receivers[rid]
+                if not receivers:
+                    del self._routes[key]
+
+    def get(self, receiver: "Receiver", sid: str) -> Optional["Session"]:
+        """获取接收函数中未结束的会话"""
+        entry = self._owned.get(id(receiver), {}).get(sid)
+        if entry is None:
+            return None
+        session = entry[0]()
+        if session is None or session.finished:
+            self._remove(id(receiver), sid, entry[0])
+            return None
+        return session
+
+    def sessions(self, receiver: "Receiver") -> Dict[str, weakref.ref]:
+        """接收函数的所有会话, sid => 会话"""
+        return {sid: ref for sid, (ref, _) in self._owned.get(id(receiver), {}).items()}
+
+    def lookup(self, receiver: "Receiver", ctx: T_Context) -> Optional["Session"]:
+        """查找该消息对应的会话"""
+        rid = id(receiver)
+        if rid not in self._owned:
+            return None
+        for key in self._lookup_keys(ctx):
+            sessions = self._routes.get(key, {}).get(rid)
+            if not sessions:
+                continue
+            for sid, ref in list(sessions.items()):
+                session = ref()
+                if session is None or session.finished:
+                    self._remove(rid, sid, ref)
+                    continue
+                return session
+        return None
+
+    def receiver_ids(self, ctx: T_Context) -> Set[int]:
+        """可能存在该消息对应会话的接收函数id"""
+        ids = set()
+        for key in self._lookup_keys(ctx):
+            if receivers := self._routes.get(key):
+                ids.update(receivers)
+        return ids
+
+    def _schedule_sweep(self, loop: Optional[asyncio.AbstractEventLoop]):
+        if self._sweeper is not None or loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._start_sweeper(loop)
+        else:
+            loop.call_soon_threadsafe(self._start_sweeper, loop)
+
+    def _start_sweeper(self, loop: asyncio.AbstractEventLoop):
+        if self._sweeper is None:
+            self._sweeper = loop.call_later(self.SWEEP_INTERVAL, self._sweep, loop)
+
+    def _sweep(self, loop: asyncio.AbstractEventLoop):
+        self._sweeper = None
+        with self._lock:
+            entries = [
+                (rid, sid, ref)
+                for rid, owned in self._owned.items()
+                for sid, (ref, _) in owned.items()
+            ]
+        for rid, sid, ref in entries:
+            session = ref()
+            if session is None or session.finished:
+                self._remove(rid, sid, ref)
+        if self._owned:
+            self._start_sweeper(loop)
+
+
+session_registry = SessionRegistry()
+SESSIONS.set_function(lambda: len(session_registry))
+
+
 class ReceiverMarker:
     def __init__(self) -> None:
         self.__name_codes = []
@@ -591,6 +803,18 @@ class ReceiverMarker:
         author="",
         usage="",
         *,
+        kind=None,
+        groups=None,
+        prefix=None,
+        keyword=None,
+        regex=None,
+        at_bot=False,
+        lane=None,
+        session=None,
+        executor=None,
+        max_concurrency=None,
+        batch=None,
+        timeout=None,
         _directly_attached=False,
         _back=1,
     ):
@@ -600,12 +824,47 @@ class ReceiverMarker:
         :param author: 插件作者，默认为空
         :param usage: 插件用法，默认为__doc__
 
+        以下为可选的过滤条件，只有满足所有条件的消息才会调用该接收函数，详见``ReceiverFilter``
+        :param kind: 消息类型 group/friend/event 或 MsgKind, 可以为列表
+        :param groups: 群号白名单, 可以为列表
+        :param prefix: 文字内容前缀, 可以为列表
+        :param keyword: 文字内容包含的关键字, 可以为列表
+        :param regex: 在文字内容中搜索的正则, 可以为列表
+        :param at_bot: 是否要求艾特机器人
+
+        以下为可选的执行选项，详见``ReceiverOptions``
+        :param lane: 有序执行通道 group/user/group_user
+        :param session: 是否使用会话, 默认根据源码自动检测
+        :param executor: 同步接收函数的执行方式 pool/thread/process
+        :param max_concurrency: 同步接收函数最多同时执行的数量
+        :param batch: 合并发送文字的时间窗口(秒)
+        :param timeout: 执行超时时间(秒), 0为不限制
+
         TODO: 目前信息仅用在加载打印插件信息，后续可进行应用
         """
         receiver.__dict__[IS_RECEIVER] = True
+        configure_recv(
+            receiver,
+            kind=kind,
+            groups=groups,
+            prefix=prefix,
+            keyword=keyword,
+            regex=regex,
+            at_bot=at_bot,
+            lane=lane,
+            session=session,
+            executor=executor,
+            max_concurrency=max_concurrency,
+            batch=batch,
+            timeout=timeout,
+        )
         meta = ""
         if file := inspect.getsourcefile(receiver):
-            meta += str(Path(file).relative_to(os.getcwd()))
+            try:
+                meta += str(Path(file).relative_to(os.getcwd()))
+            except ValueError:
+                # 不在工作目录中, 如安装的包中定义的接收函数
+                meta += file
         try:
             lines = inspect.getsourcelines(receiver)
             if meta:
@@ -662,6 +921,319 @@ def is_recv(receiver):
         return False
 
 
+def configure_recv(receiver, **kwargs):
+    """设置接收函数的过滤条件和执行选项, 参数同``mark_recv``"""
+    options = {k: kwargs.pop(k) for k in ReceiverOptions.NAMES if k in kwargs}
+    receiver_filter = ReceiverFilter(**kwargs)
+    if not receiver_filter.empty:
+        receiver.__dict__[RECEIVER_FILTER] = receiver_filter
+    receiver_options = ReceiverOptions(**options)
+    if not receiver_options.default:
+        receiver.__dict__[RECEIVER_OPTIONS] = receiver_options
+
+
+def _as_tuple(value) -> tuple:
+    if value is None:
+        return ()
+    if isinstance(value, (str, bytes, re.Pattern, MsgKind, int)):
+        return (value,)
+    return tuple(value)
+
+
+_KIND_NAMES = {
+    "group": MsgKind.GROUP,
+    "friend": MsgKind.FRIEND,
+    "event": MsgKind.EVENT,
+}
+
+
+class ReceiverFilter:
+    """接收函数的声明式过滤条件
+
+    各条件之间为``且``的关系，条件为列表时，满足其中一项即可
+
+    - kind: 消息类型
+    - groups: 群号白名单，设置后只处理这些群的群消息
+    - prefix: 文字内容前缀
+    - keyword: 文字内容包含的关键字
+    - regex: 使用 re.search 在文字内容中搜索的正则
+    - at_bot: 是否要求艾特机器人(仅群消息)
+
+    设置了文字相关条件后不会处理事件消息
+    """
+
+    def __init__(
+        self,
+        kind=None,
+        groups=None,
+        prefix=None,
+        keyword=None,
+        regex=None,
+        at_bot: bool = False,
+    ):
+        self.kinds: Optional[FrozenSet[MsgKind]] = (
+            frozenset(
+                _KIND_NAMES[k] if isinstance(k, str) else MsgKind(k)
+                for k in _as_tuple(kind)
+            )
+            or None
+        )
+        self.groups: Optional[FrozenSet[int]] = (
+            frozenset(int(g) for g in _as_tuple(groups)) or None
+        )
+        self.prefixes: Tuple[str, ...] = _as_tuple(prefix)
+        self.keywords: Tuple[str, ...] = _as_tuple(keyword)
+        self.patterns: Tuple[re.Pattern, ...] = tuple(
+            re.compile(p) for p in _as_tuple(regex)
+        )
+        self.at_bot = bool(at_bot)
+
+    @property
+    def empty(self) -> bool:
+        """没有设置任何条件"""
+        return not (
+            self.kinds
+            or self.groups
+            or self.prefixes
+            or self.keywords
+            or self.patterns
+            or self.at_bot
+        )
+
+    @property
+    def has_text_condition(self) -> bool:
+        return bool(self.prefixes or self.keywords or self.patterns)
+
+    @property
+    def effective_kinds(self) -> FrozenSet[MsgKind]:
+        """综合所有条件后实际可能匹配的消息类型"""
+        kinds = set(self.kinds or MsgKind)
+        if self.has_text_condition:
+            kinds &= {MsgKind.GROUP, MsgKind.FRIEND}
+        if self.groups or self.at_bot:
+            kinds &= {MsgKind.GROUP}
+        return frozenset(kinds)
+
+    def match_text(self, text: str) -> bool:
+        if self.prefixes and not text.startswith(self.prefixes):
+            return False
+        if self.keywords and not any(k in text for k in self.keywords):
+            return False
+        if self.patterns and not any(p.search(text) for p in self.patterns):
+            return False
+        return True
+
+    def match(self, ctx: T_Context) -> bool:
+        """完整判断, 与分发索引的结果一致"""
+        if ctx.kind not in self.effective_kinds:
+            return False
+        msg = ctx.g or ctx.f
+        if self.groups and ctx.g and ctx.g.from_group not in self.groups:
+            return False
+        if self.at_bot and not (ctx.g and ctx.g.is_at_bot):
+            return False
+        if self.has_text_condition:
+            if msg is None:
+                return False
+            return self.match_text(msg.text or "")
+        return True
+
+    def __repr__(self) -> str:
+        items = (
+            ("kind", self.kinds),
+            ("groups", self.groups),
+            ("prefix", self.prefixes),
+            ("keyword", self.keywords),
+            ("regex", tuple(p.pattern for p in self.patterns)),
+            ("at_bot", self.at_bot),
+        )
+        return "<ReceiverFilter[{}]>".format(
+            ", ".join(f"{k}={v}" for k, v in items if v)
+        )
+
+
+EXECUTOR_POOL = "pool"
+EXECUTOR_THREAD = "thread"
+EXECUTOR_PROCESS = "process"
+
+LANE_GROUP = "group"
+LANE_USER = "user"
+LANE_GROUP_USER = "group_user"
+
+
+class ReceiverOptions:
+    """接收函数的执行选项
+
+    - lane: 有序执行通道。同一通道内的消息严格按到达顺序依次执行，不同通道之间并行执行
+
+      - ``group``: 按群划分, 好友消息按用户划分
+      - ``user``: 按用户划分
+      - ``group_user``: 按群和用户划分, 好友消息按用户划分
+
+      事件消息不受影响。执行过程中开启会话后通道立即释放，后续消息交由会话处理
+
+    - session: 是否使用会话, 为None时根据源码中是否调用``start_session``自动检测
+
+      使用会话时，新消息会先等待相关的执行(同群或同一用户)确定是否开启会话，
+      执行中调用``start_session``或``no_session``或执行结束都会立即结束等待，最多等待2秒
+
+    - executor: 同步接收函数的执行方式
+
+      - ``pool``: 框架的线程池(默认)
+      - ``thread``: 事件循环默认的线程池
+      - ``process``: 进程池，适用于CPU密集的逻辑。接收函数和返回值需要可以被pickle, 不支持会话
+
+    - max_concurrency: 同步接收函数最多同时执行的数量，超出的消息排队等待，不会占用线程。
+      默认为配置项``pool.receiver_limit``, 避免单个接收函数占满线程池
+
+    - batch: 合并发送文字的时间窗口(秒)，仅对异步接收函数有效。
+      执行中``S.text``不再等待发送完成，窗口内发给同一目标的连续文字合并为一条消息发送，
+      执行结束时发送剩余的消息, 见``S.batch``
+
+    - timeout: 执行超时时间(秒)，包括会话中等待消息的时间，0为不限制，默认为配置项``receiver.timeout``。
+      超时后异步接收函数被取消；同步接收函数无法被中断，框架不再等待其结果，
+      其所在的线程被隔离，线程池创建新的线程补充，该线程执行结束后退出
+    """
+
+    NAMES = ("lane", "session", "executor", "max_concurrency", "batch", "timeout")
+
+    def __init__(
+        self,
+        lane: Optional[str] = None,
+        session: Optional[bool] = None,
+        executor: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        batch: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ):
+        if lane not in (None, LANE_GROUP, LANE_USER, LANE_GROUP_USER):
+            raise ValueError(f"不支持的执行通道: {lane}")
+        if executor not in (None, EXECUTOR_POOL, EXECUTOR_THREAD, EXECUTOR_PROCESS):
+            raise ValueError(f"不支持的执行方式: {executor}")
+        self.lane = lane
+        self.session = session
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.batch = batch
+        self.timeout = timeout
+
+    @property
+    def default(self) -> bool:
+        """全部为默认选项"""
+        return (
+            self.lane is None
+            and self.session is None
+            and self.executor is None
+            and self.max_concurrency is None
+            and self.batch is None
+            and self.timeout is None
+        )
+
+    def lane_key(self, ctx: T_Context) -> Optional[Hashable]:
+        """消息所属的执行通道, 不需要排序时返回None"""
+        if self.lane is None:
+            return None
+        if g := ctx.g:
+            if self.lane == LANE_GROUP:
+                return ("g", g.from_group)
+            if self.lane == LANE_USER:
+                return ("u", g.from_user)
+            return ("gu", g.from_group, g.from_user)
+        if f := ctx.f:
+            return ("u", f.from_user)
+        return None
+
+    def __repr__(self) -> str:
+        items = (
+            ("lane", self.lane),
+            ("session", self.session),
+            ("executor", self.executor),
+            ("max_concurrency", self.max_concurrency),
+            ("batch", self.batch),
+            ("timeout", self.timeout),
+        )
+        return "<ReceiverOptions[{}]>".format(
+            ", ".join(f"{k}={v}" for k, v in items if v is not None)
+        )
+
+
+def _run_with_packet(callback: Callable, data: dict):
+    """在子进程中执行接收函数, 根据原始数据重建上下文"""
+    current_ctx.set(T_Context(data))
+    return callback()
+
+
+class _LaneTicket:
+    """执行通道中的一次排队
+
+    每次排队都持有前一次排队的完成信号，从而形成一条链
+    """
+
+    __slots__ = ("lanes", "key", "previous", "done", "loop")
+
+    def __init__(self, lanes: Dict[Hashable, asyncio.Future], key: Hashable):
+        self.loop = asyncio.get_running_loop()
+        self.lanes = lanes
+        self.key = key
+        self.previous = lanes.get(key)
+        self.done = self.loop.create_future()
+        lanes[key] = self.done
+
+    async def wait(self):
+        if self.previous is not None and not self.previous.done():
+            await asyncio.shield(self.previous)
+
+    def release(self):
+        if self.done.done():
+            return
+        if self.previous is not None and not self.previous.done():
+            # 等待期间被取消，仍需保证后续消息排在前一条之后
+            self.previous.add_done_callback(lambda _: self.release())
+            return
+        self.done.set_result(None)
+        if self.lanes.get(self.key) is self.done:
+            del self.lanes[self.key]
+
+    def release_threadsafe(self):
+        """同步接收函数在线程中执行, 需要回到事件循环释放"""
+        self.loop.call_soon_threadsafe(self.release)
+
+
+class _SessionDecision:
+    """一次执行是否开启会话的信号
+
+    执行开始时登记到相关的群和用户下，开启会话、声明不开启会话或执行结束时完成
+    """
+
+    __slots__ = ("undecided", "keys", "future", "loop")
+
+    def __init__(
+        self,
+        undecided: Dict[Hashable, Set[asyncio.Future]],
+        keys: Tuple[Hashable, ...],
+    ):
+        self.loop = asyncio.get_running_loop()
+        self.undecided = undecided
+        self.keys = keys
+        self.future = self.loop.create_future()
+        for key in keys:
+            undecided.setdefault(key, set()).add(self.future)
+
+    def resolve(self):
+        if self.future.done():
+            return
+        self.future.set_result(None)
+        for key in self.keys:
+            futures = self.undecided.get(key)
+            if futures is not None:
+                futures.discard(self.future)
+                if not futures:
+                    del self.undecided[key]
+
+    def resolve_threadsafe(self):
+        self.loop.call_soon_threadsafe(self.resolve)
+
+
 class ReceiverInfo:
     def __init__(self, **kwargs):
         self.name: str = kwargs.get("name", "")
@@ -674,84 +1246,218 @@ class ReceiverInfo:
 
 
 class Receiver:
-    def __init__(self, callback: Callable, info=None, pool=None):
+    def __init__(
+        self,
+        callback: Callable,
+        info=None,
+        pool=None,
+        filter: Optional[ReceiverFilter] = None,
+        options: Optional[ReceiverOptions] = None,
+    ):
         self.callback = callback
         self.pool = pool
         self.info = info or ReceiverInfo()
-        self.last_execution = None
-        # 存储session
-        # 1. groupID 该群所有人, 不包括私聊
-        # 2. groupID-userID 该群对应用户, 包括私聊
-        # 3. userID 仅该用户私聊
-        self.state: Dict[str, weakref.ReferenceType[Session]] = {}
-
-        # 没检测出问题也不大
-        source = inspect.getsource(callback)
-        self.using_session = bool(re.findall(r"start_session\(.*?\)", source))
+        self.filter = filter
+        self.options = options or ReceiverOptions()
+        # 执行通道 => 该通道最后一次排队的完成信号
+        self.lanes: Dict[Hashable, asyncio.Future] = {}
+        # 群或用户 => 尚未确定是否开启会话的执行
+        self.undecided: Dict[Hashable, Set[asyncio.Future]] = {}
+        # 同步接收函数的并发限制，在事件循环中创建
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+        if self.options.executor == EXECUTOR_PROCESS:
+            self.using_session = False
+        elif self.options.session is not None:
+            self.using_session = self.options.session
+        else:
+            # 没检测出问题也不大
+            source = inspect.getsource(callback)
+            self.using_session = bool(re.findall(r"start_session\(.*?\)", source))
         if self.using_session:
             logger.debug(f"using session => {self}")
 
+    @property
+    def timeout(self) -> float:
+        """执行超时时间(秒), 0为不限制"""
+        if self.options.timeout is not None:
+            return self.options.timeout
+        return watchdog.timeout
+
+    @property
+    def state(self) -> Dict[str, weakref.ReferenceType]:
+        """该接收函数的会话, sid => 会话, 会话统一存放在``session_registry``中"""
+        return session_registry.sessions(self)
+
     async def __call__(self):
         current_receiver.set(self)
+        self.loop = asyncio.get_running_loop()
 
         ctx = current_ctx.get()
 
-        # clean
-        for k, v in self.state.items():
-            _s = v()
-            if _s is None or _s.finished:
-                del self.state[k]
-
-        if not self.state:
-            if self.using_session and self.last_execution:
-                try:
-                    # 给一定的时间用于用户确定是否开启会话的逻辑
-                    await asyncio.wait_for(self.last_execution, 2)
-                except asyncio.TimeoutError:
-                    pass
-
-        if self.state:
-            logger.debug(f"{self} => state={self.state}")
+        # 排队和登记必须在第一次await之前完成，才能与数据包的到达顺序一致
+        lane = decision = None
+        undecided: Set[asyncio.Future] = set()
+        if (key := self.options.lane_key(ctx)) is not None:
+            lane = _LaneTicket(self.lanes, key)
+            current_lane.set(lane)
+        elif self.using_session:
+            # 有序执行通道已经保证了先后顺序，无需等待
+            # 之前同群的执行可能开启多用户会话，之前同一用户的执行可能开启包括私聊的会话
             if g := ctx.g:
-                this_group, this_user = g.from_group, g.from_user
-                for sid in (f"{this_group}-{this_user}", str(this_group)):
-                    if session_ref := self.state.get(sid):
-                        if session := session_ref():
-                            if session.waiting or not session.skip_responder:
-                                await session.add_ctx(ctx)
-                        else:
-                            del self.state[sid]
-                        return
+                wait_key = ("g", g.from_group)
+                keys = (wait_key, ("u", g.from_user))
             elif f := ctx.f:
-                this_user = f.from_user
-                for sid, session_ref in self.state.items():
-                    if this_user == int(sid.split("-")[-1]):
-                        if session := session_ref():
-                            if session.waiting or not session.skip_responder:
-                                await session.add_ctx(ctx)
-                        else:
-                            del self.state[sid]
-                        return
-
+                wait_key = ("u", f.from_user)
+                keys = (wait_key,)
+            else:
+                wait_key, keys = None, ()
+            if keys:
+                undecided = set(self.undecided.get(wait_key, ()))
+                decision = _SessionDecision(self.undecided, keys)
+                current_decision.set(decision)
+        try:
+            if lane is not None:
+                await lane.wait()
+            elif undecided:
+                # 给一定的时间用于用户确定是否开启会话的逻辑
+                await asyncio.wait(undecided, timeout=2)
+            await self._handle(ctx)
+        finally:
+            if lane is not None:
+                lane.release()
+            if decision is not None:
+                decision.resolve()
+
+    async def _handle(self, ctx: T_Context):
+        if session := session_registry.lookup(self, ctx):
+            logger.debug(f"{self} => {session}")
+            if session.waiting or not session.skip_responder:
+                await session.add_ctx(ctx)
+            return
+
+        started = time.perf_counter()
         try:
             if asyncio.iscoroutinefunction(self.callback):
-                self.last_execution = asyncio.ensure_future(self.callback())
+                if self.options.batch is not None:
+                    task = asyncio.ensure_future(self._run_batched())
+                else:
+                    task = asyncio.ensure_future(self.callback())
+                await self._wait_task(task)
             else:
-                all_ctx = copy_context()
-                self.last_execution = asyncio.get_running_loop().run_in_executor(
-                    self.pool, lambda: all_ctx.run(self.callback)
-                )
-            await self.last_execution
+                await self._run_sync(ctx)
         except asyncio.CancelledError:
             pass
         except FinishSession as e:
             if e.args and (arg := e.args[0]):
                 await arg["s"].text(arg["info"])
         except Exception:
+            if metrics.enabled:
+                RECEIVER_ERRORS.labels(self.info.name).inc()
             logger.error(
                 "Error occured in receiver：\n"
                 + textwrap.indent(traceback.format_exc(), " " * 2)
             )
+        finally:
+            if metrics.enabled:
+                RECEIVER_CALLS.labels(self.info.name).inc()
+                RECEIVER_SECONDS.labels(self.info.name).observe(
+                    time.perf_counter() - started
+                )
+
+    async def _wait_task(self, task: asyncio.Future):
+        """等待异步接收函数执行结束，超时后取消"""
+        execution = watchdog.track(self.info.name, task)
+        try:
+            timeout = self.timeout
+            if timeout:
+                try:
+                    await asyncio.wait((task,), timeout=timeout)
+                except asyncio.CancelledError:
+                    task.cancel()
+                    raise
+                if not task.done():
+                    watchdog.report_timeout(execution, timeout, "已取消")
+                    task.cancel()
+            await task
+        finally:
+            watchdog.done(execution)
+
+    async def _run_batched(self):
+        async with S.batch(self.options.batch):
+            await self.callback()
+
+    async def _run_sync(self, ctx: T_Context):
+        if self._slots is None:
+            limit = self.options.max_concurrency
+            if limit is None:
+                limit = getattr(self.pool, "receiver_limit", 0)
+            if limit:
+                self._slots = asyncio.Semaphore(limit)
+
+        if self._slots is not None:
+            await self._slots.acquire()
+        execution = watchdog.track(self.info.name)
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self.options.executor
+            submitted = None
+            if executor == EXECUTOR_PROCESS:
+                execution.process = True
+                future = loop.run_in_executor(
+                    get_process_pool(), _run_with_packet, self.callback, ctx.data
+                )
+            else:
+                all_ctx = copy_context()
+
+                def run():
+                    execution.thread = threading.get_ident()
+                    try:
+                        return all_ctx.run(self.callback)
+                    finally:
+                        execution.thread = None
+
+                if executor == EXECUTOR_THREAD or self.pool is None:
+                    future = loop.run_in_executor(None, run)
+                else:
+                    submitted = self.pool.submit(run)
+                    future = asyncio.wrap_future(submitted, loop=loop)
+            timeout = self.timeout
+            if timeout:
+                await asyncio.wait((future,), timeout=timeout)
+                if not future.done():
+                    self._abandon(execution, timeout, future, submitted)
+                    return
+            await future
+        finally:
+            watchdog.done(execution)
+            if self._slots is not None:
+                self._slots.release()
+
+    def _abandon(
+        self,
+        execution: Execution,
+        timeout: float,
+        future: asyncio.Future,
+        submitted: Optional[concurrent.futures.Future],
+    ):
+        """放弃等待超时的同步接收函数
+        :param future: 本次执行的结果
+        :param submitted: 提交到线程池的任务, 未使用线程池时为None
+        """
+        if submitted is not None and getattr(self.pool, "quarantine", None):
+            if self.pool.quarantine(submitted):
+                action = "已隔离所在线程"
+            else:
+                # 还在排队, 直接取消
+                submitted.cancel()
+                action = "已取消"
+        else:
+            action = "不再等待结果"
+        watchdog.report_timeout(execution, timeout, action)
+        # 不再等待结果, 避免未获取的异常产生警告
+        future.cancel()
 
     def __repr__(self) -> str:
         return f"<Receiver[{self.info}]>"
@@ -7,13 +7,23 @@ import asyncio
 import base64
 import functools
 import re
+from contextvars import ContextVar
 from io import BytesIO
 from pathlib import Path
-from typing import BinaryIO, List, Tuple, Union
+from typing import (
+    Any,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Hashable,
+    List,
+    Optional,
+    Union,
+)
 
 from .action import Action
 from .context import Context, current_ctx
-from .utils import file_to_base64
+from .utils import file_to_base64, stream_to_base64
 
 # str => base64, md5, file path
 # bytes => base64
@@ -23,9 +33,10 @@ from .utils import file_to_base64
 # List[str] => md5 list
 _T_Data = Union[str, bytes, BytesIO, BinaryIO, Path, List[str]]
 
-_BASE64_REGEX = re.compile(
-    r"^([A-Za-z0-9+/]{4})*([A-Za-z0-9+/]{4}|[A-Za-z0-9+/]{3}=|[A-Za-z0-9+/]{2}==)$"
-)
+_BASE64_BODY = re.compile(r"[A-Za-z0-9+/]*")
+_BASE64_TAIL = re.compile(r"[A-Za-z0-9+/]{2}([A-Za-z0-9+/]{2}|[A-Za-z0-9+/]=|==)")
+# 判断base64时检查的开头和结尾长度
+_BASE64_CHECK_SIZE = 1024
 
 TYPE_AUTO: int = 0
 TYPE_URL: int = 1
@@ -34,66 +45,215 @@ TYPE_MD5: int = 3
 TYPE_PATH: int = 4
 
 
-def _resolve_data_type(data: _T_Data) -> Tuple[int, _T_Data]:
-    """用来处理数据类型，必要时需要对数据进行进一步加工再返回"""
-    # FIXME: if hell. 逻辑并不严谨
-    # url, path, md5, base64
-    # url
-    #   http:// 或 https:// 开头的肯定是
-    # path
-    #   1. Path => 确定
-    #   2. str => 用常规经验判断
-    #       a. 本地路径一般不可能超过 1000 吧
-    #       b. 文件存在
-    # md5
-    #   1. List[str] => 确定
-    #   2. str 目前来看，opq收到的图片MD5均是长度为24，==结尾，
-    #   语音并不支持md5发送, 基本可以确定, 并且一张图片的base64不可能这么短
-
-    # base64
-    #   1. 前面都不符合剩余的情况就是base64
-    #   2. bytes 一定是base64
-    #   3. base64:// 开头
-
-    # Path, List[str]
-
-    type = None
-
-    if isinstance(data, Path):  # Path 特殊对象优先判断
-        type = TYPE_PATH
-    elif isinstance(data, bytes):  # bytes 必定是base64
-        type = TYPE_BASE64
-        data = base64.b64encode(data).decode()
-    elif isinstance(data, BytesIO):
-        type = TYPE_BASE64
-        data = base64.b64encode(data.getvalue()).decode()
-    elif isinstance(data, BinaryIO):
-        type = TYPE_BASE64
-        data = base64.b64encode(data.read()).decode()
-    elif isinstance(data, list):  # 必定为MD5
-        type = TYPE_MD5
-    # 处理 str
-    elif data.startswith("http://") or data.startswith("https://"):
-        type = TYPE_URL
-    elif data.startswith("base64://"):
-        type = TYPE_BASE64
-        data = data[9:]
-    elif len(data) == 24 and data.endswith("=="):
-        type = TYPE_MD5
-    elif len(data) < 1000:
-        if Path(data).exists():
-            type = TYPE_PATH
-        elif re.match(_BASE64_REGEX, data):
-            type = TYPE_BASE64
-        # else:
-        #     return cls.TYPE_MD5
-    elif re.match(_BASE64_REGEX, data):
-        type = TYPE_BASE64
-
-    if type is not None:
-        return type, data
-
-    assert False, "正常情况下这里应该是执行不到的"
+def _is_base64(data: str) -> bool:
+    """判断是否为base64, 只检查长度以及开头和结尾部分，不扫描整个字符串"""
+    length = len(data)
+    if length < 4 or length % 4:
+        return False
+    if not _BASE64_TAIL.fullmatch(data, length - 4):
+        return False
+    body_end = length - 4
+    head_end = min(body_end, _BASE64_CHECK_SIZE)
+    if not _BASE64_BODY.fullmatch(data, 0, head_end):
+        return False
+    tail_start = max(head_end, body_end - _BASE64_CHECK_SIZE)
+    return bool(_BASE64_BODY.fullmatch(data, tail_start, body_end))
+
+
+class Media:
+    """发送的媒体数据
+
+    只记录数据类型和原始数据，需要时才编码为base64
+    """
+
+    __slots__ = ("type", "source")
+
+    def __init__(self, type: int, source):
+        self.type = type
+        self.source = source
+
+    @classmethod
+    def resolve(cls, data: _T_Data, type: int = TYPE_AUTO) -> "Media":
+        """判断数据类型
+        :param data: 发送的内容
+        :param type: 数据类型，默认自动判断
+        """
+        if type in (TYPE_URL, TYPE_BASE64, TYPE_MD5, TYPE_PATH):
+            return cls(type, data)
+
+        # NOTE: 逻辑并不严谨
+        # url, path, md5, base64
+        # url
+        #   http:// 或 https:// 开头的肯定是
+        # path
+        #   1. Path => 确定
+        #   2. str => 用常规经验判断
+        #       a. 本地路径一般不可能超过 1000 吧
+        #       b. 文件存在
+        # md5
+        #   1. List[str] => 确定
+        #   2. str 目前来看，opq收到的图片MD5均是长度为24，==结尾，
+        #   语音并不支持md5发送, 基本可以确定, 并且一张图片的base64不可能这么短
+
+        # base64
+        #   1. 前面都不符合，并且长度和开头结尾部分符合base64格式
+        #   2. bytes 一定是base64
+        #   3. base64:// 开头
+
+        if isinstance(data, Path):  # Path 特殊对象优先判断
+            return cls(TYPE_PATH, data)
+        if isinstance(data, (bytes, bytearray, memoryview, BytesIO)):
+            return cls(TYPE_BASE64, data)
+        if hasattr(data, "read"):  # 文件对象等二进制流
+            return cls(TYPE_BASE64, data)
+        if isinstance(data, list):  # 必定为MD5
+            return cls(TYPE_MD5, data)
+        # 处理 str
+        if data.startswith("http://") or data.startswith("https://"):
+            return cls(TYPE_URL, data)
+        if data.startswith("base64://"):
+            return cls(TYPE_BASE64, data[9:])
+        if len(data) == 24 and data.endswith("=="):
+            return cls(TYPE_MD5, data)
+        if len(data) < 1000 and Path(data).exists():
+            return cls(TYPE_PATH, data)
+        if _is_base64(data):
+            return cls(TYPE_BASE64, data)
+        raise ValueError("无法判断数据类型，请通过参数type指定")
+
+    @property
+    def needs_encoding(self) -> bool:
+        """获取base64时是否需要编码"""
+        return self.type == TYPE_PATH or (
+            self.type == TYPE_BASE64 and not isinstance(self.source, str)
+        )
+
+    def base64(self) -> str:
+        """base64编码后的数据，文件和数据流分段编码"""
+        source = self.source
+        if self.type == TYPE_PATH:
+            return file_to_base64(source)
+        if isinstance(source, str):
+            return source
+        if isinstance(source, BytesIO):
+            source = source.getbuffer()
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return base64.b64encode(source).decode()
+        return stream_to_base64(source)  # type: ignore
+
+    def __repr__(self) -> str:
+        return f"<Media type={self.type} source={type(self.source).__name__}>"
+
+
+class OutboundBatch:
+    """合并发送文字
+
+    发给同一目标的连续文字合并为一条消息发送。目标改变、超出时间窗口或长度上限时，
+    发送之前合并的文字。所有消息按调用顺序依次发送
+    """
+
+    def __init__(
+        self, window: float = 0, separator: str = "\n", max_length: int = 2000
+    ):
+        """
+        :param window: 时间窗口(秒), 第一条文字加入后最多等待的时间，为0时直到退出才发送
+        :param separator: 合并文字时使用的分隔符
+        :param max_length: 合并后文字的最大长度
+        """
+        self.window = window
+        self.separator = separator
+        self.max_length = max_length
+        self.sent = 0  # 实际发送的消息数
+        self.merged = 0  # 被合并的文字数
+        self.results: List[Any] = []  # 各条消息的发送结果，按发送顺序
+        self._key: Hashable = None
+        self._send: Optional[Callable[[str], Awaitable]] = None
+        self._texts: List[str] = []
+        self._length = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._last: Optional[asyncio.Task] = None
+        self._tasks: List[asyncio.Task] = []
+        self._token = None
+
+    def add_text(self, key: Hashable, send: Callable[[str], Awaitable], text: str):
+        """加入文字
+        :param key: 发送目标, 相同目标的文字才会合并
+        :param send: 发送文字的协程函数
+        :param text: 文字内容
+        """
+        if self._texts and (
+            key != self._key
+            or self._length + len(self.separator) + len(text) > self.max_length
+        ):
+            self.flush_pending()
+        if self._texts:
+            self.merged += 1
+            self._length += len(self.separator)
+        else:
+            self._key = key
+            self._send = send
+            if self.window > 0:
+                self._timer = asyncio.get_running_loop().call_later(
+                    self.window, self.flush_pending
+                )
+        self._texts.append(text)
+        self._length += len(text)
+
+    def flush_pending(self):
+        """发送已合并的文字，不等待发送完成"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._texts:
+            return
+        text = self.separator.join(self._texts)
+        send = self._send
+        self._texts = []
+        self._length = 0
+        self._key = self._send = None
+        self.enqueue(functools.partial(send, text))  # type: ignore
+
+    def enqueue(self, factory: Callable[[], Awaitable]) -> asyncio.Task:
+        """在之前的消息发送完成后执行
+        :param factory: 发送消息的无参数协程函数
+        """
+        previous = self._last
+
+        async def send():
+            if previous is not None:
+                # 前一条消息发送失败不影响后续消息
+                await asyncio.wait([previous])
+            result = await factory()
+            self.sent += 1
+            self.results.append(result)
+            return result
+
+        task = self._last = asyncio.ensure_future(send())
+        self._tasks.append(task)
+        return task
+
+    async def flush(self):
+        """发送已合并的文字并等待所有消息发送完成，有消息发送失败时抛出第一个异常"""
+        self.flush_pending()
+        tasks, self._tasks = self._tasks, []
+        if not tasks:
+            return
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, BaseException):
+                raise result
+
+    async def __aenter__(self) -> "OutboundBatch":
+        self._token = current_batch.set(self)
+        return self
+
+    async def __aexit__(self, *args):
+        current_batch.reset(self._token)  # type: ignore
+        await self.flush()
+
+
+current_batch: ContextVar[Optional[OutboundBatch]] = ContextVar(
+    "current_batch", default=None
+)
 
 
 class _S:
@@ -164,21 +324,46 @@ class _S:
         """发送文字
         :param text: 发送的文字内容
         :param at: 是否要艾特该用户
+
+        在``S.batch``中调用时只加入待发送的消息，不等待发送完成，返回None
         """
         s = self._s
-        async with Action(s._bot) as action:
-            if s._is_private:
-                return await action.sendPrivateText(s._user_id, s._group_id, text)
+        action = Action.shared(s._bot)
+        if s._is_private:
+            key = (s._bot, "private", s._group_id, s._user_id)
+            send = functools.partial(action.sendPrivateText, s._user_id, s._group_id)
+        else:
+            if s._group_id:
+                key = (s._bot, "group", s._group_id, s._user_id if at else 0)
+                send = functools.partial(
+                    action.sendGroupText,
+                    s._group_id,
+                    atUser=s._user_id if at else 0,
+                    atUserNick=s._user_name,
+                )
             else:
-                if s._group_id:
-                    return await action.sendGroupText(
-                        s._group_id,
-                        text,
-                        s._user_id if at else 0,
-                        s._user_name,
-                    )
-                else:
-                    return await action.sendFriendText(s._user_id, text)
+                key = (s._bot, "friend", s._user_id)
+                send = functools.partial(action.sendFriendText, s._user_id)
+
+        if (batch := current_batch.get()) is not None:
+            batch.add_text(key, send, text)
+            return None
+        return await send(text)
+
+    def batch(self, window: float = 0, separator: str = "\n") -> OutboundBatch:
+        """合并发送文字，发给同一目标的连续文字合并为一条消息，减少请求次数
+
+        .. code-block:: python
+
+            async with S.batch():
+                await S.text("第一行")
+                await S.text("第二行")
+            # 退出时发送: "第一行\\n第二行"
+
+        :param window: 时间窗口(秒), 第一条文字加入后最多等待的时间，为0时直到退出才发送
+        :param separator: 合并文字时使用的分隔符
+        """
+        return OutboundBatch(window, separator)
 
     async def image(
         self, data: _T_Data, text: str = "", at: bool = False, type: int = 0
@@ -192,42 +377,43 @@ class _S:
         :param type: 发送内容的类型, 默认自动判断，可选值为 S.TYPE_?
         """
 
-        if type not in (
-            TYPE_URL,
-            TYPE_MD5,
-            TYPE_BASE64,
-            TYPE_PATH,
-        ):
-            type, data = _resolve_data_type(data)
+        media = Media.resolve(data, type)
 
         s = self._s
-        async with Action(s._bot) as action:
-            if s._is_private:
+        action = Action.shared(s._bot)
+        if s._is_private:
+            send = functools.partial(
+                action.sendPrivatePic, s._user_id, s._group_id, text=text
+            )
+        else:
+            if s._group_id:
                 send = functools.partial(
-                    action.sendPrivatePic, s._user_id, s._group_id, text=text
+                    action.sendGroupPic,
+                    s._group_id,
+                    text=text,
+                    atUser=s._user_id if at else 0,
+                    atUserNick=s._user_name if at else "",
                 )
             else:
-                if s._group_id:
-                    send = functools.partial(
-                        action.sendGroupPic,
-                        s._group_id,
-                        text=text,
-                        atUser=s._user_id if at else 0,
-                        atUserNick=s._user_name if at else "",
-                    )
-                else:
-                    send = functools.partial(
-                        action.sendFriendPic, s._user_id, text=text
-                    )
-
-            if type == TYPE_URL:
-                return await send(url=data)  # type: ignore
-            elif type == TYPE_BASE64:
-                return await send(base64=data)  # type: ignore
-            elif type == TYPE_MD5:
-                return await send(md5=data)  # type: ignore
-            elif type == TYPE_PATH:
-                return await send(base64=file_to_base64(data))  # type: ignore
+                send = functools.partial(action.sendFriendPic, s._user_id, text=text)
+
+        if (batch := current_batch.get()) is not None:
+            # 保证图片在之前的文字之后发送
+            await batch.flush()
+
+        if media.type == TYPE_URL:
+            return await send(url=media.source)  # type: ignore
+        elif media.type == TYPE_MD5:
+            return await send(md5=media.source)  # type: ignore
+        elif media.type == TYPE_PATH and action.shared_fs:
+            # 服务端可以直接读取该文件，无需编码, 相对路径需转换为绝对路径
+            return await send(path=str(Path(media.source).resolve()))  # type: ignore
+        # 大文件编码比较耗时，不阻塞事件循环
+        if media.needs_encoding:
+            b64 = await asyncio.get_running_loop().run_in_executor(None, media.base64)
+        else:
+            b64 = media.base64()
+        return await send(base64=b64)  # type: ignore
 
     async def sleep(self, delay: float):
         """A shortcut of asyncio.sleep"""
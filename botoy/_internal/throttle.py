@@ -0,0 +1,255 @@
+"""出站请求调度(限流)
+
+所有经过``Action.baseRequest``的请求都会先向调度器申请令牌。
+
+默认调度器``TokenBucketScheduler``使用令牌桶算法，分四类预算:
+
+1. 每个机器人QQ一个桶，所有写操作(发送消息、群管理等)都会消耗
+2. 每个发送目标(群/好友/私聊)一个桶，仅发送消息消耗
+3. 每个机器人QQ一个查询桶，仅只读查询(如获取群列表)消耗，不占用发送预算
+4. 每个机器人QQ一个上传桶，仅上传资源消耗，不占用发送预算
+
+配置项(botoy.json)，rate 为每秒补充令牌数，burst 为桶容量(允许的突发数)，rate<=0 表示不限制::
+
+    {
+      "action.throttle.enabled": true,
+      "action.throttle.bot_rate": 2,
+      "action.throttle.bot_burst": 5,
+      "action.throttle.target_rate": 1,
+      "action.throttle.target_burst": 3,
+      "action.throttle.query_rate": 5,
+      "action.throttle.query_burst": 10,
+      "action.throttle.upload_rate": 3,
+      "action.throttle.upload_burst": 9,
+      "action.throttle.bots": {"123456": {"rate": 5, "burst": 10}}
+    }
+
+``bots``为单独设置的机器人发送预算，未设置的机器人使用``bot_rate``和``bot_burst``
+"""
+
+import asyncio
+import threading
+from time import monotonic as clock
+from typing import Dict, Optional, Tuple
+
+from .config import jconfig
+
+# 发送消息的指令
+SEND_CMDS = {"MessageSvc.PbSendMsg"}
+# 只读查询指令，payload 为空的请求(GET)也视为查询
+QUERY_CMDS = {
+    "GetGroupLists",
+    "GetGroupMemberLists",
+    "QueryUinByUid",
+    "GetClientKey",
+    "GetPSKey",
+}
+# 上传资源指令
+UPLOAD_CMDS = {"PicUp.DataUp"}
+
+KIND_SEND = "send"
+KIND_QUERY = "query"
+KIND_UPLOAD = "upload"
+KIND_OTHER = "other"
+
+
+def classify(payload: Optional[dict]) -> Tuple[str, Optional[Tuple[int, int]]]:
+    """判断请求类型
+    :return: (请求类型, 发送目标(ToType, ToUin))，非发送请求目标为None
+    """
+    if not payload:
+        return KIND_QUERY, None
+    cmd = payload.get("CgiCmd")
+    if cmd in SEND_CMDS:
+        request = payload.get("CgiRequest") or {}
+        return KIND_SEND, (request.get("ToType", 0), request.get("ToUin", 0))
+    if cmd in QUERY_CMDS:
+        return KIND_QUERY, None
+    if cmd in UPLOAD_CMDS:
+        return KIND_UPLOAD, None
+    return KIND_OTHER, None
+
+
+class TokenBucket:
+    """令牌桶
+
+    令牌允许透支，透支部分按速率换算成等待时间，等待者按申请顺序依次放行，
+    不依赖事件循环，所以在``sync_run``等新建的事件循环中也能共用
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "lock")
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: 每秒补充的令牌数, <=0 表示不限制
+        :param capacity: 桶容量，即允许的突发数
+        """
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float = 1) -> float:
+        """预占令牌，返回需要等待的秒数"""
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            self._refill(clock())
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    @property
+    def idle(self) -> bool:
+        """桶是否已满，满桶可以随时丢弃"""
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            self._refill(clock())
+            return self.tokens >= self.capacity
+
+
+class SendScheduler:
+    """出站请求调度器，自定义调度器需继承该类并实现``acquire``"""
+
+    async def acquire(self, qq: int, payload: Optional[dict]) -> None:
+        """请求发出前调用，返回即表示放行
+        :param qq: 执行请求的机器人QQ
+        :param payload: 请求体, GET 请求为None
+        """
+
+
+class TokenBucketScheduler(SendScheduler):
+    # 目标桶超过该数目时清理满桶
+    MAX_TARGET_BUCKETS = 1024
+
+    def __init__(
+        self,
+        bot_rate: float = 2,
+        bot_burst: float = 5,
+        target_rate: float = 1,
+        target_burst: float = 3,
+        query_rate: float = 5,
+        query_burst: float = 10,
+        upload_rate: float = 3,
+        upload_burst: float = 9,
+        bots: Optional[Dict[int, Tuple[float, float]]] = None,
+    ):
+        """
+        :param bots: 单独设置的机器人发送预算 {QQ: (rate, burst)}
+        """
+        self.bot_rate = bot_rate
+        self.bot_burst = bot_burst
+        self.target_rate = target_rate
+        self.target_burst = target_burst
+        self.query_rate = query_rate
+        self.query_burst = query_burst
+        self.upload_rate = upload_rate
+        self.upload_burst = upload_burst
+        self.bot_budgets: Dict[int, Tuple[float, float]] = dict(bots or {})
+
+        self._bot_buckets: Dict[int, TokenBucket] = {}
+        self._query_buckets: Dict[int, TokenBucket] = {}
+        self._upload_buckets: Dict[int, TokenBucket] = {}
+        self._target_buckets: Dict[Tuple[int, int, int], TokenBucket] = {}
+
+    @classmethod
+    def from_config(cls) -> "TokenBucketScheduler":
+        config = jconfig.get_configuration("action.throttle")
+        return cls(
+            bot_rate=config.get("bot_rate", 2),
+            bot_burst=config.get("bot_burst", 5),
+            target_rate=config.get("target_rate", 1),
+            target_burst=config.get("target_burst", 3),
+            query_rate=config.get("query_rate", 5),
+            query_burst=config.get("query_burst", 10),
+            upload_rate=config.get("upload_rate", 3),
+            upload_burst=config.get("upload_burst", 9),
+            bots={
+                int(qq): (
+                    budget.get("rate", config.get("bot_rate", 2)),
+                    budget.get("burst", config.get("bot_burst", 5)),
+                )
+                for qq, budget in (config.get("bots") or {}).items()
+            },
+        )
+
+    def set_bot_budget(self, qq: int, rate: float, burst: float):
+        """单独设置机器人的发送预算
+        :param qq: 机器人QQ
+        :param rate: 每秒补充令牌数, <=0 表示不限制
+        :param burst: 桶容量
+        """
+        self.bot_budgets[qq] = (rate, burst)
+        self._bot_buckets.pop(qq, None)
+
+    def _bucket(self, buckets: dict, key, rate: float, burst: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def _cleanup_targets(self):
+        if len(self._target_buckets) <= self.MAX_TARGET_BUCKETS:
+            return
+        for key, bucket in list(self._target_buckets.items()):
+            if bucket.idle:
+                del self._target_buckets[key]
+
+    def reserve(self, qq: int, payload: Optional[dict]) -> float:
+        """预占令牌，返回需要等待的秒数"""
+        kind, target = classify(payload)
+        if kind == KIND_QUERY:
+            return self._bucket(
+                self._query_buckets, qq, self.query_rate, self.query_burst
+            ).reserve()
+        if kind == KIND_UPLOAD:
+            return self._bucket(
+                self._upload_buckets, qq, self.upload_rate, self.upload_burst
+            ).reserve()
+
+        rate, burst = self.bot_budgets.get(qq, (self.bot_rate, self.bot_burst))
+        delay = self._bucket(self._bot_buckets, qq, rate, burst).reserve()
+        if target is not None:
+            self._cleanup_targets()
+            delay = max(
+                delay,
+                self._bucket(
+                    self._target_buckets,
+                    (qq, *target),
+                    self.target_rate,
+                    self.target_burst,
+                ).reserve(),
+            )
+        return delay
+
+    async def acquire(self, qq: int, payload: Optional[dict]) -> None:
+        delay = self.reserve(qq, payload)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+_scheduler: Optional[SendScheduler] = None
+
+
+def get_scheduler() -> SendScheduler:
+    """获取全局默认调度器"""
+    global _scheduler
+    if _scheduler is None:
+        if jconfig.get_configuration("action.throttle").get("enabled", True):
+            _scheduler = TokenBucketScheduler.from_config()
+        else:
+            _scheduler = SendScheduler()
+    return _scheduler
+
+
+def set_scheduler(scheduler: SendScheduler):
+    """替换全局默认调度器"""
+    global _scheduler
+    _scheduler = scheduler
@@ -1,12 +1,16 @@
 """提供框架所需的通用函数"""
 
 import asyncio
-import base64
+import binascii
+import os
 import re
+import struct
 import warnings
 from io import BytesIO
 from pathlib import Path
-from typing import Optional, Tuple, Union
+from typing import BinaryIO, Optional, Tuple, Union
+
+from .cache import TTLCache
 
 
 def to_address(host, port) -> str:
@@ -22,11 +26,61 @@ def check_schema(url: str) -> str:
     return url
 
 
+# 每次编码的数据长度，需为3的倍数，这样各段编码结果可以直接拼接
+_ENCODE_CHUNK_SIZE = 3 * 256 * 1024
+# 缓存编码结果的文件大小上限
+_MEMO_MAX_FILE_SIZE = 8 * 1024 * 1024
+# (路径, 修改时间, 大小) => base64
+_file_base64_cache = TTLCache(maxsize=16, ttl=600)
+
+
+def _read_full(stream: BinaryIO, size: int) -> bytes:
+    """读取指定长度, 只有读到末尾时才会少于该长度"""
+    data = stream.read(size)
+    if not data or len(data) == size:
+        return data
+    buf = bytearray(data)
+    while len(buf) < size and (more := stream.read(size - len(buf))):
+        buf.extend(more)
+    return bytes(buf)
+
+
+def stream_to_base64(stream: BinaryIO, size: Optional[int] = None) -> str:
+    """分段读取并编码为base64，不需要同时保存完整的原始数据
+    :param stream: 二进制数据流
+    :param size: 数据长度, 已知时直接分配结果所需的内存
+    """
+    if size is None:
+        parts = []
+        while chunk := _read_full(stream, _ENCODE_CHUNK_SIZE):
+            parts.append(binascii.b2a_base64(chunk, newline=False))
+        return b"".join(parts).decode()
+
+    out = bytearray((size + 2) // 3 * 4)
+    pos = 0
+    while chunk := _read_full(stream, _ENCODE_CHUNK_SIZE):
+        encoded = binascii.b2a_base64(chunk, newline=False)
+        out[pos : pos + len(encoded)] = encoded
+        pos += len(encoded)
+    if pos == len(out):
+        return out.decode()
+    return out[:pos].decode()  # 读取过程中文件被修改
+
+
 def file_to_base64(path):
-    """获取文件base64编码"""
+    """获取文件base64编码
+
+    分段编码，并按(路径, 修改时间, 大小)缓存较小文件的结果
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if (cached := _file_base64_cache.get(key)) is not None:
+        return cached
     with open(path, "rb") as f:
-        content = f.read()
-    return base64.b64encode(content).decode()
+        data = stream_to_base64(f, stat.st_size)
+    if stat.st_size <= _MEMO_MAX_FILE_SIZE:
+        _file_base64_cache.set(key, data)
+    return data
 
 
 def bind_contextvar(contextvar):
@@ -126,11 +180,112 @@ except ImportError:
             return None
 
 
+# 读取文件头的长度，绝大部分图片在该范围内就能确定尺寸
+IMAGE_HEADER_SIZE = 64 * 1024
+
+_JPEG_SOF_MARKERS = frozenset(
+    (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+)
+
+
+def image_format(header: bytes) -> Optional[str]:
+    """根据文件头判断图像格式，支持 png/jpeg/gif/webp/bmp，其他返回None"""
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header.startswith(b"\xff\xd8"):
+        return "jpeg"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    if header.startswith(b"BM"):
+        return "bmp"
+    return None
+
+
+def _probe_jpeg(data: bytes) -> Optional[Tuple[int, int]]:
+    idx, length = 2, len(data)
+    while idx + 4 <= length:
+        if data[idx] != 0xFF:
+            return None
+        marker = data[idx + 1]
+        if marker == 0xFF:  # 填充字节
+            idx += 1
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            if idx + 9 > length:
+                return None
+            h, w = struct.unpack(">HH", data[idx + 5 : idx + 9])
+            return h, w
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:  # 无长度字段
+            idx += 2
+            continue
+        idx += 2 + struct.unpack(">H", data[idx + 2 : idx + 4])[0]
+    return None
+
+
+def _probe_webp(data: bytes) -> Optional[Tuple[int, int]]:
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        w, h = struct.unpack("<HH", data[26:30])
+        return h & 0x3FFF, w & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25:
+        bits = struct.unpack("<I", data[21:25])[0]
+        return ((bits >> 14) & 0x3FFF) + 1, (bits & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        w = int.from_bytes(data[24:27], "little") + 1
+        h = int.from_bytes(data[27:30], "little") + 1
+        return h, w
+    return None
+
+
+def probe_image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """只解析文件头获取图像尺寸，数据可以只是文件开头的一部分
+    :param data: 图像二进制数据(或其开头部分)
+    :return: (长, 宽)，格式不支持或数据不足时返回None
+    """
+    fmt = image_format(data[:16])
+    try:
+        if fmt == "png" and len(data) >= 24:
+            w, h = struct.unpack(">II", data[16:24])
+            return h, w
+        if fmt == "gif" and len(data) >= 10:
+            w, h = struct.unpack("<HH", data[6:10])
+            return h, w
+        if fmt == "bmp" and len(data) >= 26:
+            if struct.unpack("<I", data[14:18])[0] == 12:
+                w, h = struct.unpack("<HH", data[18:22])
+            else:
+                w, h = struct.unpack("<ii", data[18:26])
+            return abs(h), w
+        if fmt == "webp":
+            return _probe_webp(data)
+        if fmt == "jpeg":
+            return _probe_jpeg(data)
+    except struct.error:
+        pass
+    return None
+
+
 def get_image_size(
     target: Union[bytes, BytesIO, str, Path]
 ) -> Optional[Tuple[int, int]]:
     """获取图像尺寸
+
+    优先解析文件头(png/jpeg/gif/webp/bmp)，其他格式才使用opencv或pillow解码
+
     :param target: 目标图像。接收图像路径或图像二进制数据
     :return: (长, 宽)
     """
+    if isinstance(target, (str, Path)):
+        with open(target, "rb") as f:
+            header = f.read(IMAGE_HEADER_SIZE)
+            size = probe_image_size(header)
+            if size is None and image_format(header) is not None:
+                size = probe_image_size(header + f.read())
+    else:
+        data = target.getvalue() if isinstance(target, BytesIO) else target
+        size = probe_image_size(data)
+    if size is not None:
+        return size
     return _get_image_size(target)
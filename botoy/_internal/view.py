@@ -0,0 +1,96 @@
+"""原始数据的惰性视图
+
+用于替代pydantic模型读取消息数据，不做任何校验，只在访问属性时才包装对应的下一层数据。
+指定模型后，枚举字段按模型转换为对应的枚举，与模型的取值保持一致
+"""
+
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+from . import jsonlib
+
+
+@lru_cache(maxsize=None)
+def _field_types(model: type) -> Dict[str, type]:
+    """模型中类型为模型或枚举的字段, 字段名 => 类型(列表字段为元素类型)"""
+    types = {}
+    for name, field in model.__fields__.items():
+        field_type = field.type_
+        if isinstance(field_type, type) and issubclass(field_type, (BaseModel, Enum)):
+            types[name] = field_type
+    return types
+
+
+def wrap(value: Any, field_type: Optional[type] = None) -> Any:
+    """包装字段的值
+    :param value: 原始值
+    :param field_type: 字段在模型中的类型
+    """
+    if isinstance(value, dict):
+        if field_type is not None and issubclass(field_type, BaseModel):
+            return DataView(value, field_type)
+        return DataView(value)
+    if isinstance(value, list):
+        return [wrap(item, field_type) for item in value]
+    if field_type is not None and issubclass(field_type, Enum):
+        try:
+            return field_type(value)
+        except ValueError:
+            # 不做校验，模型中没有的取值保持原样
+            return value
+    return value
+
+
+class DataView:
+    """字典数据的只读视图
+
+    - ``view.Key`` 等于 ``data.get("Key")``，不存在的字段返回None(与模型中可选字段默认值一致)
+    - 字典包装为``DataView``, 列表中的字典同样被包装
+    - 指定模型时，枚举字段转换为模型中的枚举
+    - 访问过的字段会被缓存
+    """
+
+    __slots__ = ("_data", "_model", "_cache")
+
+    def __init__(self, data: dict, model: Optional[type] = None):
+        """
+        :param data: 原始数据
+        :param model: 对应的pydantic模型，用于转换枚举字段
+        """
+        self._data = data
+        self._model = model
+        self._cache: Optional[dict] = None
+
+    def __getattr__(self, name: str) -> Any:
+        # 只有在__slots__中找不到时才会调用
+        if name.startswith("__"):
+            raise AttributeError(name)
+        cache = self._cache
+        if cache is None:
+            cache = self._cache = {}
+        elif name in cache:
+            return cache[name]
+        field_type = _field_types(self._model).get(name) if self._model else None
+        value = cache[name] = wrap(self._data.get(name), field_type)
+        return value
+
+    def dict(self) -> dict:
+        """原始数据"""
+        return self._data
+
+    def json(self, indent: Optional[int] = None) -> str:
+        """原始数据的JSON字符串
+        :param indent: 缩进
+        """
+        return jsonlib.dumps(self._data, indent)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, DataView):
+            return self._data == other._data
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"DataView({self._data!r})"
@@ -0,0 +1,166 @@
+"""接收函数执行监控
+
+登记正在执行的接收函数，定时检查，执行时间超过阈值时打印其当前调用栈(每次执行只打印一次)，
+用于定位卡住的插件。超时时间到达后异步接收函数会被取消，同步接收函数所在的线程会被隔离，
+见``Receiver._wait_task``、``Receiver._abandon``和``WorkerExecutor.quarantine``
+
+配置项(botoy.json)::
+
+    {
+      "receiver.timeout": 0,            // 接收函数执行超时时间(秒)，0为不限制，可通过 mark_recv(timeout=...) 单独设置
+      "receiver.slow_threshold": 30,    // 执行超过该时间(秒)时打印调用栈，0为关闭
+      "receiver.watchdog_interval": 5   // 检查间隔(秒)
+    }
+"""
+
+import asyncio
+import sys
+import time
+import traceback
+from typing import List, Optional, Set
+
+from .config import jconfig
+from .log import logger
+from .metrics import RECEIVER_SLOW, RECEIVER_TIMEOUTS, metrics
+
+
+def coroutine_stack(coro) -> str:
+    """协程当前的完整调用栈
+
+    ``Task.print_stack``只包含最外层的协程，这里沿着``cr_await``找到正在等待的最内层协程
+    """
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append((frame, frame.f_lineno))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return "".join(traceback.format_list(traceback.StackSummary.extract(frames)))
+
+
+class Execution:
+    """一次正在进行的执行"""
+
+    __slots__ = ("name", "task", "thread", "process", "started", "reported")
+
+    def __init__(self, name: str, task: Optional[asyncio.Future] = None):
+        self.name = name
+        # 异步接收函数的任务
+        self.task = task
+        # 同步接收函数所在线程的ident, 开始执行后设置
+        self.thread: Optional[int] = None
+        # 是否在进程池中执行
+        self.process = False
+        self.started = time.perf_counter()
+        self.reported = False
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def stack(self) -> str:
+        """当前调用栈"""
+        if self.task is not None:
+            if not isinstance(self.task, asyncio.Task):
+                return ""
+            return coroutine_stack(self.task.get_coro())
+        if self.process:
+            return "进程池中执行，无法获取调用栈"
+        if self.thread is None:
+            return "等待线程执行"
+        frame = sys._current_frames().get(self.thread)
+        if frame is None:
+            return ""
+        return "".join(traceback.format_stack(frame))
+
+
+class HandlerWatchdog:
+    """接收函数执行监控, 所有接收函数共享"""
+
+    def __init__(
+        self, timeout: float = 0, slow_threshold: float = 30, interval: float = 5
+    ):
+        """
+        :param timeout: 默认的执行超时时间(秒), 0为不限制
+        :param slow_threshold: 执行超过该时间(秒)时打印调用栈，0为关闭
+        :param interval: 检查间隔(秒)
+        """
+        self.timeout = timeout
+        self.slow_threshold = slow_threshold
+        self.interval = interval
+        self.slow = 0
+        self.timeouts = 0
+        self._running: Set[Execution] = set()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def from_config(cls) -> "HandlerWatchdog":
+        config = jconfig.get_configuration("receiver")
+        return cls(
+            timeout=config.get("timeout", 0),
+            slow_threshold=config.get("slow_threshold", 30),
+            interval=config.get("watchdog_interval", 5),
+        )
+
+    def track(self, name: str, task: Optional[asyncio.Future] = None) -> Execution:
+        """登记一次执行, 只能在事件循环中调用
+        :param name: 接收函数名称
+        :param task: 异步接收函数的任务
+        """
+        execution = Execution(name, task)
+        self._running.add(execution)
+        if self.slow_threshold > 0:
+            loop = asyncio.get_running_loop()
+            if self._timer is None or self._loop is not loop:
+                self._loop = loop
+                self._timer = loop.call_later(self.interval, self._check, loop)
+        return execution
+
+    def done(self, execution: Execution):
+        self._running.discard(execution)
+
+    def running(self) -> List[Execution]:
+        """正在进行的执行，按开始时间排序"""
+        return sorted(self._running, key=lambda e: e.started)
+
+    def report_timeout(self, execution: Execution, timeout: float, action: str):
+        """记录一次超时
+        :param action: 对超时执行的处理，用于日志
+        """
+        self.timeouts += 1
+        if metrics.enabled:
+            RECEIVER_TIMEOUTS.labels(execution.name).inc()
+        logger.warning(
+            f"接收函数[{execution.name}]执行超过{timeout}秒，{action}，当前调用栈：\n"
+            + execution.stack()
+        )
+
+    def _check(self, loop: asyncio.AbstractEventLoop):
+        if loop is not self._loop:
+            return
+        self._timer = None
+        for execution in list(self._running):
+            if execution.reported or execution.elapsed < self.slow_threshold:
+                continue
+            execution.reported = True
+            self.slow += 1
+            if metrics.enabled:
+                RECEIVER_SLOW.labels(execution.name).inc()
+            logger.warning(
+                f"接收函数[{execution.name}]已执行{execution.elapsed:.1f}秒，当前调用栈：\n"
+                + execution.stack()
+            )
+        if self._running and not loop.is_closed():
+            self._timer = loop.call_later(self.interval, self._check, loop)
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._running),
+            "slow": self.slow,
+            "timeouts": self.timeouts,
+        }
+
+
+watchdog = HandlerWatchdog.from_config()
@@ -0,0 +1,52 @@
+"""测试用的数据包"""
+
+
+def group_packet(text, group=100, user=200, bot=1):
+    return {
+        "CurrentPacket": {
+            "EventName": "ON_EVENT_GROUP_NEW_MSG",
+            "EventData": {
+                "MsgHead": {
+                    "FromUin": group,
+                    "ToUin": bot,
+                    "FromType": 2,
+                    "SenderUin": user,
+                    "SenderNick": "nick",
+                    "MsgType": 82,
+                    "C2cCmd": 0,
+                    "MsgSeq": 1,
+                    "MsgTime": 1,
+                    "MsgRandom": 1,
+                    "MsgUid": 1,
+                    "GroupInfo": {"GroupCode": group, "GroupName": "g"},
+                },
+                "MsgBody": {"SubMsgType": 0, "Content": text},
+            },
+        },
+        "CurrentQQ": bot,
+    }
+
+
+def friend_packet(text, user=200, bot=1):
+    return {
+        "CurrentPacket": {
+            "EventName": "ON_EVENT_FRIEND_NEW_MSG",
+            "EventData": {
+                "MsgHead": {
+                    "FromUin": user,
+                    "ToUin": bot,
+                    "FromType": 1,
+                    "SenderUin": user,
+                    "SenderNick": "nick",
+                    "MsgType": 166,
+                    "C2cCmd": 11,
+                    "MsgSeq": 1,
+                    "MsgTime": 1,
+                    "MsgRandom": 1,
+                    "MsgUid": 1,
+                },
+                "MsgBody": {"SubMsgType": 0, "Content": text},
+            },
+        },
+        "CurrentQQ": bot,
+    }
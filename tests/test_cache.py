@@ -0,0 +1,98 @@
+import asyncio
+import os
+
+from botoy._internal.cache import SingleFlight, UploadCache
+
+
+def test_upload_cache_key(tmp_path):
+    cache = UploadCache()
+    key = cache.key(1, 2, base64="aGVsbG8=")
+    assert key == cache.key(1, 2, base64="aGVsbG8=\n")
+    assert key != cache.key(1, 1, base64="aGVsbG8=")
+    assert key != cache.key(2, 2, base64="aGVsbG8=")
+
+    # 链接默认不缓存
+    assert cache.key(1, 2, url="http://example.com/a.png") is None
+    assert UploadCache(cache_url=True).key(1, 2, url="http://example.com/a.png")
+
+    file = tmp_path / "a.png"
+    assert cache.key(1, 2, path=str(file)) is None
+    file.write_bytes(b"a")
+    key = cache.key(1, 2, path=str(file))
+    assert key and key == cache.key(1, 2, path=str(file))
+    # 文件内容变化后缓存失效
+    file.write_bytes(b"ab")
+    os.utime(file, ns=(0, 0))
+    assert cache.key(1, 2, path=str(file)) != key
+
+
+def test_upload_cache_disk(tmp_path):
+    cache = UploadCache(directory=tmp_path)
+    key = cache.key(1, 2, base64="aGVsbG8=")
+    assert cache.get(key) is None
+    cache.set(key, {"FileMd5": "md5"})
+    cache.update_size(key, (10, 20))
+
+    restored = UploadCache(directory=tmp_path)
+    assert restored.get(key) == {"resp": {"FileMd5": "md5"}, "size": [10, 20]}
+    assert UploadCache(ttl=-1, directory=tmp_path).get("other") is None
+
+
+def test_single_flight_shares_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["result"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"calls": 1, "shared": 4, "inflight": 0, "cached": 0}
+
+    # 未设置ttl时不缓存
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+def test_single_flight_ttl():
+    flight = SingleFlight()
+    results = iter([None, "result", "other"])
+
+    async def fetch():
+        return next(results)
+
+    async def main():
+        return [await flight.do("key", fetch, ttl=60) for _ in range(3)]
+
+    # None 表示请求失败，不缓存
+    assert asyncio.run(main()) == [None, "result", "result"]
+    flight.forget("key")
+    assert asyncio.run(main())[0] == "other"
+
+
+def test_single_flight_errors_not_cached():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError("failed")
+        return "result"
+
+    async def main():
+        results = await asyncio.gather(
+            flight.do("key", fetch, ttl=60),
+            flight.do("key", fetch, ttl=60),
+            return_exceptions=True,
+        )
+        assert all(isinstance(r, ValueError) for r in results)
+        return await flight.do("key", fetch, ttl=60)
+
+    assert asyncio.run(main()) == "result"
+    assert len(calls) == 2
@@ -0,0 +1,57 @@
+import re
+
+from packets import friend_packet, group_packet
+
+from botoy._internal.context import Context
+from botoy._internal.dispatch import DispatchIndex
+from botoy._internal.receiver import (
+    Receiver,
+    ReceiverFilter,
+    Session,
+    session_registry,
+)
+
+
+def receiver(**kwargs):
+    return Receiver(lambda: None, filter=ReceiverFilter(**kwargs))
+
+
+def test_flagged_patterns():
+    ignorecase = receiver(regex=re.compile("hello", re.I))
+    multiline = receiver(regex=re.compile("^world", re.M))
+    plain = receiver(regex="foo")
+    index = DispatchIndex([ignorecase, multiline, plain])
+
+    ctx = Context(group_packet("HELLO"))
+    assert ignorecase.filter.match(ctx)
+    assert index.match(ctx) == [ignorecase]
+    assert index.match(Context(group_packet("x\nworld"))) == [multiline]
+    assert index.match(Context(group_packet("FOO"))) == []
+
+
+def test_unmergeable_pattern_disables_prefilter():
+    r = receiver(regex="(?i)hello")
+    index = DispatchIndex([r, receiver(keyword="foo")])
+    assert index.match(Context(group_packet("HeLLo"))) == [r]
+
+
+def test_grouped_patterns_disable_prefilter():
+    grouped = receiver(regex="(x)y")
+    backref = receiver(regex=r"(a)\1")
+    index = DispatchIndex([grouped, backref])
+    assert index.match(Context(group_packet("aa"))) == [backref]
+    assert index.match(Context(group_packet("xy"))) == [grouped]
+    assert index.match(Context(group_packet("ab"))) == []
+
+
+def test_session_does_not_change_index():
+    r = receiver(groups=[100])
+    index = DispatchIndex([r])
+    session = Session("100-200", r, True, True, False, False)
+    session_registry.add(session)
+    try:
+        assert index.match(Context(friend_packet("hi"))) == [r]
+    finally:
+        session.finished = True
+    assert index.match(Context(friend_packet("hi"))) == []
+    assert index.match(Context(group_packet("hi", group=101))) == []
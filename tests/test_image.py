@@ -0,0 +1,63 @@
+import struct
+
+from botoy._internal.utils import get_image_size, image_format, probe_image_size
+
+
+def png(width, height):
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I4sII", 13, b"IHDR", width, height)
+
+
+def gif(width, height):
+    return b"GIF89a" + struct.pack("<HH", width, height)
+
+
+def bmp(width, height):
+    return b"BM" + bytes(12) + struct.pack("<Iii", 40, width, height)
+
+
+def jpeg(width, height):
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + bytes(14)
+    sof0 = b"\xff\xc0" + struct.pack(">HBHH", 17, 8, height, width)
+    return b"\xff\xd8" + app0 + sof0
+
+
+def webp(chunk, body):
+    return b"RIFF" + bytes(4) + b"WEBP" + chunk + bytes(4) + body
+
+
+def test_image_format():
+    assert image_format(png(1, 1)) == "png"
+    assert image_format(jpeg(1, 1)) == "jpeg"
+    assert image_format(gif(1, 1)) == "gif"
+    assert image_format(bmp(1, 1)) == "bmp"
+    assert image_format(webp(b"VP8X", bytes(10))) == "webp"
+    assert image_format(b"not an image") is None
+
+
+def test_probe_image_size():
+    assert probe_image_size(png(300, 200)) == (200, 300)
+    assert probe_image_size(gif(300, 200)) == (200, 300)
+    # 高度为负表示自上而下存储
+    assert probe_image_size(bmp(300, -200)) == (200, 300)
+    assert probe_image_size(jpeg(300, 200)) == (200, 300)
+
+    vp8 = bytes(3) + b"\x9d\x01\x2a" + struct.pack("<HH", 300, 200)
+    assert probe_image_size(webp(b"VP8 ", vp8)) == (200, 300)
+    vp8l = b"\x2f" + struct.pack("<I", (300 - 1) | ((200 - 1) << 14))
+    assert probe_image_size(webp(b"VP8L", vp8l)) == (200, 300)
+    vp8x = bytes(4) + (300 - 1).to_bytes(3, "little") + (200 - 1).to_bytes(3, "little")
+    assert probe_image_size(webp(b"VP8X", vp8x)) == (200, 300)
+
+
+def test_probe_incomplete_header():
+    assert probe_image_size(png(300, 200)[:20]) is None
+    assert probe_image_size(jpeg(300, 200)[:-2]) is None
+    assert probe_image_size(b"not an image") is None
+
+
+def test_get_image_size(tmp_path):
+    file = tmp_path / "a.png"
+    file.write_bytes(png(300, 200) + bytes(100))
+    assert get_image_size(file) == (200, 300)
+    assert get_image_size(str(file)) == (200, 300)
+    assert get_image_size(gif(300, 200)) == (200, 300)
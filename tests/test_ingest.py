@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from packets import friend_packet, group_packet
+
+from botoy._internal.ingest import (
+    POLICY_DROP_BY_GROUP,
+    POLICY_DROP_NEWEST,
+    POLICY_DROP_OLDEST,
+    IngestQueue,
+)
+
+
+def drain(queue):
+    async def main():
+        return [
+            (await queue.get())["CurrentPacket"]["EventData"]["MsgBody"]["Content"]
+            for _ in range(queue.queued)
+        ]
+
+    return asyncio.run(main())
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        IngestQueue(policy="drop_all")
+
+
+def test_drop_oldest():
+    queue = IngestQueue(maxsize=2, policy=POLICY_DROP_OLDEST)
+    assert all(queue.put(group_packet(text)) for text in "abc")
+    assert drain(queue) == ["b", "c"]
+    assert queue.stats() == {"received": 3, "queued": 0, "dropped": 1, "invalid": 0}
+
+
+def test_drop_newest():
+    queue = IngestQueue(maxsize=2, policy=POLICY_DROP_NEWEST)
+    assert [queue.put(group_packet(text)) for text in "abc"] == [True, True, False]
+    assert drain(queue) == ["a", "b"]
+    assert queue.stats()["dropped"] == 1
+
+
+def test_drop_by_group():
+    queue = IngestQueue(maxsize=3, policy=POLICY_DROP_BY_GROUP)
+    queue.put(group_packet("a1", group=1))
+    queue.put(group_packet("b1", group=2))
+    queue.put(group_packet("a2", group=1))
+    # 排队最多的群让出位置
+    assert queue.put(group_packet("c1", group=3))
+    assert drain(queue) == ["b1", "a2", "c1"]
+
+
+def test_friend_priority():
+    queue = IngestQueue(maxsize=2, policy=POLICY_DROP_OLDEST)
+    queue.put(group_packet("g1"))
+    queue.put(friend_packet("f1"))
+    # 队列满时先丢弃群消息
+    queue.put(friend_packet("f2"))
+    assert drain(queue) == ["f1", "f2"]
+
+    queue = IngestQueue(friend_priority=False)
+    queue.put(group_packet("g1"))
+    queue.put(friend_packet("f1"))
+    assert drain(queue) == ["g1", "f1"]
+
+
+def test_invalid_packet():
+    queue = IngestQueue()
+    assert not queue.put("{not json")
+    assert queue.put(b'{"CurrentPacket": {}}')
+    assert queue.stats() == {"received": 2, "queued": 1, "dropped": 0, "invalid": 1}
+
+
+def test_get_waits_for_put():
+    async def main():
+        queue = IngestQueue()
+        getter = asyncio.ensure_future(queue.get())
+        await asyncio.sleep(0)
+        assert not getter.done()
+        queue.put(group_packet("hi"))
+        return await asyncio.wait_for(getter, 1)
+
+    assert asyncio.run(main()) == group_packet("hi")
@@ -0,0 +1,40 @@
+import sys
+
+import pytest
+
+from botoy._internal import jsonlib
+
+
+@pytest.fixture(autouse=True)
+def restore_backend():
+    yield
+    jsonlib.set_backend()
+
+
+def test_unknown_backend():
+    backend = jsonlib.backend
+    with pytest.raises(ValueError):
+        jsonlib.set_backend("simplejson")
+    assert jsonlib.backend == backend
+
+
+def test_missing_backend_falls_back(monkeypatch):
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    monkeypatch.setitem(sys.modules, "ujson", None)
+    assert jsonlib.set_backend("orjson") == jsonlib.BACKEND_JSON
+    assert jsonlib.set_backend("ujson") == jsonlib.BACKEND_JSON
+    assert jsonlib.set_backend() == jsonlib.BACKEND_JSON
+
+
+@pytest.mark.parametrize(
+    "name", [jsonlib.BACKEND_AUTO, jsonlib.BACKEND_ORJSON, jsonlib.BACKEND_JSON]
+)
+def test_round_trip(name):
+    jsonlib.set_backend(name)
+    data = {"Content": "你好", "FromUin": 2**64}
+    assert jsonlib.loads(jsonlib.dumpb(data)) == data
+    assert jsonlib.loads(jsonlib.dumps(data)) == data
+    assert "你好" in jsonlib.dumps(data)
+    assert jsonlib.dumps({"a": 1}, indent=2) == '{\n  "a": 1\n}'
+    with pytest.raises(ValueError):
+        jsonlib.loads("{")
@@ -0,0 +1,149 @@
+import asyncio
+import gc
+
+import pytest
+from packets import friend_packet, group_packet
+
+from botoy._internal.context import Context, current_ctx
+from botoy._internal.receiver import (
+    LANE_GROUP,
+    LANE_GROUP_USER,
+    LANE_USER,
+    Receiver,
+    ReceiverOptions,
+    Session,
+    SessionRegistry,
+)
+
+events = []
+
+
+async def record():
+    ctx = current_ctx.get()
+    text = (ctx.g or ctx.f).text
+    events.append(("start", text))
+    # 先到的消息执行得更久
+    await asyncio.sleep(0.02 if text.endswith("1") else 0)
+    events.append(("end", text))
+
+
+def run(receiver, packets):
+    async def main():
+        tasks = []
+        for pkt in packets:
+            current_ctx.set(Context(pkt))
+            tasks.append(asyncio.ensure_future(receiver()))
+        await asyncio.gather(*tasks)
+
+    events.clear()
+    asyncio.run(main())
+    return [text for event, text in events if event == "end"]
+
+
+def test_lane_key():
+    g, f = Context(group_packet("", group=1, user=2)), Context(
+        friend_packet("", user=2)
+    )
+    assert ReceiverOptions().lane_key(g) is None
+    assert ReceiverOptions(lane=LANE_GROUP).lane_key(g) == ("g", 1)
+    assert ReceiverOptions(lane=LANE_USER).lane_key(g) == ("u", 2)
+    assert ReceiverOptions(lane=LANE_GROUP_USER).lane_key(g) == ("gu", 1, 2)
+    for lane in (LANE_GROUP, LANE_USER, LANE_GROUP_USER):
+        assert ReceiverOptions(lane=lane).lane_key(f) == ("u", 2)
+    with pytest.raises(ValueError):
+        ReceiverOptions(lane="bot")
+
+
+def test_lane_keeps_order():
+    packets = [group_packet("a1", group=1), group_packet("a2", group=1)]
+    assert run(Receiver(record), packets) == ["a2", "a1"]
+    receiver = Receiver(record, options=ReceiverOptions(lane=LANE_GROUP))
+    assert run(receiver, packets) == ["a1", "a2"]
+    assert not receiver.lanes
+
+
+def test_lanes_run_in_parallel():
+    receiver = Receiver(record, options=ReceiverOptions(lane=LANE_GROUP))
+    packets = [
+        group_packet("a1", group=1),
+        group_packet("b1", group=2),
+        group_packet("a2", group=1),
+    ]
+    assert run(receiver, packets) == ["a1", "b1", "a2"]
+    # 不同群不需要等待
+    assert events[:2] == [("start", "a1"), ("start", "b1")]
+
+    receiver = Receiver(record, options=ReceiverOptions(lane=LANE_GROUP_USER))
+    packets = [
+        group_packet("a1", group=1, user=1),
+        group_packet("b2", group=1, user=2),
+        group_packet("a3", group=1, user=1),
+    ]
+    assert run(receiver, packets) == ["b2", "a1", "a3"]
+
+
+def session(sid, multi_user=False, receiver=None):
+    receiver = receiver or Receiver(record, options=ReceiverOptions(session=False))
+    return Session(sid, receiver, True, True, multi_user, False)
+
+
+def test_session_route_keys():
+    assert SessionRegistry._route_keys(session("1-2")) == (("gu", 1, 2), ("u", 2))
+    assert SessionRegistry._route_keys(session("1", multi_user=True)) == (("g", 1),)
+    assert SessionRegistry._route_keys(session("2")) == (("u", 2),)
+
+
+def test_session_lookup():
+    registry = SessionRegistry()
+    user = session("1-2")
+    group = session("1", multi_user=True, receiver=user.receiver)
+    registry.add(user)
+    registry.add(group)
+    receiver = user.receiver
+
+    assert registry.lookup(receiver, Context(group_packet("", group=1, user=2))) is user
+    assert (
+        registry.lookup(receiver, Context(group_packet("", group=1, user=3))) is group
+    )
+    assert registry.lookup(receiver, Context(friend_packet("", user=2))) is user
+    assert registry.lookup(receiver, Context(friend_packet("", user=3))) is None
+    assert registry.lookup(Receiver(record), Context(friend_packet("", user=2))) is None
+    assert registry.receiver_ids(Context(friend_packet("", user=2))) == {id(receiver)}
+    assert registry.get(receiver, "1-2") is user
+
+    user.finished = True
+    assert registry.lookup(receiver, Context(friend_packet("", user=2))) is None
+    assert registry.get(receiver, "1-2") is None
+    assert len(registry) == 1
+
+
+def test_session_removed_when_collected():
+    registry = SessionRegistry()
+    s = session("2")
+    receiver = s.receiver
+    registry.add(s)
+    assert len(registry) == 1
+    del s
+    gc.collect()
+    assert len(registry) == 0
+    assert not registry.receiver_ids(Context(friend_packet("", user=2)))
+    assert not registry.sessions(receiver)
+
+
+def test_session_sweep():
+    async def main():
+        registry = SessionRegistry()
+        registry.SWEEP_INTERVAL = 0.01
+        s = session("2")
+        s.receiver.loop = asyncio.get_running_loop()
+        registry.add(s)
+        await asyncio.sleep(0.05)
+        assert len(registry) == 1
+        s.finished = True
+        await asyncio.sleep(0.05)
+        assert len(registry) == 0
+        # 没有会话后停止定时清理
+        await asyncio.sleep(0.05)
+        assert registry._sweeper is None
+
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+import pytest
+
+from botoy._internal.throttle import (
+    KIND_OTHER,
+    KIND_QUERY,
+    KIND_SEND,
+    KIND_UPLOAD,
+    TokenBucket,
+    TokenBucketScheduler,
+    classify,
+)
+
+
+def send_payload(to_uin, to_type=2):
+    return {
+        "CgiCmd": "MessageSvc.PbSendMsg",
+        "CgiRequest": {"ToUin": to_uin, "ToType": to_type, "Content": "hi"},
+    }
+
+
+def test_classify():
+    assert classify(None) == (KIND_QUERY, None)
+    assert classify({"CgiCmd": "GetGroupLists"}) == (KIND_QUERY, None)
+    assert classify({"CgiCmd": "PicUp.DataUp"}) == (KIND_UPLOAD, None)
+    assert classify({"CgiCmd": "SsoGroup.Op"}) == (KIND_OTHER, None)
+    assert classify(send_payload(100)) == (KIND_SEND, (2, 100))
+
+
+def test_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(rate=1, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert not bucket.idle
+    # 透支的令牌按顺序排队
+    assert bucket.reserve() == pytest.approx(1, abs=0.05)
+    assert bucket.reserve() == pytest.approx(2, abs=0.05)
+
+
+def test_bucket_unlimited():
+    bucket = TokenBucket(rate=0, capacity=1)
+    assert all(bucket.reserve() == 0 for _ in range(100))
+    assert bucket.idle
+
+
+def test_scheduler_limits_each_target():
+    scheduler = TokenBucketScheduler(bot_rate=0, target_rate=1, target_burst=1)
+    assert scheduler.reserve(1, send_payload(100)) == 0
+    assert scheduler.reserve(1, send_payload(100)) > 0
+    # 不同目标和不同机器人互不影响
+    assert scheduler.reserve(1, send_payload(101)) == 0
+    assert scheduler.reserve(1, send_payload(100, to_type=1)) == 0
+    assert scheduler.reserve(2, send_payload(100)) == 0
+
+
+def test_scheduler_queries_and_uploads_use_own_budget():
+    scheduler = TokenBucketScheduler(
+        bot_rate=1,
+        bot_burst=1,
+        query_rate=1,
+        query_burst=2,
+        upload_rate=1,
+        upload_burst=1,
+    )
+    assert scheduler.reserve(1, {"CgiCmd": "SsoGroup.Op"}) == 0
+    assert scheduler.reserve(1, {"CgiCmd": "SsoGroup.Op"}) > 0
+    assert scheduler.reserve(1, None) == 0
+    assert scheduler.reserve(1, {"CgiCmd": "GetGroupLists"}) == 0
+    assert scheduler.reserve(1, None) > 0
+    assert scheduler.reserve(1, {"CgiCmd": "PicUp.DataUp"}) == 0
+    assert scheduler.reserve(1, {"CgiCmd": "PicUp.DataUp"}) > 0
+
+
+def test_scheduler_bot_budget():
+    scheduler = TokenBucketScheduler(
+        bot_rate=1, bot_burst=1, target_rate=0, bots={1: (0, 1)}
+    )
+    assert all(scheduler.reserve(1, send_payload(100)) == 0 for _ in range(10))
+    assert scheduler.reserve(2, send_payload(100)) == 0
+    assert scheduler.reserve(2, send_payload(100)) > 0
+
+    scheduler.set_bot_budget(2, 0, 1)
+    assert scheduler.reserve(2, send_payload(100)) == 0
+    scheduler.set_bot_budget(1, 1, 1)
+    assert scheduler.reserve(1, send_payload(100)) == 0
+    assert scheduler.reserve(1, send_payload(100)) > 0